@@ -0,0 +1,165 @@
+"""Compute correlation between delta history and next delta,
+using load traces.
+
+Like corr_load, but for the deltas between consecutive cache lines (or pages)
+instead of the cache lines themselves, as spatial prefetchers (e.g. BO) use.
+Deltas are computed between consecutive loads (global), and between consecutive
+loads of the same PC (PC-localized), for the whole trace at once.
+The results are the same frequency histograms as corr_load's (and are saved
+to the same kind of result store), so they can be compared with the temporal results.
+
+Need to run from above corr/ directory. If you still get an error,
+try export PYTHONPATH=.
+"""
+
+import argparse
+import time
+import numpy as np
+from corr.corr_load import print_freqs, get_results
+from utils.corr_results import save_freqs
+from utils.count_table import count_freqs, extend_hash
+from utils.intern import load_interned_trace
+from utils.logging import Instrumentation, add_instrumentation_arguments, get_instrumentation
+
+
+def get_deltas(tags, groups=None):
+    """Get the deltas between consecutive tags (e.g. cache lines), or if groups
+    (e.g. PC ids) are given, between consecutive tags of the same group.
+
+    Returns (deltas, starts): deltas[t] is the delta into the t + 1'th tag (of
+    the tags sorted by group, if grouped), and starts[t] is the first delta of
+    its group (deltas[t] is only valid if starts[t] <= t).
+    """
+    tags = tags.astype(np.int64)
+    if groups is None:
+        deltas = np.diff(tags)
+        return deltas, np.zeros(len(deltas), dtype=np.int64)
+
+    order = np.argsort(groups, kind='stable')
+    tags, groups = tags[order], groups[order]
+    deltas = np.diff(tags)
+    # A delta between two groups is invalid: its group starts after it
+    new_group = groups[1:] != groups[:-1]
+    idx = np.arange(len(deltas), dtype=np.int64)
+    starts = np.maximum.accumulate(np.where(new_group, idx + 1, 0)) if len(deltas) else idx
+    return deltas, starts
+
+
+class DeltaCorrelationData(object):
+    """Track correlation between delta histories (triggers) and the next delta.
+
+    depth        : how many deltas to look ahead
+        - e.g. 1 = next delta, 2 = the second delta ahead, etc.
+    max_hist_len : number of prior deltas to consider as part of the trigger.
+        - Track all triggers of length 1 to max_hist_len (inclusive)
+    shift        : number of bits to cut-off for tracking
+        - 0 : cache line deltas
+        - 6 : page deltas
+    pc_localized : use the deltas between each PC's consecutive loads.
+    """
+    def __init__(self, depth, max_hist_len, shift=0, pc_localized=False):
+        self.depth = depth
+        self.max_hist_len = max_hist_len
+        self.shift = shift
+        self.pc_localized = pc_localized
+        self.freqs = {}
+        self.weighted_freqs = {}
+
+    def add_trace(self, trace):
+        """Count the delta correlations of a whole (interned) load trace,
+        all at once (with count_freqs)."""
+        tags = trace.lines[trace.line_ids] >> np.uint64(self.shift)
+        deltas, starts = get_deltas(tags, trace.pc_ids if self.pc_localized else None)
+
+        # As in corr_load, only deltas with a full delta history are counted.
+        # pos is each counted delta's index into deltas.
+        hist_size = self.max_hist_len + self.depth - 1
+        pos = np.flatnonzero(np.arange(len(deltas)) - starts >= hist_size)
+        next_deltas = deltas[pos]
+
+        # For every trigger, count how many times each delta shows up
+        # given the trigger
+        h = np.zeros(len(pos), dtype=np.uint64)
+        for i in range(1, self.max_hist_len + 1):
+            h = extend_hash(h, deltas[pos - self.depth - i + 1])
+            self.freqs[i], self.weighted_freqs[i] = count_freqs(h, next_deltas)
+        return len(pos)
+
+    def compute_freqs(self, weighted=False):
+        """Return the frequency histogram of each history length, i.e. for
+        each # of unique correlated deltas, the # of delta history triggers with
+        that many (or if weighted, the # of deltas for those triggers).
+        """
+        freqs = self.weighted_freqs if weighted else self.freqs
+        return {hist_len: dict(freqs[hist_len]) for hist_len in freqs}
+
+
+def get_argument_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('load_trace')
+    parser.add_argument('-d', '--depth', type=int, default=1)
+    parser.add_argument('-l', '--max-hist-len', type=int, default=4)
+    parser.add_argument('-o', '--output', type=str, default=None)
+    parser.add_argument('--cache', action='store_true')
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+
+    print('Arguments:')
+    print('    Load trace     :', args.load_trace)
+    print('    Depth          :', args.depth)
+    print('    Max history len:', args.max_hist_len)
+    print('    Output         :', args.output)
+    print('    Cache          :', args.cache)
+    print('    Metrics        :', args.metrics)
+    print('    Profile        :', args.profile)
+
+    return args
+
+
+def compute_delta_correlation(load_trace, depth, max_hist_len, output=None, cache=False, instr=None):
+    """Main delta correlation computation
+
+    output : path to save the frequency histograms to (as a .npz result store).
+    cache  : reuse (and save) the interned load trace (see utils.intern.load_interned_trace).
+    instr  : Instrumentation to time the stages of the run with.
+    """
+    instr = instr or Instrumentation()
+    start = time.time()
+    trackers = {
+        'Cache Line Deltas': DeltaCorrelationData(depth, max_hist_len),
+        'Page Deltas': DeltaCorrelationData(depth, max_hist_len, shift=6),
+        'PC Cache Line Deltas': DeltaCorrelationData(depth, max_hist_len, pc_localized=True),
+        'PC Page Deltas': DeltaCorrelationData(depth, max_hist_len, shift=6, pc_localized=True),
+    }
+
+    with instr.stage('parse'):
+        trace = load_interned_trace(load_trace, cache=cache)
+    instr.count('parse', len(trace))
+
+    with instr.stage('update'):
+        for name, tracker in trackers.items():
+            num_deltas = tracker.add_trace(trace)
+            print(f'{name}: {num_deltas} deltas counted')
+    instr.count('update', len(trace) * len(trackers))
+
+    results = get_results(trackers)
+    with instr.stage('results'):
+        for name, freqs in results.items():
+            print_freqs(freqs, name)
+
+    with instr.stage('write'):
+        if output:
+            save_freqs(output, results)
+    print('Time to run:', (time.time() - start) / 60, 'min')
+
+
+if __name__ == '__main__':
+    args = get_argument_parser()
+    instr = get_instrumentation('corr_delta', args)
+    compute_delta_correlation(
+        args.load_trace, args.depth, args.max_hist_len,
+        output=args.output,
+        cache=args.cache,
+        instr=instr
+    )
+    instr.report()
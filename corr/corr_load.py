@@ -6,35 +6,60 @@ try export PYTHONPATH=.
 """
 
 import argparse
+import os
 import time
+from utils.corr_results import save_freqs, save_checkpoint, load_checkpoint
 from utils.load import get_open_function
 from utils.load_trace import get_instructions
-from utils.logging import log_progress
+from utils.logging import (log_file_progress, get_file_fraction, Instrumentation,
+                           add_instrumentation_arguments, get_instrumentation)
+from utils.memo import add_memo_arguments, get_memo
+from utils.pc_history import PCHistoryPool
+from utils.sampling import (random_offsets, simpoint_intervals, get_offset_windows, get_slice_windows,
+                            gather_sampled_correlation_data, estimate_freqs, format_estimates)
 
+BATCH_SIZE = 4096 # Lines read / parsed at a time, when timing the stages
 
-def gather_correlation_data(f, cd, pcd):
+
+def gather_correlation_data(f, cd, pcd, start=0, checkpoint=None, checkpoint_interval=10000000,
+                            pc_trackers=(), instr=None):
     """Wrapper function to gather correlation data
-    from each address in the load trace."""
+    from each address in the load trace.
 
-    # Count number of lines
-    nlines = 0
-    for _ in f:
-        nlines += 1
-    f.seek(0)
+    The first start loads are skipped (e.g. if they were already
+    gathered before resuming from a checkpoint). If checkpoint is given,
+    it is called with the # of loads gathered every checkpoint_interval loads.
+    pc_trackers are PC-localized trackers, which are also given each load's PC.
+    The decompress / parse / update stages are timed with instr, if given.
 
+    Returns the total # of loads gathered.
+    """
+    instr = instr or Instrumentation()
     start_time = time.time()
-    for lnum, inst in enumerate(get_instructions(f)):
-        
-        # Periodically log progress
-        log_progress(lnum, nlines, start_time, interval=50000)
-        
-        # Add load to correlation tracker
-        addr = inst.addr
-        cd.add_addr(addr)
-        pcd.add_addr(addr)
+    num_loads = start
+    insts = instr.timed('parse', get_instructions(instr.timed('decompress', f, BATCH_SIZE), skip=start))
+    with instr.stage('update'):
+        for lnum, inst in enumerate(insts, start=start):
+
+            # Periodically log progress
+            log_file_progress(lnum, f, start_time, interval=50000, instr=instr)
+
+            # Periodically save a checkpoint
+            if checkpoint and lnum > start and lnum % checkpoint_interval == 0:
+                with instr.stage('checkpoint'):
+                    checkpoint(lnum)
+
+            # Add load to correlation tracker
+            addr = inst.addr
+            cd.add_addr(addr)
+            pcd.add_addr(addr)
+            for tracker in pc_trackers:
+                tracker.add_addr(addr, inst.pc)
+            num_loads = lnum + 1
         
     # Print time to run
     print('Time to run:', (time.time() - start_time) / 60, 'min')
+    return num_loads
 
 
 class CorrelationData(object):
@@ -47,10 +72,13 @@ class CorrelationData(object):
     shift            : number of bits to cut-off for tracking
         - 0 : cache line temporal correlation
         - 6 : page temporal correlation
+    pc_localized     : use each PC's prior load addresses as the history, instead of
+                       the prior global ones (kept in a PCHistoryPool).
     """
-    def __init__(self, depth, max_hist_len, shift=0):
+    def __init__(self, depth, max_hist_len, shift=0, pc_localized=False):
         self.depth = depth
         self.hist = []
+        self.pc_hist = PCHistoryPool(max_hist_len + depth - 1) if pc_localized else None
         # We're considering the correlation for triggers of length 1 to max_hist_len (inclusive)
         self.max_hist_len = max_hist_len
         self.data = {i: {} for i in range(1, max_hist_len + 1)}
@@ -59,52 +87,85 @@ class CorrelationData(object):
         # 6 corresponds to page temporal correlation
         self.shift = shift
 
-    def add_addr(self, addr):
+        # Total # of addresses seen for each history trigger, and the
+        # (weighted) frequency histograms, maintained as the counts change.
+        self.totals = {i: {} for i in range(1, max_hist_len + 1)}
+        self.freqs = {i: {} for i in range(1, max_hist_len + 1)}
+        self.weighted_freqs = {i: {} for i in range(1, max_hist_len + 1)}
+
+    def add_addr(self, addr, pc=None):
         # Only take some bits of the full address
         addr_tag = self.addr_tag(addr)
+        hist = self.pc_hist.get(pc) if self.pc_hist is not None else self.hist
 
-        if len(self.hist) == self.max_hist_len + self.depth - 1:
+        if len(hist) == self.max_hist_len + self.depth - 1:
             # For every history length, keep track of how many times addr_tag shows up
             # given the history
             for hist_len in self.data:
                 # tag is the history trigger
-                tag = tuple(self.hist[(self.max_hist_len - hist_len):self.max_hist_len])
-                if tag not in self.data[hist_len]:
-                    self.data[hist_len][tag] = {}
+                tag = tuple(hist[(self.max_hist_len - hist_len):self.max_hist_len])
+                self._add_correlation(hist_len, tag, addr_tag)
 
-                # Add the current address
-                if addr_tag not in self.data[hist_len][tag]:
-                    self.data[hist_len][tag][addr_tag] = 0
+        # Update history with addr_tag
+        self._add_history(addr_tag, pc)
 
-                self.data[hist_len][tag][addr_tag] += 1
+    def warm_up(self, addr, pc=None):
+        """Add addr to the history, without counting it
+        (e.g. before a sampled interval)."""
+        self._add_history(self.addr_tag(addr), pc)
 
-        # Update history with addr_tag
+    def _add_history(self, addr_tag, pc):
+        if self.pc_hist is not None:
+            self.pc_hist.add(pc, addr_tag)
+            return
         self.hist.append(addr_tag)
         if len(self.hist) > self.max_hist_len + self.depth - 1:
             self.hist = self.hist[1:]
 
+    def _add_correlation(self, hist_len, tag, addr_tag, count=1):
+        """Count addr_tag following tag, and move tag to its
+        new bin of the frequency histograms."""
+        tag_data = self.data[hist_len].get(tag)
+        if tag_data is None:
+            tag_data = self.data[hist_len][tag] = {}
+        num_unique = len(tag_data)
+        total = self.totals[hist_len].get(tag, 0)
+
+        # Add the current address
+        tag_data[addr_tag] = tag_data.get(addr_tag, 0) + count
+        self.totals[hist_len][tag] = total + count
+
+        freqs, weighted_freqs = self.freqs[hist_len], self.weighted_freqs[hist_len]
+        if num_unique > 0:
+            freqs[num_unique] -= 1
+            weighted_freqs[num_unique] -= total
+            if freqs[num_unique] == 0:
+                del freqs[num_unique]
+                del weighted_freqs[num_unique]
+        freqs[len(tag_data)] = freqs.get(len(tag_data), 0) + 1
+        weighted_freqs[len(tag_data)] = weighted_freqs.get(len(tag_data), 0) + total + count
+
+    def merge(self, other):
+        """Add the counts of another tracker with the same configuration,
+        e.g. one run over another shard of the trace."""
+        for hist_len in other.data:
+            for tag, tag_data in other.data[hist_len].items():
+                for addr_tag, count in tag_data.items():
+                    self._add_correlation(hist_len, tag, addr_tag, count)
+
     def addr_tag(self, addr):
         return addr >> (self.shift + 6)
 
     def compute_freqs(self, weighted=False):
-        freqs = {}
-        for hist_len in self.data:
-            freqs[hist_len] = {}
-
-            for tag in self.data[hist_len]:
-                # # of unique correlated addresses
-                num_unique_correlated_addrs = len(self.data[hist_len][tag])
-                if num_unique_correlated_addrs not in freqs[hist_len]:
-                    freqs[hist_len][num_unique_correlated_addrs] = 0
+        """Return the frequency histogram of each history length, i.e. for
+        each # of unique correlated addresses, the # of history triggers with
+        that many (or if weighted, the # of addresses for those triggers).
 
-                # If we want the frequency to be weighted by # of addresses for this
-                # history trigger
-                if weighted:
-                    freqs[hist_len][num_unique_correlated_addrs] += sum(self.data[hist_len][tag].values())
-                else:
-                    freqs[hist_len][num_unique_correlated_addrs] += 1
-
-        return freqs
+        The histograms are kept up to date in add_addr, so this
+        can be read at any point mid-run.
+        """
+        freqs = self.weighted_freqs if weighted else self.freqs
+        return {hist_len: dict(freqs[hist_len]) for hist_len in freqs}
 
 
 def print_freqs(freqs, suffix=''):
@@ -118,33 +179,217 @@ def get_argument_parser():
     parser.add_argument('load_trace')
     parser.add_argument('-d', '--depth', type=int, default=1)
     parser.add_argument('-l', '--max-hist-len', type=int, default=4)
+    parser.add_argument('-o', '--output', type=str, default=None)
+    parser.add_argument('-c', '--checkpoint', type=str, default=None)
+    parser.add_argument('--checkpoint-interval', type=int, default=10000000)
+    parser.add_argument('-r', '--resume', action='store_true')
+    parser.add_argument('-s', '--sample', type=int, default=0)
+    parser.add_argument('--simpoints', type=str, nargs=2, default=None, metavar=('SIMPOINTS', 'WEIGHTS'))
+    parser.add_argument('--interval-len', type=int, default=1000000)
+    parser.add_argument('--slice-len', type=int, default=100000000)
+    parser.add_argument('--warmup', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-p', '--pc-localized', action='store_true')
+    add_instrumentation_arguments(parser)
+    add_memo_arguments(parser)
     args = parser.parse_args()
 
     print('Arguments:')
     print('    Load trace     :', args.load_trace)
     print('    Depth          :', args.depth)
     print('    Max history len:', args.max_hist_len)
+    print('    Output         :', args.output)
+    print('    Checkpoint     :', args.checkpoint)
+    print('    Checkpt. intvl.:', args.checkpoint_interval)
+    print('    Resume         :', args.resume)
+    print('    Sample         :', args.sample)
+    print('    SimPoints      :', args.simpoints)
+    print('    Interval len   :', args.interval_len)
+    print('    Slice len      :', args.slice_len)
+    print('    Warmup         :', args.warmup)
+    print('    Seed           :', args.seed)
+    print('    PC-localized   :', args.pc_localized)
+    print('    Metrics        :', args.metrics)
+    print('    Profile        :', args.profile)
 
     return args
 
 
-def compute_correlation(load_trace, depth, max_hist_len):
-    """Main temporal correlation computation"""
+def get_pc_trackers(depth, max_hist_len):
+    """Get the PC-localized cache line / page trackers."""
+    return {
+        'PC Cache Lines': CorrelationData(depth, max_hist_len, pc_localized=True),
+        'PC Pages': CorrelationData(depth, max_hist_len, shift=6, pc_localized=True)
+    }
+
+
+def compute_correlation(load_trace, depth, max_hist_len,
+                        output=None, checkpoint=None, checkpoint_interval=10000000,
+                        resume=False, pc_localized=False, instr=None):
+    """Main temporal correlation computation
+
+    output       : path to save the frequency histograms to (as a .npz result store).
+    checkpoint   : path to periodically save the tracker state to.
+    resume       : resume from the checkpoint, if it exists.
+    pc_localized : also track the correlation of PC-localized histories.
+    instr        : Instrumentation to time the stages of the run with.
+    """
+    instr = instr or Instrumentation()
     correlation_data = CorrelationData(depth, max_hist_len)
     page_correlation_data = CorrelationData(depth, max_hist_len, shift=6)
+    pc_trackers = get_pc_trackers(depth, max_hist_len) if pc_localized else {}
+    trackers = {'Cache Lines': correlation_data, 'Pages': page_correlation_data, **pc_trackers}
+    config = {
+        'script': 'corr_load',
+        'load_trace': os.path.basename(load_trace),
+        'depth': depth,
+        'max_hist_len': max_hist_len,
+    }
+    if pc_localized: # Only set if enabled, so earlier checkpoints can still be resumed
+        config['pc_localized'] = True
     start = time.time()
 
+    num_loads = 0
+    if resume and checkpoint and os.path.exists(checkpoint):
+        state = load_checkpoint(checkpoint)
+        assert state['config'] == config, f'Checkpoint {checkpoint} is for a different run: {state["config"]}'
+        for name, tracker in trackers.items():
+            tracker.__dict__.update(state['trackers'][name])
+        num_loads = state['num_loads']
+        print(f'Resuming from {checkpoint} after {num_loads} loads')
+
+    def save(num_loads):
+        save_checkpoint(checkpoint, {
+            'config': config,
+            'num_loads': num_loads,
+            'trackers': {name: tracker.__dict__ for name, tracker in trackers.items()}
+        })
+
     l_open = get_open_function(load_trace)
     with l_open(load_trace, mode='rt', encoding='utf-8') as f:
-        gather_correlation_data(f, correlation_data, page_correlation_data)
+        num_loads = gather_correlation_data(
+            f, correlation_data, page_correlation_data,
+            start=num_loads,
+            checkpoint=save if checkpoint else None,
+            checkpoint_interval=checkpoint_interval,
+            pc_trackers=list(pc_trackers.values()),
+            instr=instr
+        )
+
+    with instr.stage('results'):
+        print_freqs(correlation_data.compute_freqs(), 'Cache Lines')
+        print_freqs(page_correlation_data.compute_freqs(), 'Pages')
+        print_freqs(correlation_data.compute_freqs(weighted=True), 'Weighted Cache Lines')
+        print_freqs(page_correlation_data.compute_freqs(weighted=True), 'Weighted Pages')
+        for name, tracker in pc_trackers.items():
+            print_freqs(tracker.compute_freqs(), name)
+            print_freqs(tracker.compute_freqs(weighted=True), f'Weighted {name}')
+
+    # Save the final tracker state too, so it can be merged
+    # with runs over other shards.
+    with instr.stage('write'):
+        if checkpoint:
+            save(num_loads)
+        if output:
+            save_freqs(output, get_results(trackers))
+    print('Time to run:', (time.time() - start) / 60, 'min')
+
+
+def compute_sampled_correlation(load_trace, depth, max_hist_len,
+                                num_samples=0, simpoints=None,
+                                interval_len=1000000, slice_len=100000000, warmup=100000, seed=0,
+                                pc_localized=False, instr=None):
+    """Estimate the temporal correlation from sampled intervals of the trace
+
+    num_samples  : # of intervals to sample, uniformly at random (by byte offset in the file).
+    simpoints    : (.simpoints, .weights) files, to instead use the slices picked by SimPoint.
+    interval_len : # of loads per (uniformly random) interval.
+    slice_len    : # of instructions per SimPoint slice (as SimPoint was run with).
+    warmup       : # of loads before each interval, to warm up the history with.
+    pc_localized : also track the correlation of PC-localized histories.
+    instr        : Instrumentation to time the stages of the run with.
+    """
+    instr = instr or Instrumentation()
+    start = time.time()
+    l_open = get_open_function(load_trace)
+    if simpoints:
+        intervals = simpoint_intervals(*simpoints)
+        windows = get_slice_windows(intervals, slice_len)
+    else:
+        intervals = random_offsets(num_samples, seed=seed)
+        windows = get_offset_windows(intervals, interval_len)
+
+    def make_trackers():
+        return {
+            'Cache Lines': CorrelationData(depth, max_hist_len),
+            'Pages': CorrelationData(depth, max_hist_len, shift=6),
+            **(get_pc_trackers(depth, max_hist_len) if pc_localized else {})
+        }
+
+    def add_inst(trackers, inst):
+        for tracker in trackers.values():
+            tracker.add_addr(inst.addr, inst.pc)
 
-    print_freqs(correlation_data.compute_freqs(), 'Cache Lines')
-    print_freqs(page_correlation_data.compute_freqs(), 'Pages')
-    print_freqs(correlation_data.compute_freqs(weighted=True), 'Weighted Cache Lines')
-    print_freqs(page_correlation_data.compute_freqs(weighted=True), 'Weighted Pages')
+    def warm_up_inst(trackers, inst):
+        for tracker in trackers.values():
+            tracker.warm_up(inst.addr, inst.pc)
+
+    with l_open(load_trace, mode='rt', encoding='utf-8') as f, instr.stage('update'):
+        results = gather_sampled_correlation_data(
+            instr.timed('decompress', f, BATCH_SIZE), windows, make_trackers, add_inst, warm_up_inst, get_results,
+            warmup=warmup, by_uiid=bool(simpoints),
+            get_fraction=None if simpoints else lambda: get_file_fraction(f)
+        )
+
+    sampled = [(res, weight) for res, (_, weight) in zip(results, intervals) if res is not None]
+    unit = f'SimPoint slices of {slice_len} instructions' if simpoints else f'intervals of {interval_len} loads'
+    print(f'Sampled {len(sampled)} {unit} ({len(intervals) - len(sampled)} past the end of the trace left out)')
+    assert sampled, f'Every sampled interval is past the end of {load_trace}'
+    names = ['Cache Lines', 'Pages'] + (['PC Cache Lines', 'PC Pages'] if pc_localized else [])
+    for name in names + [f'Weighted {name}' for name in names]:
+        estimates = estimate_freqs([res[name] for res, _ in sampled], [weight for _, weight in sampled])
+        print_freqs(format_estimates(estimates), f'{name} (Sampled)')
     print('Time to run:', (time.time() - start) / 60, 'min')
 
 
+def get_results(trackers):
+    """Get the unweighted and weighted frequency histograms of each tracker,
+    keyed by name (e.g. 'Cache Lines', 'Weighted Cache Lines')."""
+    results = {}
+    for name, tracker in trackers.items():
+        results[name] = tracker.compute_freqs()
+        results[f'Weighted {name}'] = tracker.compute_freqs(weighted=True)
+    return results
+
+
 if __name__ == '__main__':
     args = get_argument_parser()
-    compute_correlation(args.load_trace, args.depth, args.max_hist_len)
+    instr = get_instrumentation('corr_load', args)
+    # Checkpointed runs are not cached, since they also save (and resume from) their state
+    memo = get_memo('corr_load', args, inputs=['load_trace', 'simpoints'], outputs=['output'],
+                    enabled=not args.checkpoint)
+    if not memo.restore():
+        with memo.record():
+            if args.sample or args.simpoints:
+                compute_sampled_correlation(
+                    args.load_trace, args.depth, args.max_hist_len,
+                    num_samples=args.sample,
+                    simpoints=args.simpoints,
+                    interval_len=args.interval_len,
+                    slice_len=args.slice_len,
+                    warmup=args.warmup,
+                    seed=args.seed,
+                    pc_localized=args.pc_localized,
+                    instr=instr
+                )
+            else:
+                compute_correlation(
+                    args.load_trace, args.depth, args.max_hist_len,
+                    output=args.output,
+                    checkpoint=args.checkpoint,
+                    checkpoint_interval=args.checkpoint_interval,
+                    resume=args.resume,
+                    pc_localized=args.pc_localized,
+                    instr=instr
+                )
+    instr.report()
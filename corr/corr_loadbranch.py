@@ -1,41 +1,79 @@
 """Compute correlation between access history and next prefetch,
 using load-branch traces.
 
+Alternatively, with --branches <champsim_trace>, a plain load trace can be
+used, and each load's branches are read from the ChampSim trace's branch
+sidecar (see trace/extract_branches.py).
+
 Need to run from above corr/ directory. If you still get an error,
 try export PYTHONPATH=.
 """
 
 import argparse
+import os
 import time
+import numpy as np
+from utils.branch_sidecar import load_branch_sidecar, attach_branches
+from utils.corr_results import save_freqs, save_checkpoint, load_checkpoint
+from utils.count_table import CountTable, extend_hash, combine_hashes
 from utils.load import get_open_function
 from utils.load_trace import get_instructions
-from utils.logging import log_progress
+from utils.logging import (log_progress, log_file_progress, get_file_fraction, Instrumentation,
+                           add_instrumentation_arguments, get_instrumentation)
+from utils.memo import add_memo_arguments, get_memo
+from utils.sampling import (random_offsets, simpoint_intervals, get_offset_windows, get_slice_windows,
+                            gather_sampled_correlation_data, estimate_freqs, format_estimates)
+
+BATCH_SIZE = 4096 # Lines read at a time, when timing the stages
 
 
-def gather_correlation_data(f, cd, pcd=None):
+def gather_correlation_data(f, cd, pcd=None, start=0, checkpoint=None, checkpoint_interval=10000000,
+                            branches=None, instr=None):
     """Wrapper function to gather correlation data
-    from each address in the load trace."""
+    from each address in the load trace.
 
-    # Count number of lines
-    nlines = 0
-    for _ in f:
-        nlines += 1
-    f.seek(0)
+    If branches is given, as (sidecar, load index, # of branches), each
+    load's branches are attached from the branch sidecar.
 
+    The first start loads are skipped (e.g. if they were already
+    gathered before resuming from a checkpoint). If checkpoint is given,
+    it is called with the # of loads gathered every checkpoint_interval loads.
+    The decompress / parse / update stages are timed with instr, if given.
+
+    Returns the total # of loads gathered.
+    """
+    instr = instr or Instrumentation()
     start_time = time.time()
-    for lnum, inst in enumerate(get_instructions(f)):
-        
-        # Periodically log progress
-        log_progress(lnum, nlines, start_time, interval=50000)
-        
-        # Add load to correlation tracker
-        addr, brs = inst.addr, inst.branches
-        cd.add_addr(addr, brs)   
-        if pcd:
-            pcd.add_addr(addr, brs)
+    num_loads = start
+    insts = instr.timed('parse', get_instructions(instr.timed('decompress', f, BATCH_SIZE), skip=start))
+    if branches:
+        sidecar, ends, n = branches
+        insts = instr.timed('branches', attach_branches(insts, sidecar, ends, n, start=start))
+        # The load index knows the exact # of loads
+        progress = lambda lnum: log_progress(lnum, len(ends), start_time, interval=50000, instr=instr)
+    else:
+        progress = lambda lnum: log_file_progress(lnum, f, start_time, interval=50000, instr=instr)
+    with instr.stage('update'):
+        for lnum, inst in enumerate(insts, start=start):
+
+            # Periodically log progress
+            progress(lnum)
+
+            # Periodically save a checkpoint
+            if checkpoint and lnum > start and lnum % checkpoint_interval == 0:
+                with instr.stage('checkpoint'):
+                    checkpoint(lnum)
+
+            # Add load to correlation tracker
+            addr, brs = inst.addr, inst.branches
+            cd.add_addr(addr, brs)
+            if pcd:
+                pcd.add_addr(addr, brs)
+            num_loads = lnum + 1
         
     # Print time to run
     print('Time to run:', (time.time() - start_time) / 60, 'min')
+    return num_loads
 
 
 class CorrelationData(object):
@@ -50,11 +88,16 @@ class CorrelationData(object):
     shift            : number of bits to cut-off for tracking load addresses.
         - 0 : cache line temporal correlation
         - 6 : page temporal correlation
+    batch_size       : number of loads to buffer before updating the count tables.
+
+    Each trigger is an integer tag, built from rolling prefix hashes over the load
+    history and branch history, so each longer trigger extends the shorter one in O(1).
     """
     def __init__(self, depth, max_hist_len, 
                  max_branch_len=0, shift=0,
                  skip_branch_dec=False,
-                 skip_branch_pc=False):
+                 skip_branch_pc=False,
+                 batch_size=1 << 18):
         self.depth = depth
         self.hist = []
         # We're considering the correlation for:
@@ -65,6 +108,7 @@ class CorrelationData(object):
         self.max_hist_len = max_hist_len
         self.max_branch_len = max_branch_len
         self.shift = shift
+        self.batch_size = batch_size
         
         branch_types = []
         if self.max_branch_len > 0:
@@ -77,80 +121,140 @@ class CorrelationData(object):
         if not (skip_branch_dec or skip_branch_pc):
             branch_types.append('pcdec')
         
-        self.data = {
-            (i, j, k): {}
-            for i in range(1, max_hist_len + 1)
-            for j in range(0, max_branch_len + 1)
-            for k in branch_types
-        }
+        # Triggers with no branches are the same for every branch type,
+        # so they share one table.
+        self.data = {}
+        for i in range(1, max_hist_len + 1):
+            load_only = CountTable()
+            for j in range(0, max_branch_len + 1):
+                for k in branch_types:
+                    self.data[(i, j, k)] = load_only if j == 0 else CountTable()
+        self.branch_types = branch_types
+
+        # Loads waiting to be counted.
+        self._pending_addrs = []
+        self._pending_branch_pcs = []
+        self._pending_branch_decs = []
+        self._pending_branch_lens = []
         
     
-    def _is_load_history_full(self):
-        return len(self.hist) == self.max_hist_len + self.depth - 1
-    
-    
-    def _trim_load_history(self):
-        if len(self.hist) > self.max_hist_len + self.depth - 1:
-            self.hist = self.hist[1:]
-    
-
     def add_addr(self, addr, branches):
         # Only take some bits of the full address
         addr_tag = self.addr_tag(addr)
 
-        if self._is_load_history_full():
-            # For every history length, keep track of how many times addr_tag shows up
-            # given the history
-            for trigger in self.data:
-                hist_len, branch_len, branch_type = trigger # trigger type
-                # tag is the trigger
-                load_tag = self.hist[(self.max_hist_len - hist_len) : self.max_hist_len]
-                branch_tag = []
-                if branch_type in ['pc', 'pcdec']:
-                    branch_tag.extend([b[0] for b in branches[:branch_len]])
-                if branch_type in ['dec', 'pcdec']:
-                     branch_tag.extend([int(b[1]) for b in branches[:branch_len]])
-                
-                tag = tuple([*load_tag, *branch_tag])
-
-                if tag not in self.data[trigger]:
-                    self.data[trigger][tag] = {}
-
-                # Add the current address
-                if addr_tag not in self.data[trigger][tag]:
-                    self.data[trigger][tag][addr_tag] = 0
-
-                self.data[trigger][tag][addr_tag] += 1
+        # Buffer the load (and its most recent branches), to be
+        # counted with the rest of its batch.
+        branches = branches[:self.max_branch_len]
+        self._pending_addrs.append(addr_tag)
+        self._pending_branch_pcs.extend([b[0] for b in branches])
+        self._pending_branch_decs.extend([b[1] for b in branches])
+        self._pending_branch_lens.append(len(branches))
 
-        
-        self.hist.append(addr_tag) # Update history with addr_tag
-        self._trim_load_history() # Trim load history to keep only most recent loads.
+        if len(self._pending_addrs) >= self.batch_size:
+            self.flush()
+
+
+    def warm_up(self, addr):
+        """Add addr to the load history, without counting it
+        (e.g. before a sampled interval)."""
+        self.flush()
+        self.hist.append(self.addr_tag(addr))
+        self.hist = self.hist[-(self.max_hist_len + self.depth - 1):]
+
+
+    def flush(self):
+        """Count all buffered loads."""
+        if not self._pending_addrs:
+            return
+        hist_size = self.max_hist_len + self.depth - 1
+        addrs = np.array(self.hist + self._pending_addrs, dtype=np.uint64)
+        n_branches = np.array(self._pending_branch_lens, dtype=np.int64)
+
+        # Branches, from most to least recent, padded out to max_branch_len.
+        # Short branch histories are hashed as if they were sliced, i.e.
+        # padding does not extend their hash.
+        branch_pcs = np.zeros((len(n_branches), self.max_branch_len), dtype=np.uint64)
+        branch_decs = np.zeros((len(n_branches), self.max_branch_len), dtype=np.uint64)
+        has_branch = np.arange(self.max_branch_len) < n_branches[:, None]
+        branch_pcs[has_branch] = np.array(self._pending_branch_pcs, dtype=np.uint64)
+        branch_decs[has_branch] = np.array(self._pending_branch_decs, dtype=np.uint64)
+
+        # Only loads with a full load history are counted.
+        # pos is each counted load's index into addrs.
+        pos = np.arange(len(self.hist), len(addrs))
+        counted = pos >= hist_size
+        pos = pos[counted]
+        next_addrs = addrs[pos]
+        branch_pcs, branch_decs = branch_pcs[counted], branch_decs[counted]
+        has_branch = has_branch[counted]
+
+        # Rolling prefix hashes, extending each trigger from its most recent
+        # element backwards. load_hashes[i - 1] covers the hist_len = i trigger,
+        # branch_hashes[k][j] covers the branch_len = j, branch_type = k trigger.
+        load_hashes = []
+        h = np.zeros(len(pos), dtype=np.uint64)
+        for i in range(1, self.max_hist_len + 1):
+            h = extend_hash(h, addrs[pos - self.depth - i + 1])
+            load_hashes.append(h)
+
+        pc_hashes = [np.zeros(len(pos), dtype=np.uint64)]
+        dec_hashes = [np.zeros(len(pos), dtype=np.uint64)]
+        for j in range(self.max_branch_len):
+            pc_hashes.append(np.where(has_branch[:, j], extend_hash(pc_hashes[-1], branch_pcs[:, j]), pc_hashes[-1]))
+            dec_hashes.append(np.where(has_branch[:, j], extend_hash(dec_hashes[-1], branch_decs[:, j]), dec_hashes[-1]))
+        branch_hashes = {
+            'pc': pc_hashes,
+            'dec': dec_hashes,
+            'pcdec': [combine_hashes(p, d) for p, d in zip(pc_hashes, dec_hashes)]
+        }
+
+        # For every trigger, keep track of how many times each address shows up
+        # given the trigger
+        for i in range(1, self.max_hist_len + 1):
+            self.data[(i, 0, self.branch_types[0])].add(load_hashes[i - 1], next_addrs)
+            for j in range(1, self.max_branch_len + 1):
+                for k in self.branch_types:
+                    tags = combine_hashes(load_hashes[i - 1], branch_hashes[k][j])
+                    self.data[(i, j, k)].add(tags, next_addrs)
+
+        # Update history with the most recent addresses
+        self.hist = addrs[max(0, len(addrs) - hist_size):].tolist()
+        self._pending_addrs = []
+        self._pending_branch_pcs = []
+        self._pending_branch_decs = []
+        self._pending_branch_lens = []
             
 
             
+    def merge(self, other):
+        """Add the counts of another tracker with the same configuration,
+        e.g. one run over another shard of the trace."""
+        self.flush()
+        other.flush()
+        merged = set()
+        for trigger, table in self.data.items():
+            if id(table) not in merged: # Load-only triggers share a table
+                table.merge(other.data[trigger])
+                merged.add(id(table))
+
+
     def addr_tag(self, addr):
         return addr >> (self.shift + 6)
 
     
     def compute_freqs(self, weighted=False):
-        freqs = {}
-        for trigger in self.data: # trigger type = (hist_len, branch_len, branch_type)
-            freqs[trigger] = {}
+        """Return the frequency histogram of each trigger, i.e. for each
+        # of unique correlated addresses, the # of tags with that many
+        (or if weighted, the # of addresses for those tags).
 
-            for tag in self.data[trigger]:
-                # # of unique correlated addresses
-                num_unique_correlated_addrs = len(self.data[trigger][tag])
-                if num_unique_correlated_addrs not in freqs[trigger]:
-                    freqs[trigger][num_unique_correlated_addrs] = 0
-
-                # If we want the frequency to be weighted by # of addresses for this
-                # history trigger
-                if weighted:
-                    freqs[trigger][num_unique_correlated_addrs] += sum(self.data[trigger][tag].values())
-                else:
-                    freqs[trigger][num_unique_correlated_addrs] += 1
-
-        return freqs
+        The histograms are kept up to date as loads are counted, so this
+        can be read at any point mid-run.
+        """
+        self.flush()
+        return {
+            trigger: table.get_freqs(weighted) # trigger type = (hist_len, branch_len, branch_type)
+            for trigger, table in self.data.items()
+        }
 
 
 def print_freqs(freqs, suffix=''):
@@ -170,6 +274,19 @@ def get_argument_parser():
     parser.add_argument('-d', '--depth', type=int, default=1)
     parser.add_argument('-l', '--max-hist-len', type=int, default=4)
     parser.add_argument('-b', '--max-branch-len', type=int, default=0)
+    parser.add_argument('-o', '--output', type=str, default=None)
+    parser.add_argument('--branches', type=str, default=None, metavar='CHAMPSIM_TRACE')
+    parser.add_argument('-c', '--checkpoint', type=str, default=None)
+    parser.add_argument('--checkpoint-interval', type=int, default=10000000)
+    parser.add_argument('-r', '--resume', action='store_true')
+    parser.add_argument('-s', '--sample', type=int, default=0)
+    parser.add_argument('--simpoints', type=str, nargs=2, default=None, metavar=('SIMPOINTS', 'WEIGHTS'))
+    parser.add_argument('--interval-len', type=int, default=1000000)
+    parser.add_argument('--slice-len', type=int, default=100000000)
+    parser.add_argument('--warmup', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    add_instrumentation_arguments(parser)
+    add_memo_arguments(parser)
     args = parser.parse_args()
 
     print('Arguments:')
@@ -177,11 +294,35 @@ def get_argument_parser():
     print('    Depth          :', args.depth)
     print('    Max history len:', args.max_hist_len)
     print('    Max branch len :', args.max_branch_len)
+    print('    Output         :', args.output)
+    print('    Branches from  :', args.branches)
+    print('    Checkpoint     :', args.checkpoint)
+    print('    Checkpt. intvl.:', args.checkpoint_interval)
+    print('    Resume         :', args.resume)
+    print('    Sample         :', args.sample)
+    print('    SimPoints      :', args.simpoints)
+    print('    Interval len   :', args.interval_len)
+    print('    Slice len      :', args.slice_len)
+    print('    Warmup         :', args.warmup)
+    print('    Seed           :', args.seed)
+    print('    Metrics        :', args.metrics)
+    print('    Profile        :', args.profile)
     return args
 
 
-def compute_correlation(load_trace, depth, max_hist_len, max_branch_len):
-    """Main temporal correlation computation"""
+def compute_correlation(load_trace, depth, max_hist_len, max_branch_len,
+                        output=None, checkpoint=None, checkpoint_interval=10000000,
+                        resume=False, champsim_trace=None, instr=None):
+    """Main temporal correlation computation
+
+    output     : path to save the frequency histograms to (as a .npz result store).
+    checkpoint : path to periodically save the tracker state to.
+    resume     : resume from the checkpoint, if it exists.
+    champsim_trace : read the branches from this ChampSim trace's branch sidecar,
+                     instead of the (load-branch) load trace.
+    instr      : Instrumentation to time the stages of the run with.
+    """
+    instr = instr or Instrumentation()
     correlation_data = CorrelationData(
         depth, max_hist_len,
         max_branch_len=max_branch_len
@@ -191,21 +332,156 @@ def compute_correlation(load_trace, depth, max_hist_len, max_branch_len):
     #     max_branch_len=max_branch_len,
     #     shift=6
     # )
+    trackers = {'Cache Lines': correlation_data}
+    config = {
+        'script': 'corr_loadbranch',
+        'load_trace': os.path.basename(load_trace),
+        'depth': depth,
+        'max_hist_len': max_hist_len,
+        'max_branch_len': max_branch_len,
+    }
+    if champsim_trace:
+        config['champsim_trace'] = os.path.basename(champsim_trace)
+
+    branches = None
+    if champsim_trace:
+        sidecar = load_branch_sidecar(champsim_trace)
+        _, ends = sidecar.get_load_index(load_trace)
+        branches = (sidecar, ends, max_branch_len)
+
+    start = 0
+    if resume and checkpoint and os.path.exists(checkpoint):
+        state = load_checkpoint(checkpoint)
+        assert state['config'] == config, f'Checkpoint {checkpoint} is for a different run: {state["config"]}'
+        for name, tracker in trackers.items():
+            tracker.__dict__.update(state['trackers'][name])
+        start = state['num_loads']
+        print(f'Resuming from {checkpoint} after {start} loads')
+
+    def save(num_loads):
+        save_checkpoint(checkpoint, {
+            'config': config,
+            'num_loads': num_loads,
+            'trackers': {name: tracker.__dict__ for name, tracker in trackers.items()}
+        })
     
     l_open = get_open_function(load_trace)
     with l_open(load_trace, mode='rt', encoding='utf-8') as f:
-        gather_correlation_data(f, correlation_data)#, page_correlation_data)
+        num_loads = gather_correlation_data(
+            f, correlation_data,#, page_correlation_data)
+            start=start,
+            checkpoint=save if checkpoint else None,
+            checkpoint_interval=checkpoint_interval,
+            branches=branches,
+            instr=instr
+        )
+
+    with instr.stage('results'):
+        #print_freqs(correlation_data.compute_freqs(), 'Cache Lines')
+        #print_freqs(page_correlation_data.compute_freqs(), 'Pages')
+        print_freqs(correlation_data.compute_freqs(weighted=True), 'Weighted Cache Lines')
+        #print_freqs(page_correlation_data.compute_freqs(weighted=True), 'Weighted Pages')
 
-    #print_freqs(correlation_data.compute_freqs(), 'Cache Lines')
-    #print_freqs(page_correlation_data.compute_freqs(), 'Pages')
-    print_freqs(correlation_data.compute_freqs(weighted=True), 'Weighted Cache Lines')
-    #print_freqs(page_correlation_data.compute_freqs(weighted=True), 'Weighted Pages')
+    # Save the final tracker state too, so it can be merged
+    # with runs over other shards.
+    with instr.stage('write'):
+        if checkpoint:
+            save(num_loads)
+        if output:
+            save_freqs(output, get_results(trackers))
+
+
+def compute_sampled_correlation(load_trace, depth, max_hist_len, max_branch_len,
+                                num_samples=0, simpoints=None,
+                                interval_len=1000000, slice_len=100000000, warmup=100000, seed=0, instr=None):
+    """Estimate the temporal correlation from sampled intervals of the trace
+
+    num_samples  : # of intervals to sample, uniformly at random (by byte offset in the file).
+    simpoints    : (.simpoints, .weights) files, to instead use the slices picked by SimPoint.
+    interval_len : # of loads per (uniformly random) interval.
+    slice_len    : # of instructions per SimPoint slice (as SimPoint was run with).
+    warmup       : # of loads before each interval, to warm up the load history with.
+    instr        : Instrumentation to time the stages of the run with.
+    """
+    instr = instr or Instrumentation()
+    start = time.time()
+    l_open = get_open_function(load_trace)
+    if simpoints:
+        intervals = simpoint_intervals(*simpoints)
+        windows = get_slice_windows(intervals, slice_len)
+    else:
+        intervals = random_offsets(num_samples, seed=seed)
+        windows = get_offset_windows(intervals, interval_len)
+
+    def make_trackers():
+        return {'Cache Lines': CorrelationData(depth, max_hist_len, max_branch_len=max_branch_len)}
+
+    def add_inst(trackers, inst):
+        for tracker in trackers.values():
+            tracker.add_addr(inst.addr, inst.branches)
+
+    def warm_up_inst(trackers, inst):
+        for tracker in trackers.values():
+            tracker.warm_up(inst.addr)
+
+    with l_open(load_trace, mode='rt', encoding='utf-8') as f, instr.stage('update'):
+        results = gather_sampled_correlation_data(
+            instr.timed('decompress', f, BATCH_SIZE), windows, make_trackers, add_inst, warm_up_inst, get_results,
+            warmup=warmup, by_uiid=bool(simpoints),
+            get_fraction=None if simpoints else lambda: get_file_fraction(f)
+        )
+
+    sampled = [(res, weight) for res, (_, weight) in zip(results, intervals) if res is not None]
+    unit = f'SimPoint slices of {slice_len} instructions' if simpoints else f'intervals of {interval_len} loads'
+    print(f'Sampled {len(sampled)} {unit} ({len(intervals) - len(sampled)} past the end of the trace left out)')
+    assert sampled, f'Every sampled interval is past the end of {load_trace}'
+    estimates = estimate_freqs([res['Weighted Cache Lines'] for res, _ in sampled], [weight for _, weight in sampled])
+    print_freqs(format_estimates(estimates), 'Weighted Cache Lines (Sampled)')
+    print('Time to run:', (time.time() - start) / 60, 'min')
+
+
+def get_results(trackers):
+    """Get the unweighted and weighted frequency histograms of each tracker,
+    keyed by name (e.g. 'Cache Lines', 'Weighted Cache Lines')."""
+    results = {}
+    for name, tracker in trackers.items():
+        results[name] = tracker.compute_freqs()
+        results[f'Weighted {name}'] = tracker.compute_freqs(weighted=True)
+    return results
 
 
 if __name__ == '__main__':
     args = get_argument_parser()
-    compute_correlation(
-        args.load_trace, args.depth, 
-        args.max_hist_len,
-        args.max_branch_len
-    )
+    instr = get_instrumentation('corr_loadbranch', args)
+    # Checkpointed runs are not cached, since they also save (and resume from) their state
+    memo = get_memo('corr_loadbranch', args, inputs=['load_trace', 'branches', 'simpoints'], outputs=['output'],
+                    enabled=not args.checkpoint)
+    if not memo.restore():
+        with memo.record():
+            if args.sample or args.simpoints:
+                assert not args.branches, '--branches is not supported when sampling.'
+                compute_sampled_correlation(
+                    args.load_trace, args.depth,
+                    args.max_hist_len,
+                    args.max_branch_len,
+                    num_samples=args.sample,
+                    simpoints=args.simpoints,
+                    interval_len=args.interval_len,
+                    slice_len=args.slice_len,
+                    warmup=args.warmup,
+                    seed=args.seed,
+                    instr=instr
+                )
+            else:
+                compute_correlation(
+                    args.load_trace, args.depth, 
+                    args.max_hist_len,
+                    args.max_branch_len,
+                    output=args.output,
+                    checkpoint=args.checkpoint,
+                    checkpoint_interval=args.checkpoint_interval,
+                    resume=args.resume,
+                    champsim_trace=args.branches,
+                    instr=instr
+                )
+    instr.report()
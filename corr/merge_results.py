@@ -0,0 +1,80 @@
+"""Merge correlation results from several runs (e.g. over different
+traces, or different shards of one trace).
+
+By default, sums the frequency histograms of result stores saved with
+corr_load / corr_loadbranch -o. Histograms of different shards of one trace
+can not be summed exactly (a trigger may appear in several shards), so with
+--checkpoints, the final checkpoints of each shard (-c) are merged instead.
+
+Need to run from above corr/ directory. If you still get an error,
+try export PYTHONPATH=.
+"""
+
+import argparse
+from corr import corr_load, corr_loadbranch
+from utils.corr_results import load_freqs, merge_freqs, save_freqs, load_checkpoint
+
+TRACKER_CLASSES = {
+    'corr_load': corr_load.CorrelationData,
+    'corr_loadbranch': corr_loadbranch.CorrelationData,
+}
+
+
+def merge_checkpoints(paths):
+    """Merge the tracker states of several checkpoints, and return their results."""
+    trackers, config = None, None
+    for path in paths:
+        state = load_checkpoint(path)
+        cls = TRACKER_CLASSES[state['config']['script']]
+
+        shard_trackers = {}
+        for name, tracker_state in state['trackers'].items():
+            tracker = cls.__new__(cls)
+            tracker.__dict__.update(tracker_state)
+            shard_trackers[name] = tracker
+
+        if trackers is None:
+            trackers, config = shard_trackers, state['config']
+            continue
+
+        # Shards may be of different traces, but must share all other settings
+        assert ({k: v for k, v in state['config'].items() if k != 'load_trace'}
+                == {k: v for k, v in config.items() if k != 'load_trace'}), \
+            f'Checkpoint {path} has a different configuration: {state["config"]}'
+        for name, tracker in trackers.items():
+            tracker.merge(shard_trackers[name])
+
+    return corr_loadbranch.get_results(trackers)
+
+
+def print_results(results):
+    for name, freqs in results.items():
+        for trigger in sorted(freqs, key=str):
+            print(name, trigger)
+            print({k: freqs[trigger][k] for k in sorted(freqs[trigger])})
+
+
+def get_argument_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inputs', nargs='+')
+    parser.add_argument('-o', '--output', type=str, default=None)
+    parser.add_argument('--checkpoints', action='store_true')
+    args = parser.parse_args()
+
+    print('Arguments:')
+    print('    Inputs     :', args.inputs)
+    print('    Output     :', args.output)
+    print('    Checkpoints:', args.checkpoints)
+
+    return args
+
+
+if __name__ == '__main__':
+    args = get_argument_parser()
+    if args.checkpoints:
+        results = merge_checkpoints(args.inputs)
+    else:
+        results = merge_freqs([load_freqs(path) for path in args.inputs])
+    print_results(results)
+    if args.output:
+        save_freqs(args.output, results)
@@ -2,6 +2,9 @@
 import argparse
 import lzma
 from collections import deque
+from utils.block_writer import BlockWriter
+from utils.logging import add_instrumentation_arguments, get_instrumentation
+from utils.memo import add_memo_arguments, get_memo
 
 def process_line(line):
     # File format for ML Prefetching Competition
@@ -119,18 +122,27 @@ parser.add_argument('load_trace')
 parser.add_argument('pc_load_trace')
 parser.add_argument('--start', type=int, default=0)
 parser.add_argument('--stop-train', type=int, default=500)
+add_instrumentation_arguments(parser)
+add_memo_arguments(parser)
 args = parser.parse_args()
+instr = get_instrumentation('bo', args)
+memo = get_memo('bo', args, inputs=['load_trace'], outputs=['pc_load_trace'])
 
-if args.load_trace.endswith('xz'):
-    with lzma.open(args.load_trace, mode='rt', encoding='utf-8') as f:
-        data = read_file(f, args.start, args.stop_train)
-else:
-    with open(args.load_trace) as f:
-        data = read_file(f, args.start, args.stop_train)
+if not memo.restore():
+    with memo.record():
+        # Parsing each line is not timed separately from updating the prefetcher with it.
+        if args.load_trace.endswith('xz'):
+            with lzma.open(args.load_trace, mode='rt', encoding='utf-8') as f, instr.stage('update'):
+                data = read_file(instr.timed('decompress', f, 4096), args.start, args.stop_train)
+        else:
+            with open(args.load_trace) as f, instr.stage('update'):
+                data = read_file(instr.timed('decompress', f, 4096), args.start, args.stop_train)
 
-with open(args.pc_load_trace, 'w') as f:
-    for line in data:
-        print(line, file=f)
+        with BlockWriter(args.pc_load_trace) as f, instr.stage('write'):
+            for line in data:
+                print(line, file=f)
+        instr.count('write', len(data))
+instr.report()
 '''
 with open(args.pc_load_trace, 'w') as f:
     for line in data[-args.length:]:
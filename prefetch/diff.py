@@ -1,48 +1,63 @@
-import sys
-start = int(sys.argv[3]) * 1000 * 1000
 import lzma
+import argparse
+from utils.memo import add_memo_arguments, get_memo
 
-if len(sys.argv) > 4 and sys.argv[4] == 'trace':
-    split = ', '
-else:
-    split = ' '
+parser = argparse.ArgumentParser()
+parser.add_argument('trace1')
+parser.add_argument('trace2')
+parser.add_argument('start', type=int, help='Millions of instructions to skip')
+parser.add_argument('split', nargs='?', default=None, help="'trace' if the traces are comma-separated")
+add_memo_arguments(parser)
+args = parser.parse_args()
+# No argument printing, the output is parsed by diff_sweep
+start = args.start * 1000 * 1000
 
-if sys.argv[1].endswith('xz'):
-    with lzma.open(sys.argv[1], mode='rt', encoding='utf-8') as f1:
-        d1 = {line.strip().split(split)[0]: line.strip().split(split)[2] for line in f1}
-else:
-    with open(sys.argv[1]) as f1:
-        d1 = {line.strip().split(split)[0]: line.strip().split(split)[1] for line in f1}
-if sys.argv[2].endswith('xz'):
-    with lzma.open(sys.argv[2], mode='rt', encoding='utf-8') as f2:
-        d2 = {line.strip().split(split)[0]: line.strip().split(split)[2] for line in f2}
-else:
-    with open(sys.argv[2]) as f2:
-        d2 = {line.strip().split(split)[0]: line.strip().split(split)[1] for line in f2}
+memo = get_memo('diff', args, inputs=['trace1', 'trace2'])
 
-diffs = 0
-total_keys = 0
-diff1 = 0
-diff2 = 0
-diff12 = 0
-for k1 in d1:
-    if int(k1) < start:
-        continue
-    if k1 not in d2:
-        diffs += 1
-        total_keys += 1
-        diff1 += 1
-    elif d1[k1] != d2[k1]:
-        diffs += 1
-        total_keys += 1
-        diff12 += 1
-    else:
-        total_keys += 1
-for k2 in d2:
-    if int(k2) < start:
-        continue
-    if k2 not in d1:
-        diffs += 1
-        total_keys += 1
-        diff2 += 1
-print(diffs / total_keys, diff1 / total_keys, diff2 / total_keys, diff12 / total_keys, diffs, diff1, diff2, diff12, total_keys)
+if not memo.restore():
+    with memo.record():
+
+        if args.split == 'trace':
+            split = ', '
+        else:
+            split = ' '
+
+        if args.trace1.endswith('xz'):
+            with lzma.open(args.trace1, mode='rt', encoding='utf-8') as f1:
+                d1 = {line.strip().split(split)[0]: line.strip().split(split)[2] for line in f1}
+        else:
+            with open(args.trace1) as f1:
+                d1 = {line.strip().split(split)[0]: line.strip().split(split)[1] for line in f1}
+        if args.trace2.endswith('xz'):
+            with lzma.open(args.trace2, mode='rt', encoding='utf-8') as f2:
+                d2 = {line.strip().split(split)[0]: line.strip().split(split)[2] for line in f2}
+        else:
+            with open(args.trace2) as f2:
+                d2 = {line.strip().split(split)[0]: line.strip().split(split)[1] for line in f2}
+
+        diffs = 0
+        total_keys = 0
+        diff1 = 0
+        diff2 = 0
+        diff12 = 0
+        for k1 in d1:
+            if int(k1) < start:
+                continue
+            if k1 not in d2:
+                diffs += 1
+                total_keys += 1
+                diff1 += 1
+            elif d1[k1] != d2[k1]:
+                diffs += 1
+                total_keys += 1
+                diff12 += 1
+            else:
+                total_keys += 1
+        for k2 in d2:
+            if int(k2) < start:
+                continue
+            if k2 not in d1:
+                diffs += 1
+                total_keys += 1
+                diff2 += 1
+        print(diffs / total_keys, diff1 / total_keys, diff2 / total_keys, diff12 / total_keys, diffs, diff1, diff2, diff12, total_keys)
@@ -18,6 +18,14 @@ import pandas as pd
 # Diff:
 #     diff.py <trace1> <trace2> <start> gets the difference between two prefetch traces.
 
+# The scripts import utils, so run them with the top-level directory on the path
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_script_env():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([ROOT] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    return env
 
 
 def get_argument_parser():
@@ -49,6 +57,7 @@ def prefetch_sweep(args):
 
     processes = []
     cwd = os.getcwd()
+    env = get_script_env()
     files = glob.glob(os.path.join(args.load_trace_dir, '*.*'))
     for f in files:
         
@@ -71,6 +80,7 @@ def prefetch_sweep(args):
             'python',
             os.path.join(cwd, 'generate_pc.py'), 
             f, gpc_outf, '0'], 
+            env=env,
         )
         processes.append(p)
 
@@ -78,6 +88,7 @@ def prefetch_sweep(args):
             'python',
             os.path.join(cwd, 'pc_sisb.py'), 
             f, pcsisb_outf], 
+            env=env,
         )
         processes.append(p)
 
@@ -85,14 +96,17 @@ def prefetch_sweep(args):
             'python',
             os.path.join(cwd, 'sisb.py'), 
             f, sisb_outf], 
+            env=env,
         )
         processes.append(p)
 
-        subprocess.Popen([
+        p = subprocess.Popen([
             'python',
             os.path.join(cwd, "bo.py"), 
             f, bo_outf], 
+            env=env,
         )
+        processes.append(p)
 
     if args.dry_run:
         return
@@ -115,6 +129,7 @@ def get_diff_data(file1, file2, start, trace_name, prefetcher_name):
         'python',
         os.path.join(cwd, 'diff.py'), 
         file1, file2, str(start)], 
+        env=get_script_env(),
     )
     
     values = out.decode('utf-8').replace('\n', '').split(' ')
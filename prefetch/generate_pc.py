@@ -1,49 +1,40 @@
 #!/bin/python
 import argparse
-import lzma
+import numpy as np
+from utils.block_writer import BlockWriter
+from utils.logging import add_instrumentation_arguments, get_instrumentation
+from utils.memo import add_memo_arguments, get_memo
+from utils.intern import load_interned_trace, previous_occurrence
 
-def process_line(line):
-    # File format for ML Prefetching Competition
-    # See github.com/Quangmire/ChampSim
-    # Uniq Instr ID, Cycle Count,   Load Address,      PC of Load,        LLC Hit or Miss
-    # int(split[0]), int(split[1]), int(split[2], 16), int(split[3], 16), split[4] == '1'
-
-    # Return Inst ID, PC, and Load Address
-    split = line.strip().split(', ')
-    if len(split) == 3:
-        return (int(split[0]), int(split[2], 16), int(split[1], 16))
-    else:
-        return (int(split[0]), int(split[3], 16), int(split[2], 16))
-
-def read_file(f, start):
-    pc_data = {}
-    data = []
-    for i, line in enumerate(f):
-        # Necessary for some extraneous lines in MLPrefetchingCompetition traces
-        if line.startswith('***') or line.startswith('Read'):
-            continue
-        inst_id, pc, addr = process_line(line)
-        if pc not in pc_data:
-            pc_data[pc] = []
-        if len(pc_data[pc]) > 0 and pc_data[pc][-1][0] >= start * 1000 * 1000:
-            data.append('{} {}'.format(pc_data[pc][-1][0], hex((addr >> 6) << 6)))
-        pc_data[pc].append((inst_id, hex((addr >> 6) << 6)))
-
-    return data
+def get_prefetches(trace, start):
+    """Get the prefetches of an optimal next-load prefetcher, which prefetches
+    each PC's next cache line on its previous load, as (instruction ids, cache lines)."""
+    prev = previous_occurrence(trace.pc_ids)
+    has_prev = np.flatnonzero(prev >= 0)
+    has_prev = has_prev[trace.inst_ids[prev[has_prev]] >= start * 1000 * 1000]
+    return trace.inst_ids[prev[has_prev]], trace.lines[trace.line_ids[has_prev]]
 
 parser = argparse.ArgumentParser()
 parser.add_argument('load_trace')
 parser.add_argument('pc_load_trace')
 parser.add_argument('start', type=int)
+parser.add_argument('--cache', action='store_true')
+add_instrumentation_arguments(parser)
+add_memo_arguments(parser)
 args = parser.parse_args()
+instr = get_instrumentation('generate_pc', args)
+memo = get_memo('generate_pc', args, inputs=['load_trace'], outputs=['pc_load_trace'])
 
-if args.load_trace.endswith('xz'):
-    with lzma.open(args.load_trace, mode='rt', encoding='utf-8') as f:
-        data = read_file(f, args.start)
-else:
-    with open(args.load_trace) as f:
-        data = read_file(f, args.start)
+if not memo.restore():
+    with memo.record():
+        with instr.stage('parse'):
+            trace = load_interned_trace(args.load_trace, cache=args.cache)
+        with instr.stage('update'):
+            inst_ids, lines = get_prefetches(trace, args.start)
+        instr.count('update', len(trace))
 
-with open(args.pc_load_trace, 'w') as f:
-    for line in data:
-        print(line, file=f)
+        with BlockWriter(args.pc_load_trace) as f, instr.stage('write'):
+            for inst_id, line in zip(inst_ids.tolist(), lines.tolist()):
+                f.write('{} {}\n'.format(inst_id, hex(line << 6)))
+        instr.count('write', len(inst_ids))
+instr.report()
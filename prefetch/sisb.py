@@ -1,61 +1,53 @@
 
 import argparse
-import lzma
-
-def process_line(line):
-    # File format for ML Prefetching Competition
-    # See github.com/Quangmire/ChampSim
-    # Uniq Instr ID, Cycle Count,   Load Address,      PC of Load,        LLC Hit or Miss
-    # int(split[0]), int(split[1]), int(split[2], 16), int(split[3], 16), split[4] == '1'
-
-    # Return Inst ID, PC, and Load Address
-    split = line.strip().split(', ')
-    return (int(split[0]), int(split[3], 16), int(split[2], 16))
-
-tu = {}
-cache = {}
-
-def read_file(f, start, stop_train):
-    data = []
-    for i, line in enumerate(f):
-        # Necessary for some extraneous lines in MLPrefetchingCompetition traces
-        if line.startswith('***') or line.startswith('Read'):
-            continue
-        if 'Warmup' in line or 'Heartbeat' in line:
-            continue
-        if len(line.strip()) == 0:
-            continue
-        inst_id, pc, addr = process_line(line)
-        if inst_id < start * 1000 * 1000:
-            continue
-        addrB = addr >> 6;
-        if inst_id < stop_train * 1000 * 1000:
-            if pc in tu:
-                prev_addr = tu[pc]
-                cache[prev_addr] = addrB
-            tu[pc] = addrB
-        if addrB in cache:
-            data.append('{} {}'.format(inst_id, hex(cache[addrB] << 6)))
-
-    return data
+import numpy as np
+from utils.block_writer import BlockWriter
+from utils.logging import add_instrumentation_arguments, get_instrumentation
+from utils.memo import add_memo_arguments, get_memo
+from utils.intern import load_interned_trace, previous_occurrence, last_assignment
+
+def get_prefetches(trace, start, stop_train):
+    """Get the prefetches of an idealized ISB, trained on the loads before stop_train
+    (in millions of instructions), as (instruction ids, prefetched cache lines)."""
+    keep = trace.inst_ids >= start * 1000 * 1000
+    inst_ids, line_ids, pc_ids = trace.inst_ids[keep], trace.line_ids[keep], trace.pc_ids[keep]
+
+    # While training, each PC's previous cache line is mapped to its next one
+    train = np.flatnonzero(inst_ids < stop_train * 1000 * 1000)
+    prev = previous_occurrence(pc_ids[train])
+    times = train[prev >= 0]
+    prev_lines = line_ids[train[prev[prev >= 0]]]
+
+    # Every load prefetches the cache line currently mapped to its own
+    next_lines, found = last_assignment(prev_lines, line_ids[times], times,
+                                        line_ids, np.arange(len(line_ids)))
+    return inst_ids[found], trace.lines[next_lines[found]]
 
 parser = argparse.ArgumentParser()
 parser.add_argument('load_trace')
 parser.add_argument('pc_load_trace')
 parser.add_argument('--start', type=int, default=0)
 parser.add_argument('--stop-train', type=int, default=500)
+parser.add_argument('--cache', action='store_true')
+add_instrumentation_arguments(parser)
+add_memo_arguments(parser)
 args = parser.parse_args()
-
-if args.load_trace.endswith('xz'):
-    with lzma.open(args.load_trace, mode='rt', encoding='utf-8') as f:
-        data = read_file(f, args.start, args.stop_train)
-else:
-    with open(args.load_trace) as f:
-        data = read_file(f, args.start, args.stop_train)
-
-with open(args.pc_load_trace, 'w') as f:
-    for line in data:
-        print(line, file=f)
+instr = get_instrumentation('sisb', args)
+memo = get_memo('sisb', args, inputs=['load_trace'], outputs=['pc_load_trace'])
+
+if not memo.restore():
+    with memo.record():
+        with instr.stage('parse'):
+            trace = load_interned_trace(args.load_trace, cache=args.cache)
+        with instr.stage('update'):
+            inst_ids, lines = get_prefetches(trace, args.start, args.stop_train)
+        instr.count('update', len(trace))
+
+        with BlockWriter(args.pc_load_trace) as f, instr.stage('write'):
+            for inst_id, line in zip(inst_ids.tolist(), lines.tolist()):
+                f.write('{} {}\n'.format(inst_id, hex(line << 6)))
+        instr.count('write', len(inst_ids))
+instr.report()
 '''
 with open(args.pc_load_trace, 'w') as f:
     for line in data[-args.length:]:
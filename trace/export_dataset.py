@@ -0,0 +1,48 @@
+"""Export an LLC load trace to a training-ready dataset for Voyager models:
+fixed-size, memory-mapped shards of each load's PC id, page id and offset,
+labeled with the next load's page id and offset (see utils/shards.py).
+
+The load trace is decoded once, and split into pages and offsets for every
+offset bit width given (-b), each with its own dense page vocabulary.
+Training input pipelines can then read the shards with
+utils.shards.load_exported_trace, as plain mmaps.
+
+Need to run from above trace/ directory. If you still get an error,
+try export PYTHONPATH=.
+"""
+
+import argparse
+from utils.logging import add_instrumentation_arguments, get_instrumentation
+from utils.shards import export_load_trace
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('load_trace')
+    parser.add_argument('output_dir')
+    parser.add_argument('-b', '--offset-bits', type=int, nargs='+', default=[6])
+    parser.add_argument('-s', '--shard-size', type=int, default=1 << 20)
+    parser.add_argument('--cache', action='store_true')
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+
+    print('Arguments:')
+    print('    Load trace  :', args.load_trace)
+    print('    Output dir  :', args.output_dir)
+    print('    Offset bits :', args.offset_bits)
+    print('    Shard size  :', args.shard_size)
+    print('    Cache       :', args.cache)
+
+    return args
+
+
+if __name__ == '__main__':
+    args = get_arguments()
+    instr = get_instrumentation('export_dataset', args)
+    manifest = export_load_trace(args.load_trace, args.output_dir, offset_bits=args.offset_bits,
+                                 shard_size=args.shard_size, cache=args.cache, instr=instr)
+    print(f'Exported {manifest["num_rows"]} loads in {len(manifest["shard_rows"])} shards '
+          f'({manifest["num_pcs"]} PCs)')
+    for bits, variant in manifest['offset_bits'].items():
+        print(f'    {bits:>2} offset bits: {variant["num_pages"]} pages')
+    instr.report()
@@ -0,0 +1,41 @@
+"""Extract the branches of a ChampSim trace to its branch sidecar
+(<champsim_trace>.branches/), and index the loads of any given load
+traces in it.
+
+loadbranch_trace.py (--sidecar) and corr_loadbranch.py (--branches) can
+then rebuild each load's prior branches, for any # of branches, without
+decoding the ChampSim trace again.
+
+Need to run from above trace/ directory. If you still get an error,
+try export PYTHONPATH=.
+"""
+
+import time
+import argparse
+from utils.branch_sidecar import load_branch_sidecar
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('champsim_trace')
+    parser.add_argument('-l', '--load-traces', type=str, nargs='*', default=[])
+    parser.add_argument('-f', '--refresh', action='store_true')
+    args = parser.parse_args()
+
+    print('Arguments:')
+    print('    ChampSim trace :', args.champsim_trace)
+    print('    Load traces    :', args.load_traces)
+    print('    Refresh        :', args.refresh)
+
+    return args
+
+
+if __name__ == '__main__':
+    args = get_arguments()
+    start = time.time()
+    sidecar = load_branch_sidecar(args.champsim_trace, refresh=args.refresh)
+    print(f'{len(sidecar)} branches in {sidecar.num_insts} instructions ({sidecar.path})')
+    for load_trace in args.load_traces:
+        uiids, _ = sidecar.get_load_index(load_trace)
+        print(f'Indexed {len(uiids)} loads of {load_trace}')
+    print(f'Time to run: {(time.time() - start) / 60:.2f} min')
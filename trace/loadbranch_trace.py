@@ -7,21 +7,37 @@ We determine each LLC load's <n_branches> prior branch PCs
 and taken decisions, and print this data out (-v) and/or
 save it to a load-branch trace file (-o <output_trace>).
 
+With --sidecar, the branches are instead read from the ChampSim
+trace's branch sidecar (see trace/extract_branches.py), which is
+extracted first if it does not exist yet.
+
 If something is off, an error is raised explaining the issue.
 
 Need to run from above trace/ directory. If you still get an error,
 try export PYTHONPATH=.
 """
 
+import os
 import time
+import shutil
 import argparse
-import bisect
-from utils.champsim_trace import get_instructions, INST_SIZE
+import tempfile
+import itertools
+import multiprocessing
+import numpy as np
+from utils.block_writer import BlockWriter
+from utils.branch_sidecar import load_branch_sidecar
+from utils.branch_history import BranchHistory
+from utils.champsim_trace import get_instruction_blocks, INST_DTYPE, INST_SIZE
 from utils.load import get_open_function
-#from tqdm import tqdm
+from utils.load_trace import format_loadbranch_rows
+from utils.logging import (log_progress, log_file_progress, get_file_fraction, Instrumentation,
+                           add_instrumentation_arguments, get_instrumentation)
 
-MAX_BRANCHES_TRACKED = 10000
-WRITE_INTERVAL = 1000 # Write in batches to reduce compression computations.
+CHAMPSIM_BLOCK_SIZE = 1 << 20 # ChampSim instructions decoded at a time
+LOAD_CHUNK_SIZE = 100000 # Load trace lines matched (and written) at a time
+WARMUP_INSTS = 1 << 16 # ChampSim instructions to initially warm up each partition's branch history with
+PARTITION_CHECK_INTERVAL = 1024 # Lines between checks of the offset read, when partitioning compressed load traces
 
 
 def parse_load_line(line):
@@ -40,105 +56,260 @@ def assert_comparison(csim_inst, load_uiid, load_pc):
     assert hex(csim_inst.pc) == load_pc, f'{load_uiid} pcs do not match: CS pc={hex(csim_inst.pc)}, load PC={load_pc}'
 
 
-def match_traces(cf, lf, branch_hist=0, max_inst=None, verbose=False, write_f=None):
-    # Both traces are sorted temporally. So, we traverse along the
-    # load trace and, for each load, search in increasing order
-    # for the matching load in the ChampSim trace.
-    max_seen_uiid = 0
-    branch_data = {}
-    branch_uiids = []
-    out_buffer = ''
+def get_load_chunks(lf, chunk_size=LOAD_CHUNK_SIZE):
+    """Yield the load trace in chunks of (up to) chunk_size lines,
+    as (# lines read so far, valid lines, their uiids)."""
+    lnum = 0
+    while True:
+        lines = list(itertools.islice(lf, chunk_size))
+        if not lines:
+            break
+        lnum += len(lines)
+        # For handling some invalid lines in the ML-DPC load traces
+        lines = [l for l in lines if not (l.startswith('***') or l.startswith('Read'))]
+        uiids = np.array([int(l.split(',', 1)[0]) for l in lines], dtype=np.int64)
+        yield lnum, lines, uiids
+
+
+def match_traces(cf, lf, branch_hist=0, max_inst=None, verbose=False, write_f=None, block_size=CHAMPSIM_BLOCK_SIZE,
+                 instr=None):
+    instr = instr or Instrumentation()
+    start = time.time()
+    stop_reason = match_loads(
+        instr.timed('decode', get_instruction_blocks(cf, block_size), count=len),
+        instr.timed('parse', get_load_chunks(instr.timed('decompress', lf, LOAD_CHUNK_SIZE)), count=lambda c: len(c[2])),
+        branch_hist=branch_hist, max_inst=max_inst,
+        verbose=verbose, write_f=write_f, block_size=block_size,
+        progress=lambda lnum: log_file_progress(lnum, lf, start, interval=LOAD_CHUNK_SIZE, instr=instr),
+        instr=instr
+    )
+    if stop_reason == 'out_of_insts':
+        print('ChampSim trace out of instructions. Returning.')
+
+
+def match_loads(blocks, load_chunks, branch_hist=0, max_inst=None, verbose=False, write_f=None,
+                block_size=CHAMPSIM_BLOCK_SIZE, first_inst=0, progress=None, instr=None):
+    """Match each chunk of loads to its most recent branches, decoding
+    blocks of the ChampSim trace (which start at instruction first_inst).
+    The match / write stages are timed with instr, if given.
+
+    Returns why matching stopped early ('max_inst' or 'out_of_insts'),
+    or None if every load was matched.
+    """
+    # Both traces are sorted temporally. So, we decode the ChampSim trace
+    # in blocks, and match each chunk of loads to its most recent branches
+    # as soon as the ChampSim trace has been decoded up to them.
+    block, block_start = None, first_inst
+    num_insts = first_inst # ChampSim instructions decoded so far
+    branches = BranchHistory(block_size + branch_hist)
+    instr = instr or Instrumentation()
+
+    with instr.stage('match'):
+        for lnum, lines, uiids in load_chunks:
+            if progress:
+                progress(lnum)
+
+            # Stop at the maximum instruction limit
+            stop_reason = None
+            if max_inst and (uiids > max_inst).any():
+                stop = int(np.argmax(uiids > max_inst))
+                lines, uiids = lines[:stop], uiids[:stop]
+                stop_reason = 'max_inst'
+            instr.count('match', len(uiids))
+
+            i = 0
+            while i < len(uiids):
+                # Decode the next block of the ChampSim trace, if we
+                # need to go further to match the next load.
+                if uiids[i] > num_insts:
+                    block = next(blocks, None)
+                    if block is None:
+                        stop_reason = 'out_of_insts'
+                        break
+                    block_start, num_insts = num_insts, num_insts + len(block)
+                    is_branch = np.flatnonzero(block['is_branch'])
+                    branches.extend(is_branch + block_start, block['pc'][is_branch], block['branch_taken'][is_branch].astype(bool))
+                    continue
+
+                # Match every load we've decoded up to with its most recent branches
+                past = uiids[i:] > num_insts
+                j = i + int(np.argmax(past)) if past.any() else len(uiids)
+                branch_pcs, branch_taken = branches.get_prior_batch(uiids[i:j], branch_hist)
+
+                if verbose:
+                    for k in range(i, j):
+                        uiid, _, src_addr, pc, _ = parse_load_line(lines[k])
+                        print(f'\n{uiid:8} Load    : pc={pc} src_mem={src_addr}')
+                        if block_start <= uiid - 1 < num_insts:
+                            inst = block[uiid - 1 - block_start]
+                            print(f'{uiid:8} CS      : pc={hex(inst["pc"])} src_mem={hex(inst["src_mem"][0])}')
+                        for bpc, dec in zip(branch_pcs[k - i].tolist(), branch_taken[k - i].tolist()):
+                            print(f'({hex(bpc)}, {"T" if dec else "NT"}) ', end='')
+                        print()
+
+                # Write results to a load trace augmented with the branches.
+                # Row: <load data>, <branch 1 PC>, <branch 1 T/NT>, <branch 2 PC>, <branch 2 T/NT>, ...
+                # Branch 1 is the most recent branch.
+                # Branch <n_branches> is the least recent branch.
+                # If there are less than <n_branches> prior branches, the PC/Taken will both be 0.
+                if write_f:
+                    with instr.stage('write'):
+                        write_f.write(format_loadbranch_rows(lines[i:j], branch_pcs, branch_taken))
+                i = j
+
+            if stop_reason:
+                return stop_reason
+
+
+def match_sidecar(sidecar, lf, ends, branch_hist=0, max_inst=None, write_f=None, instr=None):
+    """Match each chunk of loads to its most recent branches, from the branch
+    sidecar of the ChampSim trace (and the load trace's index ends in it).
+
+    Returns why matching stopped early, like match_loads.
+    """
+    instr = instr or Instrumentation()
+    start = time.time()
+    num_loads = 0
+    load_chunks = instr.timed('parse', get_load_chunks(instr.timed('decompress', lf, LOAD_CHUNK_SIZE)), count=lambda c: len(c[2]))
+    for lnum, lines, uiids in load_chunks:
+        log_progress(lnum, len(ends), start, interval=LOAD_CHUNK_SIZE, instr=instr)
+        chunk_ends = ends[num_loads:num_loads + len(uiids)]
+        num_loads += len(uiids)
+
+        # Stop at the maximum instruction limit, or the end of the ChampSim trace
+        stop_reason = None
+        if max_inst and (uiids > max_inst).any():
+            stop_reason = 'max_inst'
+            uiids = uiids[:int(np.argmax(uiids > max_inst))]
+        if (uiids > sidecar.num_insts).any():
+            stop_reason = 'out_of_insts'
+            uiids = uiids[:int(np.argmax(uiids > sidecar.num_insts))]
+        lines, chunk_ends = lines[:len(uiids)], chunk_ends[:len(uiids)]
+
+        with instr.stage('match'):
+            branch_pcs, branch_taken = sidecar.get_prior_batch(chunk_ends, branch_hist)
+        instr.count('match', len(uiids))
+        if write_f:
+            with instr.stage('write'):
+                write_f.write(format_loadbranch_rows(lines, branch_pcs, branch_taken))
+        if stop_reason:
+            return stop_reason
+
+
+def get_partition_lines(load_trace, start, end):
+    """Yield the lines of the partition [start, end) of the load trace, as fractions
+    of its file (by byte offset): from the first line starting at (or after) start,
+    up to the first starting at (or after) end (or the end of the file, if end is 1).
+
+    Plain text load traces are seeked to the byte offset, and realigned to the next
+    line. Compressed load traces cannot be seeked, so they are read from the start,
+    with each line at the offset in the compressed file read so far (see
+    utils.logging.get_file_fraction, checked every PARTITION_CHECK_INTERVAL lines),
+    which is the same in every partition.
+    """
+    l_open = get_open_function(load_trace)
+    if l_open is open:
+        size = os.path.getsize(load_trace)
+        start, end = int(start * size), (int(end * size) if end < 1 else size)
+        with open(load_trace, mode='rb') as lf:
+            pos = 0
+            if start > 0:
+                # Skip the rest of the line start is in (unless a line starts at start)
+                lf.seek(start - 1)
+                pos = start - 1 + len(lf.readline())
+            for line in lf:
+                if pos >= end:
+                    break
+                pos += len(line)
+                yield line.decode('utf-8')
+        return
+
+    with l_open(load_trace, mode='rt', encoding='utf-8') as lf:
+        fraction = 0.
+        for lnum, line in enumerate(lf):
+            if lnum % PARTITION_CHECK_INTERVAL == 0:
+                fraction = get_file_fraction(lf)
+            if end < 1 and fraction >= end:
+                break
+            if fraction >= start:
+                yield line
+
+
+def match_partition(champsim_trace, load_trace, part_path, start, end,
+                    branch_hist, max_inst, block_size):
+    """Match the loads of the partition [start, end) of the load trace (as fractions
+    of its file, see get_partition_lines), writing their rows to part_path.
+
+    Decoding starts early enough before the partition's first load to warm up
+    its branch history with at least branch_hist branches, so the rows
+    are the same as when matching the whole trace at once.
+    """
+    cs_open = get_open_function(champsim_trace)
+    with cs_open(champsim_trace, mode='rb') as cf, \
+         open(part_path, mode='wt', encoding='utf-8') as of:
+        load_chunks = get_load_chunks(get_partition_lines(load_trace, start, end))
+        # Skip ahead to the first chunk with loads (chunks may only have invalid lines)
+        first_chunk = next((chunk for chunk in load_chunks if len(chunk[2]) > 0), None)
+        if first_chunk is None:
+            return None
+        first_uiid = int(first_chunk[2][0])
+
+        # Find a warm-up window of instructions before the first load,
+        # with enough branches.
+        warmup = max(WARMUP_INSTS, 64 * branch_hist)
+        while True:
+            first_inst = max(0, first_uiid - 1 - warmup)
+            cf.seek(first_inst * INST_SIZE)
+            warm_bytes = cf.read((first_uiid - 1 - first_inst) * INST_SIZE)
+            warm_block = np.frombuffer(warm_bytes, dtype=INST_DTYPE, count=len(warm_bytes) // INST_SIZE)
+            if first_inst == 0 or warm_block['is_branch'].sum() >= branch_hist:
+                break
+            warmup *= 4
+
+        blocks = itertools.chain([warm_block], get_instruction_blocks(cf, block_size))
+        return match_loads(
+            blocks, itertools.chain([first_chunk], load_chunks),
+            branch_hist=branch_hist, max_inst=max_inst, write_f=of,
+            block_size=block_size, first_inst=first_inst
+        )
+
 
-    # Count number of lines
-    nlines = 0
-    for line in lf:
-        nlines += 1
-    lf.seek(0)
+def match_traces_parallel(champsim_trace, load_trace, write_f, branch_hist=0, max_inst=None,
+                          workers=2, block_size=CHAMPSIM_BLOCK_SIZE, tmp_dir=None, instr=None):
+    """Match the load trace in workers partitions (by byte offset, see
+    get_partition_lines) in parallel, and write their rows to write_f in order.
+
+    Each partition's rows are written to a temporary file in tmp_dir first.
+    Waiting on the workers (match) and copying their rows (write) are timed with instr.
+    """
+    instr = instr or Instrumentation()
+    bounds = [p / workers for p in range(workers + 1)]
+    part_dir = tempfile.mkdtemp(prefix='loadbranch-', dir=tmp_dir)
+    part_paths = [os.path.join(part_dir, f'part{p}.txt') for p in range(workers)]
+    part_args = [
+        (champsim_trace, load_trace, part_paths[p], bounds[p], bounds[p + 1], branch_hist, max_inst, block_size)
+        for p in range(workers)
+    ]
 
-    #for line in tqdm(lf, total=nlines, unit='line', dynamic_ncols=True):
     start = time.time()
-    for lnum, line in enumerate(lf):
-
-        if lnum > 0 and lnum % 10000 == 0:
-            pct = lnum / nlines
-            elapsed_time = time.time() - start
-            left_time = (elapsed_time / lnum * nlines) - elapsed_time # estimated time left
-            print(f'{lnum} / {nlines} ({pct*100:.2f}%) ({elapsed_time / 60:.2f} min) ({left_time / 60:.2f} min est. rem.)')
-
-        # Parse load trace line
-        if line.startswith('***') or line.startswith('Read'): # For handling some invalid lines in the ML-DPC load traces
-            continue
-        uiid, _, src_addr, pc, _ = parse_load_line(line)
-
-        # Return early if we exceed the maximum instruction limit
-        if max_inst and uiid > max_inst:
-            return
-
-        # If this instruction is higher than the maximum seen UIID, build
-        # the branch table up to this instruction's UIID.
-        if uiid > max_seen_uiid:
-            cf.seek(max_seen_uiid * INST_SIZE)
-            for i in range(max_seen_uiid, uiid):
-                inst = next(get_instructions(cf), None)
-                if not inst:
+    try:
+        with multiprocessing.Pool(workers) as pool:
+            results = instr.timed('match', pool.imap(_match_partition, part_args), count=lambda _: 0)
+            for p, stop_reason in enumerate(results):
+                with open(part_paths[p], mode='rt', encoding='utf-8') as pf, instr.stage('write'):
+                    shutil.copyfileobj(pf, write_f)
+                print(f'Partition {p + 1} / {workers} done ({(time.time() - start) / 60:.2f} min)')
+                # Later partitions have nothing more to add
+                if stop_reason == 'out_of_insts':
                     print('ChampSim trace out of instructions. Returning.')
-                    return
-                if inst.is_branch: # Insert the branch into the sorted list (sorted by uiid)
-                    bisect.insort(branch_uiids, i)
-                    branch_data[i] = (inst.pc, inst.branch_taken)
-
-                    # Clear old branch instructions to conserve memory
-                    # (should not cause major impacts)
-                    if len(branch_uiids) > MAX_BRANCHES_TRACKED:
-                        remove_uiid = branch_uiids[0]
-                        branch_uiids = branch_uiids[1:]
-                        del branch_data[remove_uiid]
-
-            max_seen_uiid = uiid
-        #else:
-        #    cf.seek((uiid - 1) * INST_SIZE)
-        #    inst = next(get_instructions(cf), None)
-
-        # Assertion checks
-        #assert_comparison(inst, uiid, pc)
-
-        if verbose:
-            print(f'\n{uiid:8} Load    : pc={pc} src_mem={src_addr}')
-            print(f'{uiid:8} CS      : pc={hex(inst.pc)} src_mem={hex(inst.src_mem[0])}')
-            #print(f'{uiid:8} Load    : pc={bin(int(pc[2:], 16))} src_mem={bin(int(src_addr[2:], 16))}')
-            #print(f'{uiid:8} CS      : pc={bin(inst.pc)} src_mem={bin(inst.src_mem[0])}')
-
-        # Match each load to its most recent branches, and print / write results.
-        if branch_hist > 0:
-            idx = bisect.bisect_left(branch_uiids, uiid)
-            low, high = max(0, idx - branch_hist), min(idx, len(branch_uiids))
-            prior_branch_uiids = branch_uiids[low:high][::-1] # Reverse so the most recent branch appears first.
-
-            if verbose:
-                for buiid in prior_branch_uiids:
-                    pc, dec = branch_data[buiid]
-                    print(f'({hex(pc)}, {"T" if dec else "NT"}) ', end='')
-                print()
-
-            # Write results to a load trace augmented with the branches.
-            # Row: <load data>, <branch 1 PC>, <branch 1 T/NT>, <branch 2 PC>, <branch 2 T/NT>, ...
-            # Branch 1 is the most recent branch.
-            # Branch <n_branches> is the least recent branch.
-            # If there are less than <n_branches> prior branches, the PC/Taken will both be 0.
-            if write_f:
-                out_buffer += line.rstrip('\n')
-                for i in range(branch_hist):
-                    pc, dec = branch_data[prior_branch_uiids[i]] if i < len(prior_branch_uiids) else (0, 0)
-                    out_buffer += f', {hex(pc)[2:]}, {int(dec)}'
-                out_buffer += '\n'
-
-                # Batch out output writing
-                if lnum % WRITE_INTERVAL == 0:
-                    print(out_buffer, end='', file=write_f)
-                    out_buffer = ''
-
-    # Write anything left over in buffer.
-    print(out_buffer, end='', file=write_f)
+                if stop_reason:
+                    break
+    finally:
+        shutil.rmtree(part_dir)
+
+
+def _match_partition(args):
+    return match_partition(*args)
 
 
 def get_arguments():
@@ -149,6 +320,10 @@ def get_arguments():
     parser.add_argument('-o', '--output-trace', type=str)
     parser.add_argument('-i', '--max-inst', default=None, type=int)
     parser.add_argument('-v', '--verbose', action='store_true')
+    parser.add_argument('-j', '--workers', default=1, type=int)
+    parser.add_argument('--write-threads', default=None, type=int)
+    parser.add_argument('--sidecar', action='store_true')
+    add_instrumentation_arguments(parser)
     args = parser.parse_args()
 
     print('Arguments:')
@@ -158,30 +333,59 @@ def get_arguments():
     print('    Output trace   :', args.output_trace)
     print('    Max load inst. :', args.max_inst if args.max_inst else 'Full load trace')
     print('    Verbose        :', args.verbose)
+    print('    Workers        :', args.workers)
+    print('    Write threads  :', args.write_threads if args.write_threads else 'All CPUs')
+    print('    Sidecar        :', args.sidecar)
+    print('    Metrics        :', args.metrics)
+    print('    Profile        :', args.profile)
 
     return args
 
 
 if __name__ == '__main__':
     args = get_arguments()
+    instr = get_instrumentation('loadbranch_trace', args)
 
     cs_open = get_open_function(args.champsim_trace)
     l_open = get_open_function(args.load_trace)
-    o_open = get_open_function(args.output_trace) if args.output_trace else None
 
     if args.output_trace:
-        of = o_open(args.output_trace, mode='wt', encoding='utf-8')
+        of = BlockWriter(args.output_trace, threads=args.write_threads)
     else:
         of = None
 
-    with cs_open(args.champsim_trace, mode='rb') as cf, l_open(args.load_trace, mode='rt', encoding='utf-8') as lf:
-        match_traces(
-            cf, lf,
+    if args.sidecar:
+        assert not args.verbose, 'Verbose output is not supported with --sidecar.'
+        with instr.stage('sidecar'):
+            sidecar = load_branch_sidecar(args.champsim_trace)
+            _, ends = sidecar.get_load_index(args.load_trace)
+        with l_open(args.load_trace, mode='rt', encoding='utf-8') as lf:
+            stop_reason = match_sidecar(sidecar, lf, ends, branch_hist=args.n_branches, max_inst=args.max_inst,
+                                        write_f=of, instr=instr)
+        if stop_reason == 'out_of_insts':
+            print('ChampSim trace out of instructions. Returning.')
+    elif args.workers > 1 and of:
+        assert not args.verbose, 'Verbose output is only supported with 1 worker.'
+        match_traces_parallel(
+            args.champsim_trace, args.load_trace, of,
             branch_hist=args.n_branches,
             max_inst=args.max_inst,
-            verbose=args.verbose,
-            write_f=of
+            workers=args.workers,
+            tmp_dir=os.path.dirname(os.path.abspath(args.output_trace)),
+            instr=instr
         )
+    else:
+        with cs_open(args.champsim_trace, mode='rb') as cf, l_open(args.load_trace, mode='rt', encoding='utf-8') as lf:
+            match_traces(
+                cf, lf,
+                branch_hist=args.n_branches,
+                max_inst=args.max_inst,
+                verbose=args.verbose,
+                write_f=of,
+                instr=instr
+            )
 
     if args.output_trace:
-        of.close()
+        with instr.stage('write'):
+            of.close()
+    instr.report()
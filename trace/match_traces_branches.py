@@ -13,8 +13,12 @@ try export PYTHONPATH=.
 import lzma
 import gzip
 import argparse
-import bisect
+import numpy as np
+from utils.branch_history import BranchHistory
 from utils.champsim_trace import get_instructions, INST_SIZE
+from utils.trace_verify import AddressMapping
+
+MAX_BRANCHES_TRACKED = 10000
 
 
 def parse_load_line(line):
@@ -32,8 +36,8 @@ def match_traces(cf, lf, branch_hist=0):
     # load trace and, for each load, search in increasing order
     # for the matching load in the ChampSim trace.
     prev_uiid = 0
-    src_mapping = {}
-    branches = []
+    src_mapping = AddressMapping()
+    branches = BranchHistory(max(branch_hist, MAX_BRANCHES_TRACKED))
 
     for line in lf:
         # For handling some invalid lines in the ML-DPC load traces
@@ -44,8 +48,8 @@ def match_traces(cf, lf, branch_hist=0):
         if uiid > prev_uiid:
             for i in range(prev_uiid, uiid):
                 inst = next(get_instructions(cf), None)
-                if inst.is_branch: # Insert the branch into the sorted list (sorted by uiid)
-                    bisect.insort(branches, (i, inst.pc, inst.branch_taken))
+                if inst.is_branch: # Add the branch to the history (overwriting the oldest branch once full)
+                    branches.add(i, inst.pc, inst.branch_taken)
         else:
             cf.seek((uiid - 1) * INST_SIZE)
             inst = next(get_instructions(cf), None)
@@ -58,9 +62,8 @@ def match_traces(cf, lf, branch_hist=0):
         # Assertion checks
         assert len(inst.src_mem) == 1, f'{uiid} matches with instruction with 0 / 2+ load addreses {inst.src_mem} : {inst}'
         assert hex(inst.pc) == pc, f'{uiid} pcs do not match: CS pc={hex(inst.pc)}, load PC={pc}'
-        if src_addr in src_mapping:
-            assert src_mapping[src_addr] == inst.src_mem, '{uiid} mapping between addresses is not one-to-one: Load {src_addr}, CS {hex(inst.pc)} vs. {hex(src_mapping[src_addr])}'
-        src_mapping[src_addr] = inst.src_mem
+        mismatch = src_mapping.check(np.array([int(src_addr, 16)], dtype=np.uint64), np.array(inst.src_mem, dtype=np.uint64))
+        assert not mismatch[0], f'{uiid} mapping between addresses is not one-to-one: Load {src_addr}, CS {hex(inst.src_mem[0])}'
 
         print()
         print(f'{uiid:8} Load    : pc={pc} src_mem={src_addr}')
@@ -68,12 +71,10 @@ def match_traces(cf, lf, branch_hist=0):
         #print(f'{uiid:8} Load    : pc={bin(int(pc[2:], 16))} src_mem={bin(int(src_addr[2:], 16))}')
         #print(f'{uiid:8} CS      : pc={bin(inst.pc)} src_mem={bin(inst.src_mem[0])}')
         if branch_hist > 0:
-            i = bisect.bisect_left(branches, (uiid, 0, 0))
-            low = max(0, i - branch_hist)
-            high = min(i, len(branches))
-            prior_branches = branches[low:high]
+            # Least recent branch first
+            prior_pcs, prior_taken = branches.get_prior(uiid, branch_hist)
             print(f'{uiid:8} Branches: ', end='')
-            for _, pc, dec in prior_branches:
+            for pc, dec in zip(prior_pcs.tolist()[::-1], prior_taken.tolist()[::-1]):
                 print(f'({hex(pc)}, {"T" if dec else "NT"}) ', end='')
             print()
 
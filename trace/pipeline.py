@@ -0,0 +1,91 @@
+"""Decode a ChampSim trace once, and feed it to several analysis
+stages at the same time (instead of running each script separately):
+
+- verify     : verify the load trace against the ChampSim trace (like match_traces).
+- loadbranch : build a load-branch trace (like loadbranch_trace).
+- pc_stats   : count each PC's instructions, branches, taken branches, loads and stores.
+- inst_mix   : count the instruction mix.
+
+Each stage writes its own file to the output directory.
+
+Need to run from above trace/ directory. If you still get an error,
+try export PYTHONPATH=.
+"""
+
+import os
+import argparse
+from utils.load import get_open_function
+from utils.logging import add_instrumentation_arguments, get_instrumentation
+from utils.pipeline import run_pipeline, VerifyStage, LoadBranchStage, PCStatsStage, InstMixStage
+
+STAGES = ['verify', 'loadbranch', 'pc_stats', 'inst_mix']
+BLOCK_SIZE = 1 << 20
+
+
+def get_stages(names, output_dir, n_branches, compress=None, max_reported=10):
+    stages = []
+    for name in names:
+        if name == 'verify':
+            stages.append(VerifyStage(output_dir, max_reported=max_reported))
+        elif name == 'loadbranch':
+            stages.append(LoadBranchStage(output_dir, n_branches, BLOCK_SIZE, ext=f'txt.{compress}' if compress else 'txt'))
+        elif name == 'pc_stats':
+            stages.append(PCStatsStage(output_dir))
+        elif name == 'inst_mix':
+            stages.append(InstMixStage(output_dir))
+        else:
+            raise ValueError(f'Unknown stage {name}, must be one of {STAGES}')
+    return stages
+
+
+def get_argument_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('champsim_trace')
+    parser.add_argument('output_dir')
+    parser.add_argument('-l', '--load-trace', type=str, default=None)
+    parser.add_argument('-s', '--stages', type=str, default=','.join(STAGES))
+    parser.add_argument('-n', '--n-branches', type=int, default=8)
+    parser.add_argument('-c', '--compress', choices=['xz', 'gz'], default=None)
+    parser.add_argument('-k', '--max-reported', type=int, default=10)
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+
+    print('Arguments:')
+    print('    ChampSim trace :', args.champsim_trace)
+    print('    Output dir     :', args.output_dir)
+    print('    Load trace     :', args.load_trace)
+    print('    Stages         :', args.stages)
+    print('    Num branches   :', args.n_branches)
+    print('    Compress       :', args.compress)
+    print('    Max reported   :', args.max_reported)
+    print('    Metrics        :', args.metrics)
+    print('    Profile        :', args.profile)
+
+    return args
+
+
+if __name__ == '__main__':
+    args = get_argument_parser()
+    instr = get_instrumentation('pipeline', args)
+    os.makedirs(args.output_dir, exist_ok=True)
+    stages = get_stages(
+        args.stages.split(','), args.output_dir, args.n_branches,
+        compress=args.compress, max_reported=args.max_reported
+    )
+    assert args.load_trace or not any(stage.needs_loads for stage in stages), \
+        f'Stages {[s.name for s in stages if s.needs_loads]} need a load trace (-l).'
+
+    cs_open = get_open_function(args.champsim_trace)
+    with cs_open(args.champsim_trace, mode='rb') as cf:
+        if args.load_trace:
+            l_open = get_open_function(args.load_trace)
+            with l_open(args.load_trace, mode='rt', encoding='utf-8') as lf:
+                timings = run_pipeline(cf, lf, stages, block_size=BLOCK_SIZE)
+        else:
+            timings = run_pipeline(cf, None, stages, block_size=BLOCK_SIZE)
+
+    for stage in stages:
+        print(f'Wrote {stage.output_path}')
+    for name, t in timings.items():
+        instr.add_time(name, t)
+    instr.report()
@@ -0,0 +1,56 @@
+"""Compute the reuse distance histograms and footprints of an LLC load trace,
+at cache line and page granularity, overall, per PC and per window of loads
+(see utils/reuse.py).
+
+The stats are saved alongside the load trace (<load_trace>.reuse.npz), where
+notebooks can load them with utils.reuse.load_reuse_stats, and are only
+computed again if the load trace (or the window) changes, or with -f.
+
+Need to run from above trace/ directory. If you still get an error,
+try export PYTHONPATH=.
+"""
+
+import argparse
+from utils.logging import add_instrumentation_arguments, get_instrumentation
+from utils.reuse import GRANULARITIES, load_reuse_stats
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('load_trace')
+    parser.add_argument('-w', '--window', type=int, default=1000000)
+    parser.add_argument('-k', '--top-pcs', type=int, default=10)
+    parser.add_argument('-f', '--refresh', action='store_true')
+    parser.add_argument('--cache', action='store_true')
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+
+    print('Arguments:')
+    print('    Load trace :', args.load_trace)
+    print('    Window     :', args.window)
+    print('    Top PCs    :', args.top_pcs)
+    print('    Refresh    :', args.refresh)
+    print('    Cache      :', args.cache)
+
+    return args
+
+
+if __name__ == '__main__':
+    args = get_arguments()
+    instr = get_instrumentation('reuse_distance', args)
+    with instr.stage('update'):
+        stats = load_reuse_stats(args.load_trace, window=args.window, refresh=args.refresh, cache_trace=args.cache)
+    instr.count('update', int(stats.num_loads))
+
+    print(f'{stats.num_loads} loads, {stats.num_lines} unique lines, {stats.num_pages} unique pages, {len(stats.pcs)} PCs')
+    for g in GRANULARITIES:
+        hist = stats.get_histogram_table(g)
+        hist = hist[hist.loads > 0]
+        print(f'Reuse distance ({g}s):')
+        for row in hist.itertuples():
+            label = 'cold' if row.min_distance == float('inf') else f'{int(row.min_distance)}-{int(row.max_distance)}'
+            print(f'    {label:>24}: {row.loads:12} ({row.fraction * 100:6.2f}%)')
+
+    print(f'Top {args.top_pcs} PCs:')
+    print(stats.get_pc_table().head(args.top_pcs).to_string(index=False, formatters={'pc': hex}))
+    instr.report()
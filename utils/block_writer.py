@@ -0,0 +1,86 @@
+"""Write large (optionally .xz / .gz compressed) text outputs,
+compressing blocks of the output in parallel.
+
+Each block is compressed as an independent .xz stream / .gz member. Their
+concatenation is still a valid .xz / .gz file (readable with xzcat / zcat,
+or get_open_function), and its blocks can be decoded in parallel.
+"""
+
+import os
+import gzip
+import lzma
+import collections
+import concurrent.futures
+
+
+def _compress_gz(data):
+    return gzip.compress(data, compresslevel=9)
+
+
+def get_compress_function(path):
+    """Choose a block compression function based on the file's extension
+    (or None, for uncompressed files)."""
+    if path.endswith('xz'):
+        return lzma.compress
+    elif path.endswith('gz'):
+        return _compress_gz
+    return None
+
+
+class BlockWriter(object):
+    """File-like text writer, that compresses each block_size characters
+    of the output in a pool of threads (compression releases the GIL),
+    and writes them out in order.
+    """
+    def __init__(self, path, threads=None, block_size=16 << 20):
+        self.f = open(path, 'wb')
+        self.compress = get_compress_function(path)
+        self.block_size = block_size
+        self.buffer = []
+        self.buffered = 0
+        self.blocks_written = 0
+
+        if self.compress:
+            threads = threads or os.cpu_count()
+            self.pool = concurrent.futures.ThreadPoolExecutor(threads)
+            self.pending = collections.deque()
+            self.max_pending = 2 * threads # Bound the memory used by blocks waiting to be written
+
+    def write(self, s):
+        self.buffer.append(s)
+        self.buffered += len(s)
+        if self.buffered >= self.block_size:
+            self._flush_block()
+        return len(s)
+
+    def _flush_block(self):
+        if not self.buffer:
+            return
+        data = ''.join(self.buffer).encode('utf-8')
+        self.buffer = []
+        self.buffered = 0
+        self.blocks_written += 1
+
+        if not self.compress:
+            self.f.write(data)
+            return
+        self.pending.append(self.pool.submit(self.compress, data))
+        while len(self.pending) > self.max_pending:
+            self.f.write(self.pending.popleft().result())
+
+    def close(self):
+        self._flush_block()
+        if self.compress:
+            # Empty outputs are still written as a valid (empty) stream
+            if self.blocks_written == 0:
+                self.f.write(self.compress(b''))
+            while self.pending:
+                self.f.write(self.pending.popleft().result())
+            self.pool.shutdown()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,63 @@
+"""Fixed-size history of the most recent branches in a ChampSim trace."""
+
+import numpy as np
+
+
+class BranchHistory(object):
+    """Ring buffer of the size most recent branches' (uiid, pc, taken).
+
+    Branches must be added in increasing uiid order, so the buffer
+    stays sorted and older branches are simply overwritten.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.uiids = np.zeros(size, dtype=np.int64)
+        self.pcs = np.zeros(size, dtype=np.uint64)
+        self.taken = np.zeros(size, dtype=bool)
+        self.count = 0 # Total # of branches added
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def add(self, uiid, pc, taken):
+        i = self.count % self.size
+        self.uiids[i] = uiid
+        self.pcs[i] = pc
+        self.taken[i] = taken
+        self.count += 1
+
+    def extend(self, uiids, pcs, taken):
+        """Add a batch of branches at once."""
+        skipped = max(0, len(uiids) - self.size) # Would be overwritten anyways
+        idx = (self.count + np.arange(skipped, len(uiids))) % self.size
+        self.uiids[idx] = uiids[skipped:]
+        self.pcs[idx] = pcs[skipped:]
+        self.taken[idx] = taken[skipped:]
+        self.count += len(uiids)
+
+    def get_prior_batch(self, uiids, n):
+        """Get the n most recent branches before each of uiids, as (pcs, taken)
+        arrays of shape (len(uiids), n), from most to least recent.
+
+        Loads with fewer than n prior branches are padded with pc 0 / not taken.
+        """
+        order = np.arange(self.count - len(self), self.count) % self.size
+        end = np.searchsorted(self.uiids[order], uiids)
+        pos = end[:, None] - 1 - np.arange(n)
+        valid = pos >= 0
+        idx = order[np.where(valid, pos, 0)] if len(order) > 0 else np.zeros(pos.shape, dtype=np.int64)
+        pcs = np.where(valid, self.pcs[idx], np.uint64(0))
+        taken = valid & self.taken[idx]
+        return pcs, taken
+
+    def get_prior(self, uiid, n):
+        """Get the (up to) n most recent branches before uiid,
+        as (pcs, taken) arrays, from most to least recent."""
+        oldest = self.count - len(self)
+        end = self.count
+        # Skip any branches at or after uiid (e.g. if
+        # the history was already built past it)
+        while end > oldest and self.uiids[(end - 1) % self.size] >= uiid:
+            end -= 1
+        idx = np.arange(end - 1, max(oldest, end - n) - 1, -1) % self.size
+        return self.pcs[idx], self.taken[idx]
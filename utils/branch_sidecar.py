@@ -0,0 +1,175 @@
+"""Compact, columnar sidecar of the branches in a ChampSim trace.
+
+Branches are a small fraction of a ChampSim trace's 64-byte records, so
+instead of decoding the whole trace for every load-branch analysis, the
+branches' (uiid, pc, taken) are extracted once, to raw column files in
+<champsim_trace>.branches/. For each load trace, an index of each load's
+# of prior branches is saved there too, so the history of any width can
+be gathered for a load without searching.
+"""
+
+import os
+import json
+import hashlib
+import itertools
+import numpy as np
+from utils.champsim_trace import get_instruction_blocks
+from utils.load import get_open_function
+
+COLUMNS = {'uiids': np.int64, 'pcs': np.uint64, 'taken': np.bool_}
+
+
+def get_sidecar_path(champsim_trace):
+    return champsim_trace + '.branches'
+
+
+def _source(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _skip_line(line):
+    # For handling some invalid lines in the ML-DPC load traces
+    return line.startswith('***') or line.startswith('Read')
+
+
+class BranchSidecar(object):
+    """The branches of a ChampSim trace, as (memory-mapped) columns.
+
+    uiids     : instruction index of each branch (as in utils.branch_history).
+    pcs       : PC of each branch.
+    taken     : whether each branch was taken.
+    num_insts : # of instructions in the ChampSim trace.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.num_insts = self.meta['num_insts']
+        for name, dtype in COLUMNS.items():
+            col_path = os.path.join(path, f'{name}.bin')
+            if self.meta['num_branches'] > 0:
+                col = np.memmap(col_path, dtype=dtype, mode='r')
+            else:
+                col = np.empty(0, dtype=dtype)
+            setattr(self, name, col)
+
+    def __len__(self):
+        return self.meta['num_branches']
+
+    @classmethod
+    def extract(cls, cf, path, source=None, block_size=1 << 20):
+        """Extract the branches of the (open) ChampSim trace cf to a sidecar at path.
+
+        source is the [size, mtime] of the ChampSim trace, to check that
+        the sidecar is still up-to-date.
+        """
+        os.makedirs(path, exist_ok=True)
+        files = {name: open(os.path.join(path, f'{name}.bin'), 'wb') for name in COLUMNS}
+        num_insts, num_branches = 0, 0
+        try:
+            for block in get_instruction_blocks(cf, block_size):
+                is_branch = np.flatnonzero(block['is_branch'])
+                files['uiids'].write((is_branch + num_insts).astype(np.int64).tobytes())
+                files['pcs'].write(block['pc'][is_branch].tobytes())
+                files['taken'].write(block['branch_taken'][is_branch].astype(np.bool_).tobytes())
+                num_insts += len(block)
+                num_branches += len(is_branch)
+        finally:
+            for f in files.values():
+                f.close()
+
+        # Written last, so an interrupted extraction is not mistaken for a complete one
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'source': source, 'num_insts': num_insts, 'num_branches': num_branches}, f)
+        return cls(path)
+
+    def get_prior_batch(self, ends, n):
+        """Get the n most recent branches before loads with ends[i] prior branches,
+        as (pcs, taken) arrays of shape (len(ends), n), from most to least recent.
+
+        Loads with fewer than n prior branches are padded with pc 0 / not taken
+        (the same as BranchHistory.get_prior_batch).
+        """
+        pos = ends[:, None] - 1 - np.arange(n)
+        valid = pos >= 0
+        if len(self) == 0:
+            return np.zeros(pos.shape, dtype=np.uint64), np.zeros(pos.shape, dtype=bool)
+        idx = np.where(valid, pos, 0)
+        pcs = np.where(valid, self.pcs[idx], np.uint64(0))
+        taken = valid & self.taken[idx]
+        return pcs, taken
+
+    def get_load_index_path(self, load_trace):
+        # Load traces with the same name in different directories get their own index
+        path_hash = hashlib.sha256(os.path.abspath(load_trace).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.path, f'loads-{os.path.basename(load_trace)}-{path_hash}.npz')
+
+    def get_load_index(self, load_trace, chunk_size=1 << 20):
+        """Get the uiid, and # of prior branches, of each load in the load trace
+        (skipping invalid lines, like utils.load_trace.get_instructions).
+
+        The index is cached in the sidecar, and rebuilt if the load trace
+        (or the ChampSim trace) changes.
+        """
+        index_path = self.get_load_index_path(load_trace)
+        source = _source(load_trace) + (self.meta['source'] or [-1, -1])
+        if os.path.exists(index_path):
+            with np.load(index_path) as data:
+                if data['source'].tolist() == source:
+                    return data['uiids'], data['ends']
+
+        uiids = []
+        l_open = get_open_function(load_trace)
+        with l_open(load_trace, mode='rt', encoding='utf-8') as lf:
+            while True:
+                lines = list(itertools.islice(lf, chunk_size))
+                if not lines:
+                    break
+                uiids.append(np.array([int(l.split(',', 1)[0]) for l in lines if not _skip_line(l)], dtype=np.int64))
+        uiids = np.concatenate(uiids) if uiids else np.empty(0, dtype=np.int64)
+        ends = np.searchsorted(self.uiids, uiids).astype(np.int64)
+
+        with open(index_path, 'wb') as f:
+            np.savez(f, source=np.array(source, dtype=np.int64), uiids=uiids, ends=ends)
+        return uiids, ends
+
+
+def load_branch_sidecar(champsim_trace, refresh=False):
+    """Load the branch sidecar of a ChampSim trace, extracting it first
+    if it is missing, out-of-date with the trace, or refresh is set."""
+    path = get_sidecar_path(champsim_trace)
+    source = _source(champsim_trace)
+    if not refresh and os.path.exists(os.path.join(path, 'meta.json')):
+        sidecar = BranchSidecar(path)
+        if sidecar.meta['source'] == source:
+            return sidecar
+
+    print(f'Extracting branches of {champsim_trace} to {path}')
+    cs_open = get_open_function(champsim_trace)
+    with cs_open(champsim_trace, mode='rb') as cf:
+        return BranchSidecar.extract(cf, path, source=source)
+
+
+def attach_branches(insts, sidecar, ends, n, start=0, batch_size=1 << 16):
+    """Attach the n most recent branches (from the sidecar) to each load trace
+    instruction, as its branches (like in a load-branch trace).
+
+    ends is the load index of the load trace (see BranchSidecar.get_load_index),
+    and start is the index of the first of insts in the load trace. Stops at the first
+    load past the end of the ChampSim trace (which a load-branch trace would not have).
+    """
+    ends = ends[start:]
+    i = 0
+    while True:
+        batch = list(itertools.islice(insts, batch_size))
+        if not batch:
+            return
+        branch_pcs, branch_taken = sidecar.get_prior_batch(ends[i:i + len(batch)], n)
+        branch_pcs, branch_taken = branch_pcs.tolist(), branch_taken.tolist()
+        for j, inst in enumerate(batch):
+            if inst.uiid > sidecar.num_insts:
+                return
+            inst.branches = list(zip(branch_pcs[j], branch_taken[j]))
+            yield inst
+        i += len(batch)
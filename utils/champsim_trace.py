@@ -1,7 +1,21 @@
+import numpy as np
+
 INST_SIZE = 64
 N_INST_DESTS = 2
 N_INST_SRCS = 4
 
+# Layout of each instruction, to decode whole blocks of them at once.
+INST_DTYPE = np.dtype([
+    ('pc', '<u8'),
+    ('is_branch', 'u1'),
+    ('branch_taken', 'u1'),
+    ('dest_regs', 'u1', (N_INST_DESTS,)),
+    ('src_regs', 'u1', (N_INST_SRCS,)),
+    ('dest_mem', '<u8', (N_INST_DESTS,)),
+    ('src_mem', '<u8', (N_INST_SRCS,)),
+])
+assert INST_DTYPE.itemsize == INST_SIZE
+
 
 def read_champsim_trace(f, max_inst=100):
     """Read and print each instruction of the ChampSim trace,
@@ -36,6 +50,25 @@ def get_instructions(f):
         yield Instruction(bytearr)
 
 
+def get_instruction_blocks(f, block_size=1 << 20):
+    """Yield the next (up to) block_size instructions in the file,
+    as structured arrays of INST_DTYPE, as a generator."""
+    leftover = b''
+    while True:
+        bytearr = f.read(block_size * INST_SIZE)
+        if not bytearr:
+            break
+        bytearr = leftover + bytearr
+        n_insts = len(bytearr) // INST_SIZE
+        leftover = bytearr[n_insts * INST_SIZE:]
+        if n_insts == 0:
+            continue
+        block = np.frombuffer(bytearr, dtype=INST_DTYPE, count=n_insts)
+        assert block['is_branch'].max() <= 1, 'is_branch not boolean'
+        assert block['branch_taken'].max() <= 1, 'branch_taken not boolean'
+        yield block
+
+
 class Instruction:
     """Interpret a INST_SIZE byte chunk of the file
     as its proper instruction notation.
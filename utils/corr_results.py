@@ -0,0 +1,94 @@
+"""Persist correlation results and tracker checkpoints.
+
+Result stores are .npz files holding one tidy table of frequency histograms,
+with one row per (name, trigger, # of unique correlated addresses).
+Checkpoints are pickled tracker states, so long runs can be resumed
+(or merged with runs over other shards of the trace).
+"""
+
+import os
+import pickle
+import numpy as np
+from utils.load import get_open_function
+
+
+def _trigger_tuple(trigger):
+    """Normalize a trigger to (hist_len, branch_len, branch_type)."""
+    if isinstance(trigger, tuple):
+        return trigger
+    return (trigger, 0, None)
+
+
+def save_freqs(path, results):
+    """Save results, a dict of {name: freqs} (e.g. {'Weighted Cache Lines': freqs}),
+    where freqs is the output of CorrelationData.compute_freqs.
+    """
+    columns = {k: [] for k in ['name', 'hist_len', 'branch_len', 'branch_type', 'n_unique', 'count']}
+    for name, freqs in results.items():
+        for trigger, freq in freqs.items():
+            hist_len, branch_len, branch_type = _trigger_tuple(trigger)
+            for n_unique, count in sorted(freq.items()):
+                columns['name'].append(name)
+                columns['hist_len'].append(hist_len)
+                columns['branch_len'].append(branch_len)
+                columns['branch_type'].append(branch_type or '')
+                columns['n_unique'].append(n_unique)
+                columns['count'].append(count)
+
+    with open(path, 'wb') as f:
+        np.savez_compressed(
+            f,
+            name=np.array(columns['name'], dtype=str),
+            hist_len=np.array(columns['hist_len'], dtype=np.int64),
+            branch_len=np.array(columns['branch_len'], dtype=np.int64),
+            branch_type=np.array(columns['branch_type'], dtype=str),
+            n_unique=np.array(columns['n_unique'], dtype=np.int64),
+            count=np.array(columns['count'], dtype=np.int64),
+        )
+
+
+def load_freqs(path):
+    """Load a result store saved by save_freqs, as {name: {trigger: {n_unique: count}}}.
+
+    Triggers are (hist_len, branch_len, branch_type) tuples,
+    with branch_type None for triggers without branches.
+    """
+    results = {}
+    with np.load(path) as store:
+        rows = zip(
+            store['name'].tolist(), store['hist_len'].tolist(), store['branch_len'].tolist(),
+            store['branch_type'].tolist(), store['n_unique'].tolist(), store['count'].tolist()
+        )
+        for name, hist_len, branch_len, branch_type, n_unique, count in rows:
+            trigger = (hist_len, branch_len, branch_type or None)
+            results.setdefault(name, {}).setdefault(trigger, {})[n_unique] = count
+    return results
+
+
+def merge_freqs(results_list):
+    """Sum the histograms of several result stores (e.g. over different traces)."""
+    merged = {}
+    for results in results_list:
+        for name, freqs in results.items():
+            for trigger, freq in freqs.items():
+                merged_freq = merged.setdefault(name, {}).setdefault(trigger, {})
+                for n_unique, count in freq.items():
+                    merged_freq[n_unique] = merged_freq.get(n_unique, 0) + count
+    return merged
+
+
+def save_checkpoint(path, state):
+    """Atomically save a checkpoint of the run state, e.g.
+    {'args': ..., 'num_loads': ..., 'trackers': {name: tracker.__dict__}}.
+    """
+    tmp_path = path + '.tmp'
+    c_open = get_open_function(path)
+    with c_open(tmp_path, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path):
+    c_open = get_open_function(path)
+    with c_open(path, 'rb') as f:
+        return pickle.load(f)
@@ -0,0 +1,164 @@
+"""Compact counting store for correlation tracking.
+
+Counts how many times each (trigger tag, next address) pair occurs, with both
+keyed by 64-bit integer hashes. Updates are applied in vectorized batches,
+instead of one Python dict operation per trigger per load.
+"""
+
+import numpy as np
+
+HASH_SEED = np.uint64(0x9E3779B97F4A7C15)
+COMBINE_SEED = np.uint64(0xD6E8FEB86659FD93)
+
+
+def mix64(x):
+    """Scramble uint64 values (splitmix64 finalizer)."""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def extend_hash(h, values):
+    """Extend rolling prefix hashes h by one more element each, in O(1)."""
+    return mix64((h ^ values.astype(np.uint64)) + HASH_SEED)
+
+
+def combine_hashes(h1, h2):
+    """Hash the concatenation of two hashed sequences (order matters)."""
+    return mix64(mix64(h1 + COMBINE_SEED) ^ h2.astype(np.uint64))
+
+
+def _merge_sorted(keys, columns, new_keys, new_columns, new_inserts=None):
+    """Add the new_columns values of (unique, sorted) new_keys into the
+    columns of sorted keys, inserting keys that are not present yet
+    (with new_inserts as their values, if given, else new_columns).
+
+    Returns the merged keys and columns, plus which new keys were
+    already present.
+    """
+    pos = np.searchsorted(keys, new_keys)
+    found = pos < len(keys)
+    found[found] = keys[pos[found]] == new_keys[found]
+
+    for column, new_column in zip(columns, new_columns):
+        column[pos[found]] += new_column[found]
+    if not found.all():
+        keys = np.insert(keys, pos[~found], new_keys[~found])
+        new_inserts = new_columns if new_inserts is None else new_inserts
+        columns = [np.insert(c, pos[~found], n[~found]) for c, n in zip(columns, new_inserts)]
+    return keys, columns, found
+
+
+def _add_to_bins(bins, idx, weights):
+    """Add weights into bins[idx], growing bins if needed."""
+    if len(idx) == 0:
+        return bins
+    added = np.bincount(idx, weights=weights).astype(np.int64)
+    if len(added) > len(bins):
+        bins = np.concatenate((bins, np.zeros(len(added) - len(bins), dtype=np.int64)))
+    bins[:len(added)] += added
+    return bins
+
+
+class CountTable(object):
+    """Track, for every trigger tag, how often each next address follows it.
+
+    pairs / pair_counts : sorted hashes of (tag, addr) pairs, and their counts.
+    pair_tags           : the tag of each pair.
+    tags / tag_unique   : sorted tags, and the # of unique addresses following each.
+    tag_total           : the # of times each tag was seen.
+
+    The frequency histograms are maintained as the counts change:
+    freqs[n]            : # of tags with n unique addresses.
+    weighted_freqs[n]   : # of times those tags were seen.
+    """
+    def __init__(self):
+        self.pairs = np.empty(0, dtype=np.uint64)
+        self.pair_counts = np.empty(0, dtype=np.int64)
+        self.pair_tags = np.empty(0, dtype=np.uint64)
+        self.tags = np.empty(0, dtype=np.uint64)
+        self.tag_unique = np.empty(0, dtype=np.int64)
+        self.tag_total = np.empty(0, dtype=np.int64)
+        self.freqs = np.zeros(1, dtype=np.int64)
+        self.weighted_freqs = np.zeros(1, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.tags)
+
+    def add(self, tags, addrs):
+        """Count each (tags[i], addrs[i]) occurrence."""
+        if len(tags) == 0:
+            return
+        pairs = combine_hashes(tags, addrs)
+        new_pairs, first, counts = np.unique(pairs, return_index=True, return_counts=True)
+        self._add_pairs(new_pairs, tags[first], counts)
+
+    def merge(self, other):
+        """Add all the counts of another CountTable to this one."""
+        self._add_pairs(other.pairs, other.pair_tags, other.pair_counts)
+
+    def _add_pairs(self, new_pairs, new_pair_tags, counts):
+        """Add counts of (unique, sorted) pairs, whose tags are new_pair_tags."""
+        if len(new_pairs) == 0:
+            return
+        self.pairs, (self.pair_tags, self.pair_counts), found = _merge_sorted(
+            self.pairs, [self.pair_tags, self.pair_counts],
+            new_pairs, [np.zeros_like(new_pair_tags), counts],
+            new_inserts=[new_pair_tags, counts]
+        )
+
+        # Every tag adds its occurrences to its total, and its
+        # never-before-seen addresses to its unique count.
+        new_tags, inverse = np.unique(new_pair_tags, return_inverse=True)
+        tag_counts = np.bincount(inverse, weights=counts, minlength=len(new_tags)).astype(np.int64)
+        unique_counts = np.bincount(inverse[~found], minlength=len(new_tags))
+        self.tags, (self.tag_unique, self.tag_total), found = _merge_sorted(
+            self.tags, [self.tag_unique, self.tag_total],
+            new_tags, [unique_counts, tag_counts]
+        )
+
+        # Move the updated tags out of their old histogram bins,
+        # and into their new ones.
+        pos = np.searchsorted(self.tags, new_tags)
+        unique, total = self.tag_unique[pos], self.tag_total[pos]
+        old_unique = (unique - unique_counts)[found]
+        old_total = (total - tag_counts)[found]
+        self.freqs = _add_to_bins(self.freqs, old_unique, -np.ones(len(old_unique)))
+        self.freqs = _add_to_bins(self.freqs, unique, None)
+        self.weighted_freqs = _add_to_bins(self.weighted_freqs, old_unique, -old_total)
+        self.weighted_freqs = _add_to_bins(self.weighted_freqs, unique, total)
+
+    def get_freqs(self, weighted=False):
+        """Return the (weighted) frequency histogram, as {n: count}."""
+        bins = self.weighted_freqs if weighted else self.freqs
+        return {int(n): int(bins[n]) for n in np.flatnonzero(self.freqs)}
+
+
+def _run_lengths(sorted_values):
+    starts = np.flatnonzero(np.concatenate(([True], sorted_values[1:] != sorted_values[:-1])))
+    return np.diff(np.append(starts, len(sorted_values)))
+
+
+def count_freqs(tags, addrs):
+    """Count each (tags[i], addrs[i]) occurrence all at once, and return the
+    (freqs, weighted_freqs) histograms (as in CountTable.get_freqs).
+
+    For counts that are not updated later (e.g. of a whole trace), this only
+    sorts the pairs and tags once each, instead of merging them into a CountTable.
+    """
+    if len(tags) == 0:
+        return {}, {}
+    pairs = combine_hashes(tags, addrs)
+    order = np.argsort(pairs)
+    pairs = pairs[order]
+    first = np.concatenate(([True], pairs[1:] != pairs[:-1]))
+    # Both are sorted by tag, with the same tags, so they line up
+    tag_unique = _run_lengths(np.sort(tags[order][first]))
+    tag_total = _run_lengths(np.sort(tags))
+    freqs = np.bincount(tag_unique)
+    weighted_freqs = np.bincount(tag_unique, weights=tag_total).astype(np.int64)
+    nonzero = np.flatnonzero(freqs)
+    return ({int(n): int(freqs[n]) for n in nonzero},
+            {int(n): int(weighted_freqs[n]) for n in nonzero})
@@ -0,0 +1,475 @@
+"""Ingest directories of ChampSim result files into tidy tables.
+
+Every result file (<trace>-s<simpoint>.trace.<ext>-<branch predictor>-<L1I>-<L1D>-<L2>-<LLC
+prefetcher>-<replacement>-<# cores>.txt) is parsed once, in a process pool, into:
+- a row of the results table (trace, simpoint, prefetcher, config, and its stats:
+  each cache level's accesses / hits / misses by access type, prefetches, miss latency,
+  and branch prediction accuracy / MPKI), and
+- rows of the heartbeats table (one per heartbeat, with the # of warmups completed before it).
+
+Both are cached in <results_dir>/.ingest.npz, with where each file was parsed up to.
+Only new files, and the lines added to files since (e.g. while a sweep is still
+running, see watch_results), are parsed again.
+"""
+
+import os
+import re
+import glob
+import time
+import fnmatch
+import multiprocessing
+import numpy as np
+import pandas as pd
+import attrdict
+
+CACHE_NAME = '.ingest.npz'
+POOL_MIN_BYTES = 1 << 22 # Parse less than this in this process, instead of starting a pool
+CACHE_VERSION = 3 # Bump when the parsed stats change, to parse every file again
+CACHE_LEVELS = ['L1D', 'L1I', 'L2C', 'LLC']
+ACCESS_TYPES = ['TOTAL', 'LOAD', 'RFO', 'PREFETCH', 'WRITEBACK']
+PREFETCH_STATS = ['requested', 'issued', 'useful', 'useless', 'uac_correct']
+
+
+def _get_stats_dtype():
+    fields = [('roi_instructions', np.int64), ('roi_cycles', np.int64), ('roi_ipc', np.float64)]
+    for level in CACHE_LEVELS:
+        level = level.lower()
+        for access_type in ACCESS_TYPES:
+            fields += [(f'{level}_{access_type.lower()}_{k}', np.int64) for k in ['accesses', 'hits', 'misses']]
+        fields += [(f'{level}_prefetch_{k}', np.int64) for k in PREFETCH_STATS]
+        fields.append((f'{level}_average_miss_latency', np.float64))
+    fields += [('branch_accuracy', np.float64), ('branch_mpki', np.float64), ('rob_occupancy_at_mispredict', np.float64)]
+    return np.dtype(fields)
+
+
+# Every stat of the Region of Interest: each cache level's accesses / hits / misses
+# of each access type, prefetch stats and average miss latency, and branch prediction.
+# Stats missing from a result file are -1 (or NaN, for floats).
+STATS_DTYPE = _get_stats_dtype()
+STATS = list(STATS_DTYPE.names)
+# LLC stats, under the names used by the notebooks
+LEGACY_STATS = {
+    'useless_prefetches': 'llc_prefetch_useless',
+    'useful_prefetches': 'llc_prefetch_useful',
+    'uac_correct_prefetches': 'llc_prefetch_uac_correct',
+    'issued_prefetches': 'llc_prefetch_issued',
+}
+HEARTBEAT_DTYPE = np.dtype([
+    ('instructions', np.int64), ('cycles', np.int64), ('heartbeat_ipcs', np.float64),
+    ('cumulative_ipcs', np.float64), ('cumulative_sim_times', np.int64), ('warmups', np.int64),
+])
+HEARTBEAT_COLUMNS = list(HEARTBEAT_DTYPE.names)
+
+_MISSING_STATS = np.zeros((), dtype=STATS_DTYPE)
+for _k in STATS:
+    _MISSING_STATS[_k] = np.nan if STATS_DTYPE[_k].kind == 'f' else -1
+_CACHE_FIELDS = {
+    (level, access_type): tuple(f'{level.lower()}_{access_type.lower()}_{k}' for k in ['accesses', 'hits', 'misses'])
+    for level in CACHE_LEVELS for access_type in ACCESS_TYPES
+}
+
+_SIMPOINT_RE = re.compile(r'^(.*)-s(\d+)$')
+_HEARTBEAT_RE = re.compile(
+    r'Heartbeat CPU \d+ instructions: (\d+) cycles: (\d+) heartbeat IPC: (\S+) cumulative IPC: (\S+)'
+    r' \(Simulation time: (\d+) hr (\d+) min (\d+) sec\)'
+)
+_CACHE_RE = re.compile(r'(L1D|L1I|L2C|LLC) (\w+)\s+ACCESS:\s+(\d+)\s+HIT:\s+(\d+)\s+MISS:\s+(\d+)')
+_PREFETCH_RE = re.compile(
+    r'(L1D|L1I|L2C|LLC) PREFETCH\s+REQUESTED:\s+(\d+)\s+ISSUED:\s+(\d+)\s+USEFUL:\s+(\d+)\s+USELESS:\s+(\d+)'
+    r'(?:\s+UAC CORRECT:\s+(\d+))?' # Older result files have no UAC CORRECT count
+)
+_LATENCY_RE = re.compile(r'(L1D|L1I|L2C|LLC) AVERAGE MISS LATENCY: (\S+) cycles')
+_ROI_RE = re.compile(r'CPU \d+ cumulative IPC: (\S+) instructions: (\d+) cycles: (\d+)')
+_BRANCH_RE = re.compile(r'CPU \d+ Branch Prediction Accuracy: (\S+)% MPKI: (\S+) Average ROB Occupancy at Mispredict: (\S+)')
+
+# In-process cache of each ingested directory, with the stat of its files when loaded
+_loaded = {}
+
+
+def get_variation_name(path):
+    """Name the LLC prefetcher of a result file, as used in the notebooks
+    (or None, if it is not one of them)."""
+    name = os.path.basename(path)
+    if '-bo' in name:
+        return 'BO'
+    elif '-sisb_bo' in name:
+        return 'ISB+BO'
+    elif '-sisb-' in name:
+        return 'ISB'
+    elif '-no' in name:
+        return 'NoPrefetcher'
+    return None
+
+
+def split_simpoint(name):
+    """Split a trace name (e.g. 429.mcf-s2) into its benchmark and simpoint.
+    Traces without simpoints have simpoint -1."""
+    match = _SIMPOINT_RE.match(name)
+    if match:
+        return match.group(1), int(match.group(2))
+    return name, -1
+
+
+def parse_result_path(path):
+    """Get the (trace, simpoint, LLC prefetcher) of a result file from its name.
+    Traces without simpoints have simpoint -1."""
+    name = os.path.basename(path)
+    trace, _, config = name.partition('.trace')
+    trace, simpoint = split_simpoint(trace)
+    fields = config.split('-')[1:]
+    prefetcher = fields[4] if len(fields) >= 7 else ''
+    return trace, simpoint, prefetcher
+
+
+def _get_heartbeats(rows):
+    # Convert the matched heartbeat fields (all at once, instead of per line)
+    values = np.array(rows, dtype=np.float64).reshape(-1, 8)
+    heartbeats = np.empty(len(values), dtype=HEARTBEAT_DTYPE)
+    heartbeats['instructions'] = values[:, 0]
+    heartbeats['cycles'] = values[:, 1]
+    heartbeats['heartbeat_ipcs'] = values[:, 2]
+    heartbeats['cumulative_ipcs'] = values[:, 3]
+    heartbeats['cumulative_sim_times'] = values[:, 4] * 3600 + values[:, 5] * 60 + values[:, 6]
+    heartbeats['warmups'] = values[:, 7]
+    return heartbeats
+
+
+def _parse_lines(lines, stats, warmups=0):
+    # Parse lines into stats (in place), continuing from warmups completed.
+    # Returns the matched heartbeat fields and the # of warmups completed after the lines.
+    rows = []
+    for line in lines:
+        head = line[:3]
+        if head == 'Hea':
+            m = _HEARTBEAT_RE.match(line)
+            if m:
+                rows.append(m.groups() + (warmups,))
+        elif head in ('L1D', 'L1I', 'L2C', 'LLC'):
+            m = _CACHE_RE.match(line)
+            if m:
+                fields = _CACHE_FIELDS.get((m.group(1), m.group(2)))
+                if fields:
+                    for k, v in zip(fields, m.group(3, 4, 5)):
+                        stats[k] = int(v)
+                continue
+            m = _PREFETCH_RE.match(line)
+            if m:
+                level = m.group(1).lower()
+                for k, v in zip(PREFETCH_STATS, m.group(2, 3, 4, 5, 6)):
+                    if v is not None:
+                        stats[f'{level}_prefetch_{k}'] = int(v)
+                continue
+            m = _LATENCY_RE.match(line)
+            if m:
+                stats[f'{m.group(1).lower()}_average_miss_latency'] = float(m.group(2))
+        elif head == 'War':
+            if line.startswith('Warmup complete'):
+                warmups += 1
+        elif head == 'CPU':
+            m = _ROI_RE.match(line)
+            if m:
+                stats['roi_ipc'] = float(m.group(1))
+                stats['roi_instructions'] = int(m.group(2))
+                stats['roi_cycles'] = int(m.group(3))
+                continue
+            m = _BRANCH_RE.match(line)
+            if m:
+                stats['branch_accuracy'] = float(m.group(1)) / 100
+                stats['branch_mpki'] = float(m.group(2))
+                stats['rob_occupancy_at_mispredict'] = float(m.group(3))
+    return rows, warmups
+
+
+def parse_result_stream(f):
+    """Parse every heartbeat and stat of an (open) ChampSim result file, in one pass.
+
+    Each line is classified by its first word, and parsed with one precompiled
+    pattern. Returns the stats (a STATS_DTYPE record) and the heartbeats
+    (a HEARTBEAT_DTYPE array, with the # of warmups completed before each).
+    """
+    stats = _MISSING_STATS.copy()
+    rows, _ = _parse_lines(f, stats)
+    return stats, _get_heartbeats(rows)
+
+
+def parse_result_tail(path, offset=0, stats=None, warmups=0):
+    """Parse the complete lines of a ChampSim result file from byte offset on (e.g. of
+    a file still being written), continuing from the stats and # of warmups completed
+    before offset.
+
+    Returns (stats, heartbeats, offset, warmups): the new heartbeats, and the
+    parser state after the last complete line (to continue from later).
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind(b'\n') + 1
+    stats = _MISSING_STATS.copy() if stats is None else stats.copy()
+    rows, warmups = _parse_lines(data[:end].decode('utf-8').splitlines(), stats, warmups)
+    return stats, _get_heartbeats(rows), offset + end, warmups
+
+
+def parse_result_file(path):
+    """Parse every heartbeat and stat of a ChampSim result file (see parse_result_stream)."""
+    with open(path, 'r') as f:
+        return parse_result_stream(f)
+
+
+def _parse_result_tail(args):
+    return args[0], parse_result_tail(*args)
+
+
+class ResultsDataset(object):
+    """The parsed result files of a directory, as flat arrays.
+
+    files      : name, size, mtime and stats of each file, and the parser state
+                 at its end (offset parsed up to, and warmups completed).
+    heartbeats : heartbeat columns, and the index of each heartbeat's file (file).
+    """
+    def __init__(self, files, heartbeats):
+        self.files = files
+        self.heartbeats = heartbeats
+        self.index = {name: i for i, name in enumerate(files['name'].tolist())}
+
+    def __len__(self):
+        return len(self.files['name'])
+
+    @classmethod
+    def from_parsed(cls, parsed):
+        """Build from (name, size, mtime, (stats, heartbeats, offset, warmups)) of each file
+        (see parse_result_tail)."""
+        files = {
+            'name': np.array([p[0] for p in parsed], dtype=str),
+            'size': np.array([p[1] for p in parsed], dtype=np.int64),
+            'mtime': np.array([p[2] for p in parsed], dtype=np.int64),
+            'offset': np.array([p[3][2] for p in parsed], dtype=np.int64),
+            'warmups': np.array([p[3][3] for p in parsed], dtype=np.int64),
+        }
+        stats = np.array([p[3][0] for p in parsed], dtype=STATS_DTYPE)
+        for k in STATS:
+            files[k] = stats[k]
+        lengths = [len(p[3][1]) for p in parsed]
+        all_heartbeats = np.concatenate([p[3][1] for p in parsed]) if parsed else np.empty(0, dtype=HEARTBEAT_DTYPE)
+        heartbeats = {'file': np.repeat(np.arange(len(parsed), dtype=np.int32), lengths)}
+        for k in HEARTBEAT_COLUMNS:
+            heartbeats[k] = all_heartbeats[k]
+        return cls(files, heartbeats)
+
+    def get_parsed(self, i):
+        """Get file i as (stats, heartbeats, offset, warmups), like parse_result_tail."""
+        stats = np.zeros((), dtype=STATS_DTYPE)
+        for k in STATS:
+            stats[k] = self.files[k][i]
+        # Heartbeats are grouped by file
+        start, end = np.searchsorted(self.heartbeats['file'], [i, i + 1])
+        heartbeats = np.empty(end - start, dtype=HEARTBEAT_DTYPE)
+        for k in HEARTBEAT_COLUMNS:
+            heartbeats[k] = self.heartbeats[k][start:end]
+        return stats, heartbeats, int(self.files['offset'][i]), int(self.files['warmups'][i])
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            np.savez(f, version=CACHE_VERSION, **{f'file_{k}': v for k, v in self.files.items()},
+                     **{f'heartbeat_{k}': v for k, v in self.heartbeats.items()})
+
+    @classmethod
+    def load(cls, path):
+        """Load a saved dataset, or None if it was saved by an older version."""
+        with np.load(path) as data:
+            if 'version' not in data.files or int(data['version']) != CACHE_VERSION:
+                return None
+            files = {k[len('file_'):]: data[k] for k in data.files if k.startswith('file_')}
+            heartbeats = {k[len('heartbeat_'):]: data[k] for k in data.files if k.startswith('heartbeat_')}
+        return cls(files, heartbeats)
+
+
+def ingest_results(results_dir, processes=None, cache=True):
+    """Get the ResultsDataset of every result file (*.txt) in results_dir.
+
+    Unchanged files are not parsed again, and files that grew since they were last
+    parsed (e.g. of a sweep still running) are only parsed from where that parse
+    stopped. Result files are assumed to be append-only, unless they shrink.
+    Files are parsed in a pool of processes, if there is enough to parse.
+    A dataset saved in the directory is continued from, if there is one. If cache
+    is set, the dataset is also saved there, to continue from in other processes.
+    """
+    names = sorted(os.path.basename(p) for p in glob.glob(os.path.join(results_dir, '*.txt')))
+    stats = [os.stat(os.path.join(results_dir, n)) for n in names]
+    signature = tuple((n, s.st_size, s.st_mtime_ns) for n, s in zip(names, stats))
+    key = os.path.abspath(results_dir)
+    loaded = _loaded.get(key)
+    if loaded and loaded[0] == signature:
+        return loaded[1]
+
+    old = loaded[1] if loaded else None
+    cache_path = os.path.join(results_dir, CACHE_NAME)
+    if old is None and os.path.exists(cache_path):
+        old = ResultsDataset.load(cache_path)
+
+    parsed, previous, todo = {}, {}, []
+    todo_bytes = 0
+    for n, s in zip(names, stats):
+        path = os.path.join(results_dir, n)
+        i = old.index.get(n) if old is not None else None
+        if i is None or s.st_size < old.files['offset'][i]: # New, or rewritten
+            todo.append((path,))
+            todo_bytes += s.st_size
+        elif old.files['size'][i] == s.st_size and old.files['mtime'][i] == s.st_mtime_ns:
+            parsed[n] = old.get_parsed(i)
+        else: # Appended to
+            file_stats, previous[n], offset, warmups = old.get_parsed(i)
+            todo.append((path, offset, file_stats, warmups))
+            todo_bytes += s.st_size - offset
+
+    if len(todo) > 1 and todo_bytes >= POOL_MIN_BYTES:
+        with multiprocessing.Pool(min(processes or os.cpu_count(), len(todo))) as pool:
+            results = list(pool.imap_unordered(_parse_result_tail, todo, chunksize=8))
+    else:
+        results = [_parse_result_tail(args) for args in todo]
+    for path, result in results:
+        n = os.path.basename(path)
+        if n in previous:
+            file_stats, heartbeats, offset, warmups = result
+            result = (file_stats, np.concatenate((previous[n], heartbeats)), offset, warmups)
+        parsed[n] = result
+
+    if old is not None and not todo and len(old) == len(names):
+        dataset = old
+    else:
+        dataset = ResultsDataset.from_parsed([
+            (n, s.st_size, s.st_mtime_ns, parsed[n]) for n, s in zip(names, stats)
+        ])
+        if cache:
+            dataset.save(cache_path)
+    _loaded[key] = (signature, dataset)
+    return dataset
+
+
+def get_results_table(dataset, config=None):
+    """Get the tidy results table of a dataset: one row per result file, with
+    its trace, simpoint, prefetcher, config (e.g. the results directory's name),
+    file name and stats, LLC accuracy and UAC, and whether the run completed."""
+    names = dataset.files['name'].tolist()
+    keys = [parse_result_path(n) for n in names]
+    df = pd.DataFrame({
+        'trace': [k[0] for k in keys],
+        'simpoint': np.array([k[1] for k in keys], dtype=np.int64),
+        'prefetcher': [k[2] for k in keys],
+        'config': config,
+        'file': names,
+        **{k: dataset.files[k] for k in STATS},
+        **{k: dataset.files[v] for k, v in LEGACY_STATS.items()},
+    })
+    useful, useless = df.useful_prefetches, df.useless_prefetches
+    df['accuracy'] = np.where(useful + useless > 0, useful / (useful + useless).clip(lower=1), 0.)
+    df['uac'] = np.where(df.issued_prefetches > 0, df.uac_correct_prefetches / df.issued_prefetches.clip(lower=1), 0.)
+    df.loc[df.uac_correct_prefetches < 0, 'uac'] = np.nan
+    df['complete'] = df.roi_instructions >= 0 # Reached the ROI stats at the end
+    return df
+
+
+def get_heartbeats_table(dataset, config=None):
+    """Get the tidy heartbeats table of a dataset: one row per heartbeat,
+    keyed by the trace, simpoint, prefetcher and config of its file."""
+    results = get_results_table(dataset, config)
+    rows = dataset.heartbeats['file']
+    df = results[['trace', 'simpoint', 'prefetcher', 'config', 'file']].iloc[rows].reset_index(drop=True)
+    for k in HEARTBEAT_COLUMNS:
+        df[k] = dataset.heartbeats[k]
+    return df
+
+
+def _get_tables(results_dirs, datasets):
+    results, heartbeats = [], []
+    for results_dir, dataset in zip(results_dirs, datasets):
+        config = os.path.basename(os.path.normpath(results_dir))
+        results.append(get_results_table(dataset, config))
+        heartbeats.append(get_heartbeats_table(dataset, config))
+    return pd.concat(results, ignore_index=True), pd.concat(heartbeats, ignore_index=True)
+
+
+def load_results_tables(results_dirs, processes=None, cache=True):
+    """Ingest several results directories into one (results, heartbeats) pair
+    of tidy tables, with each directory's name as the config."""
+    datasets = [ingest_results(d, processes=processes, cache=cache) for d in results_dirs]
+    return _get_tables(results_dirs, datasets)
+
+
+def watch_results(results_dirs, interval=60, processes=None, cache=True):
+    """Watch results directories (e.g. of a sweep still running), and yield their
+    (results, heartbeats) tables (like load_results_tables) now, and again each
+    time a result file is added or grows.
+
+    Each poll only parses the lines added to each file since the last one.
+    """
+    datasets = None
+    while True:
+        current = [ingest_results(d, processes=processes, cache=cache) for d in results_dirs]
+        if datasets is None or any(a is not b for a, b in zip(current, datasets)):
+            datasets = current
+            yield _get_tables(results_dirs, datasets)
+        time.sleep(interval)
+
+
+def get_filtered_results(stats, heartbeats, max_instruction_num=None, min_instruction_interval=0):
+    """Get the results of a parsed result file, as in the notebooks: the heartbeats
+    after both warmups complete (at most one every min_instruction_interval instructions),
+    and every stat found, with the LLC prefetch accuracy and UAC."""
+    instructions = heartbeats['instructions'].tolist()
+    warmups = heartbeats['warmups'].tolist()
+    selected = []
+    last_instruction = 0
+    reset_warmups = 0 # Warmups completed when the warmup count was last reset
+    for j, inst in enumerate(instructions):
+        # DEBUG - Temporary fix until we can figure out why
+        # ChampSim runs too long.
+        if max_instruction_num and inst >= max_instruction_num:
+            reset_warmups = warmups[j]
+
+        if warmups[j] - reset_warmups >= 2 and inst - last_instruction > min_instruction_interval:
+            selected.append(j)
+            last_instruction = inst
+
+    data = {k: heartbeats[k][selected].tolist() for k in HEARTBEAT_COLUMNS if k != 'warmups'}
+    for k in STATS:
+        v = stats[k].item()
+        if v == v and v != -1: # Skip missing (-1 / NaN) stats
+            data[k] = v
+    for k, v in LEGACY_STATS.items():
+        if v in data:
+            data[k] = data[v]
+
+    safediv = lambda x, y: x / y if y != 0 else 0
+    if 'useful_prefetches' in data:
+        data['accuracy'] = safediv(data['useful_prefetches'], (data['useful_prefetches'] + data['useless_prefetches']))
+    if 'uac_correct_prefetches' in data:
+        data['uac'] = safediv(data['uac_correct_prefetches'], data['issued_prefetches'])
+    # Coverage must be calculated separately, since it depends on the baseline prefetcher.
+    return attrdict.AttrDict(data)
+
+
+def get_champsim_results(dataset, i, **kwargs):
+    """Get the results of file i of a dataset (see get_filtered_results)."""
+    stats, heartbeats, _, _ = dataset.get_parsed(i)
+    return get_filtered_results(stats, heartbeats, **kwargs)
+
+
+def load_champsim_results(base, tracename, verbose=False, processes=None, cache=True, **kwargs):
+    """Load the results of each prefetcher for a trace, like
+    utils.load.load_champsim_base_results, from the ingested results directory."""
+    base_path = base + f'*{tracename}*.txt'
+    dataset = ingest_results(os.path.dirname(base_path) or '.', processes=processes, cache=cache)
+    pattern = os.path.basename(base_path)
+    data = {}
+    if verbose:
+        print('Loading results from:', base_path)
+    for name in sorted(dataset.index):
+        if not fnmatch.fnmatch(name, pattern):
+            continue
+        variation_name = get_variation_name(name)
+        if variation_name is None:
+            continue
+        data[variation_name] = get_champsim_results(dataset, dataset.index[name], **kwargs)
+    if verbose:
+        print('    Found variations:', *data.keys())
+    return data
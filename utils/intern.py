@@ -0,0 +1,150 @@
+"""Intern load trace addresses and PCs as dense integer ids.
+
+Instead of keying dicts on 64-bit addresses / PCs (or tuples of them),
+analyses can map each distinct value to a dense int32 id in one vectorized
+pass, and then index flat arrays by id.
+"""
+
+import os
+import numpy as np
+from utils.load import get_open_function
+
+
+def intern(values):
+    """Map values to dense int32 ids.
+
+    Returns (ids, uniques), where uniques is sorted and uniques[ids] == values.
+    """
+    uniques, ids = np.unique(values, return_inverse=True)
+    return ids.astype(np.int32).reshape(-1), uniques
+
+
+def previous_occurrence(ids):
+    """For each position, get the index of the previous position with the same id
+    (or -1 if there is none)."""
+    order = np.argsort(ids, kind='stable')
+    same = ids[order[1:]] == ids[order[:-1]]
+    prev = np.full(len(ids), -1, dtype=np.int64)
+    prev[order[1:][same]] = order[:-1][same]
+    return prev
+
+
+def last_assignment(keys, values, times, query_keys, query_times):
+    """Replay a sequence of assignments table[keys[i]] = values[i], made at times[i],
+    and look up table[query_keys[j]] at query_times[j] (after any assignments
+    made at the same time).
+
+    Returns the looked up values, and whether each key had been assigned yet.
+    """
+    n = len(keys)
+    all_keys = np.concatenate((keys, query_keys))
+    all_times = np.concatenate((times, query_times))
+
+    # Sort by key, then time (with assignments before queries at the same time)
+    order = np.lexsort((np.arange(len(all_keys)), all_times, all_keys))
+    is_query = order >= n
+
+    # Carry the position of the most recent assignment forward, within each key
+    last = np.where(is_query, -1, np.arange(len(order)))
+    last = np.maximum.accumulate(last)[is_query]
+    query_pos = order[is_query] - n
+    found = last >= 0
+    found[found] = all_keys[order[last[found]]] == query_keys[query_pos[found]]
+
+    result = np.zeros(len(query_keys), dtype=values.dtype)
+    result[query_pos[found]] = values[order[last[found]]]
+    assigned = np.zeros(len(query_keys), dtype=bool)
+    assigned[query_pos] = found
+    return result, assigned
+
+
+def _skip_line(line):
+    # Necessary for some extraneous lines in MLPrefetchingCompetition traces
+    return (line.startswith('***') or line.startswith('Read')
+            or 'Warmup' in line or 'Heartbeat' in line or len(line.strip()) == 0)
+
+
+class InternedLoadTrace(object):
+    """A load trace, as flat arrays of instruction ids and interned
+    cache lines, pages and PCs.
+
+    inst_ids                  : instruction id of each load.
+    line_ids / page_ids / pc_ids : id of each load's cache line / page / PC.
+    lines / pages / pcs       : the value of each id.
+    """
+    FIELDS = ['inst_ids', 'line_ids', 'page_ids', 'pc_ids', 'lines', 'pages', 'pcs']
+
+    def __init__(self, inst_ids, addrs, pcs):
+        self.inst_ids = inst_ids
+        self.line_ids, self.lines = intern(addrs >> np.uint64(6))
+        self.page_ids, self.pages = intern(addrs >> np.uint64(12))
+        self.pc_ids, self.pcs = intern(pcs)
+
+    def __len__(self):
+        return len(self.inst_ids)
+
+    @classmethod
+    def from_file(cls, f):
+        """Parse an (ML Prefetching Competition) load trace,
+        with lines of either uiid, cycle, addr, pc, hit or uiid, addr, pc."""
+        inst_ids, addrs, pcs = [], [], []
+        for line in f:
+            if _skip_line(line):
+                continue
+            split = line.strip().split(', ')
+            inst_ids.append(int(split[0]))
+            if len(split) == 3:
+                addrs.append(int(split[1], 16))
+                pcs.append(int(split[2], 16))
+            else:
+                addrs.append(int(split[2], 16))
+                pcs.append(int(split[3], 16))
+
+        return cls(
+            np.array(inst_ids, dtype=np.int64),
+            np.array(addrs, dtype=np.uint64),
+            np.array(pcs, dtype=np.uint64)
+        )
+
+    def save(self, path, source_stat=None):
+        """Save the interned trace (and, optionally, the stat of the
+        trace it was built from, to check it is still up-to-date)."""
+        source = [source_stat.st_size, source_stat.st_mtime_ns] if source_stat else [-1, -1]
+        with open(path, 'wb') as f:
+            np.savez(f, source=np.array(source, dtype=np.int64),
+                     **{k: getattr(self, k) for k in self.FIELDS})
+
+    @classmethod
+    def load(cls, path):
+        trace = cls.__new__(cls)
+        with np.load(path) as data:
+            for k in cls.FIELDS:
+                setattr(trace, k, data[k])
+        return trace
+
+
+def get_cache_path(load_trace):
+    return load_trace + '.intern.npz'
+
+
+def load_interned_trace(load_trace, cache=False):
+    """Load and intern a load trace.
+
+    If cache is set, the interned trace is saved alongside the load trace,
+    and reused as long as the load trace is unchanged.
+    """
+    stat = os.stat(load_trace)
+    cache_path = get_cache_path(load_trace)
+    if cache and os.path.exists(cache_path):
+        with np.load(cache_path) as data:
+            up_to_date = data['source'].tolist() == [stat.st_size, stat.st_mtime_ns]
+        if up_to_date:
+            return InternedLoadTrace.load(cache_path)
+
+    l_open = get_open_function(load_trace)
+    with l_open(load_trace, mode='rt', encoding='utf-8') as f:
+        trace = InternedLoadTrace.from_file(f)
+
+    if cache:
+        trace.save(cache_path, stat)
+    return trace
@@ -2,9 +2,10 @@ import os
 import glob
 import lzma
 import gzip
+import warnings
 import numpy as np
 import pandas as pd
-import attrdict
+from utils.ingest import split_simpoint, load_champsim_results, parse_result_stream, get_filtered_results
 
 
 def get_open_function(path):
@@ -17,106 +18,97 @@ def get_open_function(path):
 
 
 
-def load_simpoint_weights(simpoints_dir, trace):
-    """Load simpoint weights for a given trace."""
-    simpoints = pd.DataFrame(columns=['trace', 'weight'])
-    for f in glob.glob(os.path.join(simpoints_dir, '*.csv')):
-        df = pd.read_csv(f)
-        simpoints = pd.concat((simpoints, df))
-    tr_points = simpoints[simpoints.trace.str.contains(trace)]
-    weights = np.array(tr_points.weight.array)
-    return weights
+class SimpointWeights(object):
+    """The simpoint weights of every trace in a directory of CSVs (trace, weight),
+    indexed by exact benchmark name (e.g. 429.mcf) and simpoint.
+
+    weights : benchmark -> array of the weight of each simpoint (NaN for any missing).
+    sums    : benchmark -> sum of its weights.
+    """
+    def __init__(self, simpoints_dir):
+        self.simpoints_dir = simpoints_dir
+        self.signature = get_simpoint_signature(simpoints_dir)
+        points = {}
+        for path, _, _ in self.signature:
+            df = pd.read_csv(path)
+            for trace, weight in zip(df.trace.tolist(), df.weight.tolist()):
+                benchmark, simpoint = split_simpoint(trace)
+                simpoint = max(simpoint, 0)
+                assert (benchmark, simpoint) not in points, f'Duplicate simpoint weight for {trace} in {path}'
+                points[(benchmark, simpoint)] = weight
+
+        counts = {}
+        for benchmark, simpoint in points:
+            counts[benchmark] = max(counts.get(benchmark, 0), simpoint + 1)
+        self.weights = {b: np.full(n, np.nan) for b, n in counts.items()}
+        for (benchmark, simpoint), weight in points.items():
+            self.weights[benchmark][simpoint] = weight
+        self.sums = {b: np.nansum(w) for b, w in self.weights.items()}
+
+    def __contains__(self, benchmark):
+        return benchmark in self.weights
+
+    def get(self, benchmark, normalize=False):
+        """Get the weight of each simpoint of a benchmark, optionally normalized to sum to 1."""
+        weights = self.weights[benchmark]
+        return weights / self.sums[benchmark] if normalize else weights.copy()
+
+    def get_unnormalized(self, tolerance=1e-3):
+        """Get the sum of the weights of each benchmark whose weights do not sum to 1."""
+        return {b: s for b, s in self.sums.items() if abs(s - 1) > tolerance}
+
+
+# Loaded once per process, and again if the CSVs change
+_simpoint_weights = {}
+
+
+def get_simpoint_signature(simpoints_dir):
+    paths = sorted(glob.glob(os.path.join(simpoints_dir, '*.csv')))
+    return tuple((p, os.stat(p).st_size, os.stat(p).st_mtime_ns) for p in paths)
+
+
+def get_simpoint_weights(simpoints_dir):
+    """Get the SimpointWeights of a directory, loading it only if it is not loaded yet
+    (or the CSVs changed since)."""
+    key = os.path.abspath(simpoints_dir)
+    registry = _simpoint_weights.get(key)
+    if registry is None or registry.signature != get_simpoint_signature(simpoints_dir):
+        registry = _simpoint_weights[key] = SimpointWeights(simpoints_dir)
+    return registry
+
+
+def load_simpoint_weights(simpoints_dir, trace, normalize=False, tolerance=1e-3):
+    """Load simpoint weights for a given trace (benchmark name, e.g. 429.mcf).
+
+    Warns if the weights do not sum to 1 (within tolerance), unless normalize is set.
+    """
+    registry = get_simpoint_weights(simpoints_dir)
+    assert trace in registry, f'No simpoint weights for {trace} in {simpoints_dir}'
+    if not normalize and abs(registry.sums[trace] - 1) > tolerance:
+        warnings.warn(f'Simpoint weights of {trace} sum to {registry.sums[trace]:.4f}, not 1')
+    return registry.get(trace, normalize=normalize)
 
 
 def parse_champsim_result_file(f, max_instruction_num=None, min_instruction_interval=0):
-    data = {
-        'instructions': [],
-        'cycles': [],
-        'heartbeat_ipcs': [],
-        'cumulative_ipcs': [],
-        'cumulative_sim_times': [],
-    }
-
-    last_instruction = 0
-    warmups_completed = 0 # 0 = none, 1 = CPU, 2 = CPU + prefetch
-    for line in f:
-        line_tokens = line.split(' ')
-
-        # Only append data after the prefetch warmup completes.
-        # DEBUG - Hardcoded stop condition (for now. It should stop
-        # automatically, but for some reason it doesn't).
-        if 'Warmup complete' in line:
-            warmups_completed += 1
-
-        if 'Heartbeat' in line:
-            #print(line)
-            instructions = int(line_tokens[line_tokens.index('instructions:') + 1])
-            cycles = int(line_tokens[line_tokens.index('cycles:') + 1])
-            heartbeat_ipc = float(line_tokens[line_tokens.index('heartbeat') + 2])
-            cumulative_ipc = float(line_tokens[line_tokens.index('cumulative') + 2])
-            cumulative_sim_time = int(line_tokens[line_tokens.index('time:') + 1]) * 3600 \
-                + int(line_tokens[line_tokens.index('time:') + 3]) * 60 \
-                + int(line_tokens[line_tokens.index('time:') + 5]) \
-
-            # DEBUG - Temporary fix until we can figure out why
-            # ChampSim runs too long.
-            if max_instruction_num and instructions >= max_instruction_num:
-                warmups_completed = 0
-
-            if warmups_completed >= 2 and instructions - last_instruction > min_instruction_interval:
-                data['instructions'].append(instructions)
-                data['cycles'].append(cycles)
-                data['heartbeat_ipcs'].append(heartbeat_ipc)
-                data['cumulative_ipcs'].append(cumulative_ipc)
-                data['cumulative_sim_times'].append(cumulative_sim_time)
-                last_instruction = instructions
-
-        if 'LLC PREFETCH' in line and 'REQUESTED' in line:
-            #print(line)
-            #print(line.split())
-            data['useless_prefetches'] = int(line.split()[-4])
-            data['useful_prefetches'] = int(line.split()[-6])
-            data['uac_correct_prefetches'] = int(line.split()[-1])
-            data['issued_prefetches'] = int(line.split()[-8])
-        if 'LLC LOAD' in line:
-            data['llc_load_hits'] = int(line.split()[-3])
-            data['llc_load_misses'] = int(line.split()[-1])
-        if 'LLC RFO' in line:
-            data['llc_rfo_hits'] = int(line.split()[-3])
-            data['llc_rfo_misses'] = int(line.split()[-1])
-
-    safediv = lambda x, y: x / y if y != 0 else 0
-    data['accuracy'] = safediv(data['useful_prefetches'], (data['useful_prefetches'] + data['useless_prefetches']))
-    data['uac'] = safediv(data['uac_correct_prefetches'], data['issued_prefetches'])
-    # Coverage must be calculated separately, since it depends on the baseline prefetcher.
-
-    return attrdict.AttrDict(data)
-
-
-def load_champsim_base_results(base, tracename, verbose=False, **kwargs):
-    base_path = base + f'*{tracename}*.txt'
-    data = {}
-    if verbose:
-        print('Loading results from:', base_path)
-    variation_paths = sorted(glob.glob(base_path))
-    for path in variation_paths:
-        if '-bo' in os.path.basename(path):
-            variation_name = 'BO'
-        elif '-sisb_bo' in os.path.basename(path):
-            variation_name = 'ISB+BO'
-        elif '-sisb-' in os.path.basename(path):
-            variation_name = 'ISB'
-        elif '-no' in os.path.basename(path):
-            variation_name = 'NoPrefetcher'
-        else:
-            continue
-        with open(path, 'r') as f:
-            data[variation_name] = parse_champsim_result_file(
-                f, **kwargs
-            )
-    if verbose:
-        print('    Found variations:', *data.keys())
-    return data
+    """Parse an (open) ChampSim result file: its heartbeats after warmup, and the
+    stats of every cache level and the branch predictor (see utils.ingest)."""
+    stats, heartbeats = parse_result_stream(f)
+    return get_filtered_results(
+        stats, heartbeats,
+        max_instruction_num=max_instruction_num,
+        min_instruction_interval=min_instruction_interval
+    )
+
+
+def load_champsim_base_results(base, tracename, verbose=False, cache=False, **kwargs):
+    """Load the results of each prefetcher for a trace.
+
+    The results directory is ingested once per process by utils.ingest,
+    so repeated calls only parse new / changed result files. The directory
+    is only written to (the ingested dataset, to reuse in other processes)
+    if cache is set.
+    """
+    return load_champsim_results(base, tracename, verbose=verbose, cache=cache, **kwargs)
 
 
 def parse_paper_result_file(f, strip_prefixes=False):
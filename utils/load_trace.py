@@ -1,3 +1,9 @@
+from collections import deque
+import numpy as np
+
+FRACTION_INTERVAL = 1024 # Loads between checks of the fraction of the file read, when sampling by it
+
+
 class LoadTraceInstruction(object):
     """Track load trace instruction in an orderly manner."""
     def __init__(self, line):
@@ -22,13 +28,92 @@ class LoadTraceInstruction(object):
         return s
 
 
-def get_instructions(f):
+def get_instructions(f, skip=0):
     """Process the load trace as a generator, (note the yield)
     yielding every loaded data address.
     Can call using gather_correlation_data inside an
-    open (or variant) context."""
+    open (or variant) context.
+
+    The first skip instructions are passed over without being parsed
+    (e.g. when resuming from a checkpoint)."""
     for line in f:
         # For handling some invalid lines in the ML-DPC load traces
         if line.startswith('***') or line.startswith('Read'):
             continue
+        if skip > 0:
+            skip -= 1
+            continue
         yield LoadTraceInstruction(line)
+
+
+def get_sampled_instructions(f, windows, warmup=0, by_uiid=False, get_fraction=None):
+    """Process only the sampled windows of the load trace, as a generator.
+
+    windows is a sorted list of (start, end) load indices (or if by_uiid,
+    uiids) of each window (see utils.sampling.get_slice_windows). If get_fraction
+    (the fraction of the file read so far, see utils.logging.get_file_fraction)
+    is given, windows are instead (start fraction, # of loads), and each window
+    starts at the first load read once that fraction of the file has been read
+    (checked every FRACTION_INTERVAL loads). Each window is first warmed up
+    with the (up to) warmup loads before it.
+
+    Yields (window index, instruction, whether the load only warms up the
+    window), for every window containing the load, and (window index, None,
+    False) once a window is complete, i.e. its last load (or a load past it)
+    has been read. Windows the trace ends in are never completed. Loads
+    outside of every window are passed over without being parsed."""
+    lnum = 0
+    next_window = 0
+    active = {} # End (load index, or uiid) of each active window
+    recent = deque(maxlen=warmup) # Lines of the loads before the current one, to warm up with
+    fraction = 0.
+    for line in f:
+        # For handling some invalid lines in the ML-DPC load traces
+        if line.startswith('***') or line.startswith('Read'):
+            continue
+        pos = int(line.split(',', 1)[0]) if by_uiid else lnum
+        if get_fraction is not None and lnum % FRACTION_INTERVAL == 0:
+            fraction = get_fraction() or 0.
+        for w in [w for w, end in active.items() if end <= pos]:
+            del active[w]
+            yield w, None, False
+        started = {}
+        while next_window < len(windows) and windows[next_window][0] <= (pos if get_fraction is None else fraction):
+            end = windows[next_window][1] if get_fraction is None else lnum + windows[next_window][1]
+            if end <= pos: # No loads in the window
+                yield next_window, None, False
+            else:
+                started[next_window] = end
+            next_window += 1
+        if not active and not started and next_window == len(windows):
+            break
+
+        if active or started:
+            inst = LoadTraceInstruction(line)
+            for w in started:
+                for prev in recent:
+                    yield w, LoadTraceInstruction(prev), True
+            active.update(started)
+            for w in active:
+                yield w, inst, False
+            for w in [w for w, end in active.items() if end - 1 <= pos]:
+                del active[w]
+                yield w, None, False
+        if warmup > 0:
+            recent.append(line)
+        lnum += 1
+
+
+def format_loadbranch_rows(lines, branch_pcs, branch_taken):
+    """Format load-branch trace rows, appending each load's
+    branches (PC, T/NT) to its load trace line."""
+    rows = np.array([l.rstrip('\n') for l in lines], dtype=object)
+    if branch_pcs.shape[1] > 0:
+        # Format each unique (branch PC, decision) once
+        keys = (branch_pcs << np.uint64(1)) | branch_taken.astype(np.uint64)
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        pieces = np.array([f', {hex(k >> 1)[2:]}, {k & 1}' for k in unique_keys.tolist()], dtype=object)
+        pieces = pieces[inverse.reshape(keys.shape)]
+        for i in range(branch_pcs.shape[1]):
+            rows = rows + pieces[:, i]
+    return ''.join(row + '\n' for row in rows.tolist())
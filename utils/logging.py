@@ -1,9 +1,236 @@
+import io
+import os
+import json
+import itertools
 import time
+import resource
 
-def log_progress(iter_num, n_iters, start_time, interval=10000):
-    # TODO add RAM usage.
+PROFILE_ENV = 'VOYAGER_PROFILE' # Set to cprofile / tracemalloc to profile every instrumented script run
+PROFILE_MODES = ['cprofile', 'tracemalloc']
+
+
+def get_rss():
+    """Get the current resident set size of this process, in bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return get_peak_rss()
+
+
+def get_peak_rss():
+    """Get the peak resident set size of this process, in bytes."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # in KB on Linux
+
+
+def _format_memory():
+    return f'(RSS {get_rss() / (1 << 30):.2f} GB, peak {get_peak_rss() / (1 << 30):.2f} GB)'
+
+
+def log_progress(iter_num, n_iters, start_time, interval=10000, instr=None):
     if iter_num > 0 and iter_num % interval == 0:
         pct = iter_num / n_iters
         elapsed_time = time.time() - start_time
         left_time = (elapsed_time / iter_num * n_iters) - elapsed_time # estimated time left
-        print(f'{iter_num} / {n_iters} ({pct*100:.2f}%) ({elapsed_time / 60:.2f} min) ({left_time / 60:.2f} min est. rem.)')
\ No newline at end of file
+        print(f'{iter_num} / {n_iters} ({pct*100:.2f}%) ({elapsed_time / 60:.2f} min) ({left_time / 60:.2f} min est. rem.) {_format_memory()}')
+        if instr:
+            instr.sample(iter_num, pct)
+
+
+def get_file_fraction(f):
+    """Get the fraction of the file read so far, from the byte offset of the
+    underlying (for .xz / .gz files, compressed) file, or None if unknown.
+
+    Works through text / lzma / gzip wrappers, since they all pass
+    fileno() through to the file they read from.
+    """
+    try:
+        fd = f.fileno()
+        size = os.fstat(fd).st_size
+        return os.lseek(fd, 0, os.SEEK_CUR) / size if size > 0 else None
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+
+
+def log_file_progress(iter_num, f, start_time, interval=10000, instr=None):
+    """Like log_progress, but estimating the progress from how much of the
+    file f has been read, so the lines do not need to be counted first."""
+    if iter_num > 0 and iter_num % interval == 0:
+        pct = get_file_fraction(f)
+        elapsed_time = time.time() - start_time
+        if not pct:
+            print(f'{iter_num} ({elapsed_time / 60:.2f} min) {_format_memory()}')
+        else:
+            left_time = (elapsed_time / pct) - elapsed_time # estimated time left
+            print(f'{iter_num} ({pct*100:.2f}%) ({elapsed_time / 60:.2f} min) ({left_time / 60:.2f} min est. rem.) {_format_memory()}')
+        if instr:
+            instr.sample(iter_num, pct)
+
+
+class _Stage(object):
+    def __init__(self, instr, name):
+        self.instr = instr
+        self.name = name
+
+    def __enter__(self):
+        self.instr._enter(self.name)
+
+    def __exit__(self, *args):
+        self.instr._exit()
+
+
+class Instrumentation(object):
+    """Time the stages of a run (e.g. decompress, parse, update, write),
+    count the records each processes, and sample the memory used.
+
+    Stage times are exclusive: time spent in a stage nested inside another
+    (e.g. parsing lines pulled from inside the update loop) only counts towards
+    the inner stage. Time outside every stage is reported as 'other'.
+
+    metrics : path to append JSON lines to (a progress line per sample,
+              and a line per stage and a summary line on report).
+    profile : also profile the run with cProfile or tracemalloc.
+    """
+    def __init__(self, name='run', metrics=None, profile=None):
+        self.name = name
+        self.metrics = metrics
+        self.times = {}
+        self.counts = {}
+        self.max_rss = 0
+        self._stack = []
+        self._since = None
+        self._start = time.perf_counter()
+
+        self.profile = profile or None
+        assert self.profile in PROFILE_MODES + [None], f'Unknown profile mode {self.profile}, must be one of {PROFILE_MODES}'
+        self.profiler = None
+        if self.profile == 'cprofile':
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif self.profile == 'tracemalloc':
+            import tracemalloc
+            tracemalloc.start()
+
+    def _enter(self, name):
+        now = time.perf_counter()
+        if self._stack:
+            self.times[self._stack[-1]] += now - self._since
+        self._stack.append(name)
+        self.times.setdefault(name, 0.)
+        self._since = now
+
+    def _exit(self):
+        now = time.perf_counter()
+        self.times[self._stack.pop()] += now - self._since
+        self._since = now
+
+    def stage(self, name):
+        """Context manager timing a stage."""
+        return _Stage(self, name)
+
+    def timed(self, name, iterable, batch_size=1, count=None):
+        """Iterate over iterable, timing (and counting the items of) the
+        stage of producing each item.
+
+        For cheap items (e.g. lines), pass a batch_size to produce (and time)
+        them in batches instead, so timing does not slow down the hot loop.
+        For chunked items (e.g. blocks of instructions), pass count to get the
+        # of records in each item.
+        """
+        it = iter(iterable)
+        self.counts.setdefault(name, 0)
+        if batch_size == 1:
+            while True:
+                self._enter(name)
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+                finally:
+                    self._exit()
+                self.counts[name] += count(item) if count else 1
+                yield item
+
+        while True:
+            self._enter(name)
+            try:
+                batch = list(itertools.islice(it, batch_size))
+            finally:
+                self._exit()
+            if not batch:
+                return
+            self.counts[name] += len(batch)
+            yield from batch
+
+    def count(self, name, n=1):
+        """Count n records processed by a stage."""
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def add_time(self, name, seconds):
+        """Add time measured elsewhere (e.g. by utils.pipeline) to a stage."""
+        self.times[name] = self.times.get(name, 0.) + seconds
+
+    def _emit(self, record):
+        if self.metrics:
+            with open(self.metrics, 'a') as f:
+                print(json.dumps({'name': self.name, **record}), file=f)
+
+    def sample(self, records=None, fraction=None):
+        """Sample the memory used (e.g. with each progress update)."""
+        rss = get_rss()
+        self.max_rss = max(self.max_rss, rss)
+        self._emit({
+            'event': 'progress', 'elapsed': time.perf_counter() - self._start,
+            'records': records, 'fraction': fraction, 'rss': rss, 'peak_rss': get_peak_rss()
+        })
+
+    def report(self):
+        """Print the time spent in each stage (and the profile, if enabled),
+        and append it to the metrics file."""
+        self.sample()
+        total = time.perf_counter() - self._start
+        times = dict(self.times)
+        times['other'] = max(0., total - sum(self.times.values()))
+
+        print(f'Time per stage ({self.name}):')
+        for name, t in times.items():
+            line = f'    {name:12}: {t:10.2f} s ({t / total * 100 if total else 0:5.1f}%)'
+            records = self.counts.get(name)
+            if records:
+                line += f' {records:12} records ({records / t if t else 0:.0f} / s)'
+            print(line)
+            self._emit({'event': 'stage', 'stage': name, 'seconds': t, 'records': records,
+                        'records_per_s': records / t if records and t else None})
+        print(f'    {"total":12}: {total:10.2f} s')
+        print(f'    {"memory":12}: {_format_memory()}')
+        summary = {'event': 'summary', 'seconds': total, 'rss': get_rss(), 'peak_rss': get_peak_rss()}
+
+        if self.profile == 'cprofile':
+            import pstats
+            self.profiler.disable()
+            stats = pstats.Stats(self.profiler).sort_stats('cumulative')
+            stats.print_stats(20)
+            if self.metrics:
+                stats.dump_stats(self.metrics + '.prof')
+        elif self.profile == 'tracemalloc':
+            import tracemalloc
+            snapshot = tracemalloc.take_snapshot()
+            _, summary['traced_peak'] = tracemalloc.get_traced_memory()
+            print('Top allocations:')
+            for stat in snapshot.statistics('lineno')[:10]:
+                print('   ', stat)
+            tracemalloc.stop()
+        self._emit(summary)
+
+
+def add_instrumentation_arguments(parser):
+    parser.add_argument('--metrics', type=str, default=None)
+    parser.add_argument('--profile', choices=PROFILE_MODES, default=None)
+
+
+def get_instrumentation(name, args):
+    """Start instrumenting a run, from the arguments added
+    by add_instrumentation_arguments (or the VOYAGER_PROFILE environment variable,
+    which only applies to the runs of scripts, not to library calls)."""
+    return Instrumentation(name, metrics=args.metrics, profile=args.profile or os.environ.get(PROFILE_ENV))
@@ -0,0 +1,189 @@
+"""Content-addressed memoization of analysis runs.
+
+A run of an entry point (e.g. corr_load, sisb) is keyed by the entry point, its
+normalized arguments, the code version (a hash of every script / module of the
+repository) and the fingerprint (path, size and mtime) of each of its input files.
+What it printed, and the output files it wrote, are stored under that key in a
+local cache directory, so running it again with the same inputs and arguments
+just prints the same output and copies the output files back.
+
+Memoization is opt-in, since output files (e.g. prefetch traces) can be large:
+pass --memo (or set the VOYAGER_MEMO environment variable) to use and store
+cached runs, or --refresh to run again and replace the cached run.
+The least recently used runs are evicted to keep the cache under a disk budget.
+The cache directory and budget (in GB) can be set with the VOYAGER_CACHE_DIR and
+VOYAGER_CACHE_BUDGET environment variables.
+"""
+
+import io
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import hashlib
+import contextlib
+
+MEMO_ENV = 'VOYAGER_MEMO'
+CACHE_DIR_ENV = 'VOYAGER_CACHE_DIR'
+CACHE_BUDGET_ENV = 'VOYAGER_CACHE_BUDGET'
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'voyager-analysis')
+DEFAULT_CACHE_BUDGET = 20 # GB
+# Arguments that do not change a run's results
+IGNORED_ARGS = ['metrics', 'profile', 'memo', 'refresh', 'cache']
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CODE_DIRS = ['corr', 'prefetch', 'trace', 'utils']
+
+_code_version = None
+
+
+def get_code_version():
+    """Hash every script / module of the repository, so any change to
+    the code invalidates the cached runs."""
+    global _code_version
+    if _code_version is None:
+        h = hashlib.sha256()
+        for path in sorted(p for d in CODE_DIRS for p in glob.glob(os.path.join(ROOT, d, '*.py'))):
+            h.update(os.path.relpath(path, ROOT).encode('utf-8'))
+            with open(path, 'rb') as f:
+                h.update(f.read())
+        _code_version = h.hexdigest()
+    return _code_version
+
+
+def get_fingerprint(path):
+    """Get the [path, size, mtime] of an input file (or of each of a list of them)."""
+    if path is None:
+        return None
+    if isinstance(path, (list, tuple)):
+        return [get_fingerprint(p) for p in path]
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def _get_size(path):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+
+def evict(cache_dir, budget, keep=None):
+    """Delete the least recently used runs in cache_dir (but keep), until it is under budget bytes."""
+    entries = []
+    for name in os.listdir(cache_dir):
+        meta_path = os.path.join(cache_dir, name, 'meta.json')
+        if os.path.exists(meta_path): # Skip runs still being stored
+            entries.append((os.stat(meta_path).st_mtime_ns, _get_size(os.path.join(cache_dir, name)), name))
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= budget:
+            break
+        if name == keep:
+            continue
+        shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+        total -= size
+
+
+class _Tee(io.TextIOBase):
+    def __init__(self, *streams):
+        self.streams = streams
+
+    def write(self, s):
+        for stream in self.streams:
+            stream.write(s)
+        return len(s)
+
+    def flush(self):
+        for stream in self.streams:
+            stream.flush()
+
+
+class Memo(object):
+    """The cached run of an entry point, with the given arguments
+    (an argparse namespace, or a dict).
+
+    inputs  : names of the arguments that are input file paths (or lists of them).
+    outputs : names of the arguments that are output file paths (or None, if not written).
+    enabled : whether to use (and store) the cached run at all.
+    refresh : run again, and replace the cached run.
+    """
+    def __init__(self, name, args, inputs=(), outputs=(), enabled=True, refresh=False,
+                 cache_dir=None, budget=None):
+        args = dict(args if isinstance(args, dict) else vars(args))
+        self.name = name
+        self.enabled = enabled
+        self.refresh = refresh
+        self.cache_dir = cache_dir or os.environ.get(CACHE_DIR_ENV) or DEFAULT_CACHE_DIR
+        self.budget = int((budget or float(os.environ.get(CACHE_BUDGET_ENV, DEFAULT_CACHE_BUDGET))) * (1 << 30))
+        self.outputs = [args[k] for k in outputs]
+
+        # Which outputs are written changes the run, but not where
+        key_args = {k: v for k, v in args.items() if k not in IGNORED_ARGS and k not in outputs}
+        for k in inputs:
+            key_args[k] = get_fingerprint(key_args[k])
+        key_args['outputs'] = [path is not None for path in self.outputs]
+        self.args = key_args
+        key = json.dumps({'name': name, 'args': key_args, 'code': get_code_version()}, sort_keys=True, default=str)
+        self.path = os.path.join(self.cache_dir, f'{name}-{hashlib.sha256(key.encode("utf-8")).hexdigest()}')
+
+    def restore(self):
+        """If the run is cached, print what it printed, copy its output files
+        to this run's output paths, and return True."""
+        meta_path = os.path.join(self.path, 'meta.json')
+        if not self.enabled or self.refresh or not os.path.exists(meta_path):
+            return False
+        with open(meta_path) as f:
+            meta = json.load(f)
+        for i, path in enumerate(self.outputs):
+            if path is not None and meta['outputs'][i]:
+                shutil.copyfile(os.path.join(self.path, 'outputs', str(i)), path)
+        with open(os.path.join(self.path, 'stdout.txt'), encoding='utf-8') as f:
+            sys.stdout.write(f.read())
+        # On stderr, so the output is the same as the run's (e.g. for diff_sweep to parse)
+        print(f'Restored the cached run of {time.ctime(meta["created"])} ({self.path})', file=sys.stderr)
+        os.utime(meta_path) # Mark as recently used
+        return True
+
+    @contextlib.contextmanager
+    def record(self):
+        """Run the body (printing as usual), and if it completes, store what
+        it printed and the output files it wrote as the cached run."""
+        if not self.enabled:
+            yield
+            return
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(_Tee(sys.stdout, stdout)):
+            yield
+        self._store(stdout.getvalue())
+
+    def _store(self, stdout):
+        # Stored in a temporary directory first, so a partly stored run is never restored
+        tmp_path = f'{self.path}.tmp-{os.getpid()}'
+        os.makedirs(os.path.join(tmp_path, 'outputs'), exist_ok=True)
+        written = []
+        for i, path in enumerate(self.outputs):
+            written.append(path is not None and os.path.exists(path))
+            if written[-1]:
+                shutil.copyfile(path, os.path.join(tmp_path, 'outputs', str(i)))
+        with open(os.path.join(tmp_path, 'stdout.txt'), 'w', encoding='utf-8') as f:
+            f.write(stdout)
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump({'name': self.name, 'args': self.args, 'created': time.time(), 'outputs': written},
+                      f, default=str)
+
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.rename(tmp_path, self.path)
+        evict(self.cache_dir, self.budget, keep=os.path.basename(self.path))
+
+
+def add_memo_arguments(parser):
+    parser.add_argument('--memo', action='store_true')
+    parser.add_argument('--refresh', action='store_true')
+
+
+def get_memo(name, args, inputs=(), outputs=(), enabled=True):
+    """Get the cached run of an entry point, from the arguments added by add_memo_arguments.
+    It is only used with --memo / --refresh, or if VOYAGER_MEMO is set."""
+    use = args.memo or args.refresh or bool(os.environ.get(MEMO_ENV))
+    return Memo(name, args, inputs=inputs, outputs=outputs,
+                enabled=enabled and use, refresh=args.refresh)
@@ -0,0 +1,123 @@
+"""Simpoint-weighted prefetcher metrics (IPC speedup, accuracy, coverage and UAC),
+computed from the tidy tables of utils.ingest with grouped pandas operations.
+
+As in the notebooks, IPC and IPC speedup (over the baseline prefetcher) are
+weighted geometric means over the simpoints of a trace, and accuracy, coverage
+(of the baseline's LLC load + RFO misses) and UAC are weighted arithmetic means.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from utils.ingest import get_variation_name, load_results_tables
+from utils.load import get_simpoint_weights, parse_paper_result_file
+
+METRICS = ['ipc', 'speedup', 'accuracy', 'coverage', 'uac']
+PAPER_FILES = {
+    'speedup': 'paper_ipc_speedups.csv',
+    'accuracy': 'paper_accuracies.csv',
+    'coverage': 'paper_coverages.csv',
+    'uac': 'paper_uacs.csv',
+}
+_KEYS = ['config', 'trace', 'simpoint']
+
+
+def get_final_ipcs(heartbeats, max_instruction_num=None):
+    """Get the cumulative IPC of each result file at its last heartbeat after
+    both warmups complete (the last of utils.ingest.get_filtered_results'
+    cumulative_ipcs, with min_instruction_interval=0), indexed by (config, file)."""
+    warmups = heartbeats.warmups
+    if max_instruction_num:
+        # Warmups completed when the warmup count was last reset
+        reset = warmups.where(heartbeats.instructions >= max_instruction_num)
+        reset = reset.groupby([heartbeats.config, heartbeats.file]).ffill().fillna(0)
+        warmups = warmups - reset
+    valid = heartbeats[warmups >= 2]
+    return valid.groupby(['config', 'file']).cumulative_ipcs.last()
+
+
+def get_simpoint_metrics(results, heartbeats, max_instruction_num=None, baseline='NoPrefetcher'):
+    """Get the metrics of every prefetcher on every simpoint, from the tidy results
+    and heartbeats tables: one row per (config, trace, simpoint, prefetcher).
+
+    Runs that have not completed (e.g. still running) are left out,
+    since their LLC stats are not written yet.
+    """
+    results = results[results.roi_instructions >= 0] # Reached the ROI stats at the end
+    df = results[_KEYS + ['file']].copy()
+    df['prefetcher'] = df.file.map(get_variation_name)
+    df = df[df.prefetcher.notna()]
+    df['ipc'] = pd.MultiIndex.from_frame(df[['config', 'file']]).map(
+        get_final_ipcs(heartbeats, max_instruction_num)
+    ).astype(np.float64)
+    df['accuracy'] = results.accuracy
+    df['uac'] = results.uac
+    df['misses'] = results.llc_load_misses + results.llc_rfo_misses
+
+    base = df[df.prefetcher == baseline][_KEYS + ['ipc', 'misses']]
+    df = df.merge(base, on=_KEYS, how='left', suffixes=('', '_base'))
+    df['speedup'] = df.ipc / df.ipc_base
+    df['coverage'] = (df.misses_base - df.misses) / df.misses_base
+    return df[_KEYS + ['prefetcher'] + METRICS].reset_index(drop=True)
+
+
+def get_weights_table(simpoints_dir):
+    """Get the simpoint weights of a directory as a (trace, simpoint, weight) table."""
+    registry = get_simpoint_weights(simpoints_dir)
+    rows = [(b, i, w) for b, weights in registry.weights.items() for i, w in enumerate(weights.tolist()) if w == w]
+    return pd.DataFrame(rows, columns=['trace', 'simpoint', 'weight'])
+
+
+def aggregate_metrics(simpoint_metrics, weights, largest=False, baseline='NoPrefetcher'):
+    """Aggregate simpoint metrics over the simpoints of each (config, trace, prefetcher).
+
+    Simpoints without a weight (or a result) are left out. If largest is set,
+    take the metrics of the largest simpoint instead of weighting them.
+    The baseline is left out of every metric but IPC.
+    """
+    df = simpoint_metrics.merge(weights, on=['trace', 'simpoint'], how='inner')
+    groups = ['config', 'trace', 'prefetcher']
+    if largest:
+        largest_weight = df.groupby(groups).weight.transform('max')
+        # The first largest simpoint, as with np.argmax
+        agg = df[df.weight == largest_weight].sort_values('simpoint').groupby(groups)[METRICS].first()
+    else:
+        w = df.weight
+        values = df[METRICS].assign(ipc=np.log(df.ipc), speedup=np.log(df.speedup))
+        # Each metric is weighted by the simpoints it has a value for (e.g. UAC may be NaN)
+        weights = values.notna().mul(w, axis=0)
+        sums = values.mul(w, axis=0).groupby([df[g] for g in groups]).sum(min_count=1)
+        agg = sums / weights.groupby([df[g] for g in groups]).sum()
+        agg['ipc'] = np.exp(agg.ipc)
+        agg['speedup'] = np.exp(agg.speedup)
+    agg['speedup'] -= 1.
+    agg = agg.reset_index()
+    agg.loc[agg.prefetcher == baseline, ['speedup', 'accuracy', 'coverage', 'uac']] = np.nan
+    return agg
+
+
+def load_paper_table(paper_dir):
+    """Load the paper's metrics (data/paper-values) as a tidy
+    (trace, prefetcher, speedup, accuracy, coverage, uac) table."""
+    tables = []
+    for metric, name in PAPER_FILES.items():
+        values = parse_paper_result_file(os.path.join(paper_dir, name))
+        tables.append(pd.DataFrame(
+            [(tr, pf, v) for tr, pfs in values.items() for pf, v in pfs.items()],
+            columns=['trace', 'prefetcher', metric]
+        ).set_index(['trace', 'prefetcher']))
+    return pd.concat(tables, axis=1).reset_index()
+
+
+def get_comparison_table(results_dirs, simpoints_dir, paper_dir=None, max_instruction_num=None,
+                         largest=False, baseline='NoPrefetcher'):
+    """Build the full comparison table of every prefetcher on every trace of the results
+    directories (one config per directory), with the paper's values (config 'paper')."""
+    results, heartbeats = load_results_tables(results_dirs)
+    simpoint_metrics = get_simpoint_metrics(results, heartbeats, max_instruction_num, baseline=baseline)
+    table = aggregate_metrics(simpoint_metrics, get_weights_table(simpoints_dir), largest=largest, baseline=baseline)
+    if paper_dir:
+        paper = load_paper_table(paper_dir)
+        paper = paper[paper.trace.isin(table.trace)].assign(config='paper')
+        table = pd.concat([table, paper], ignore_index=True)
+    return table.set_index(['trace', 'config', 'prefetcher']).sort_index()
@@ -0,0 +1,48 @@
+"""Fixed-size histories of the most recent values (e.g. load addresses) of each PC."""
+
+import numpy as np
+
+
+class PCHistoryPool(object):
+    """Ring buffers of the size most recent values of each PC, pooled in one
+    preallocated array, with a row per PC.
+
+    PCs are interned to dense row ids as they are first seen, and the pool
+    doubles when it runs out of rows, so memory stays bounded by the
+    # of PCs x size (instead of growing a list per PC in a dict).
+    """
+    def __init__(self, size, capacity=1024, dtype=np.uint64):
+        self.size = size
+        self.ids = {} # Row id of each PC
+        self.values = np.zeros((capacity, size), dtype=dtype)
+        self.counts = np.zeros(capacity, dtype=np.int64) # Total # of values added for each PC
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get_id(self, pc):
+        """Get the row id of pc, adding a row if it is new."""
+        row = self.ids.get(pc)
+        if row is None:
+            row = self.ids[pc] = len(self.ids)
+            if row == len(self.counts):
+                self.values = np.concatenate((self.values, np.zeros_like(self.values)))
+                self.counts = np.concatenate((self.counts, np.zeros_like(self.counts)))
+        return row
+
+    def add(self, pc, value):
+        row = self.get_id(pc)
+        self.values[row, self.counts[row] % self.size] = value
+        self.counts[row] += 1
+
+    def get(self, pc):
+        """Get the (up to) size most recent values of pc, from least to most recent."""
+        row = self.ids.get(pc)
+        if row is None:
+            return []
+        count = int(self.counts[row])
+        values = self.values[row].tolist()
+        if count < self.size:
+            return values[:count]
+        i = count % self.size
+        return values[i:] + values[:i]
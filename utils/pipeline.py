@@ -0,0 +1,258 @@
+"""Single-pass pipeline over a ChampSim trace (and its load trace).
+
+The ChampSim trace is decoded once, in blocks, and each block (with the
+loads that fall in it) is passed to every registered stage in turn. Each
+stage writes its own output file, and is timed separately.
+"""
+
+import os
+import time
+import numpy as np
+from utils.block_writer import BlockWriter
+from utils.branch_history import BranchHistory
+from utils.champsim_trace import get_instruction_blocks, INST_DTYPE
+from utils.load_trace import format_loadbranch_rows
+from utils.trace_verify import TraceVerifier, MISMATCH_KINDS, get_load_arrays
+
+
+class PipelineChunk(object):
+    """A decoded block of the ChampSim trace, and the loads that fall in it.
+
+    insts        : the block's instructions (structured array of INST_DTYPE).
+    start        : index of the block's first instruction in the trace.
+    lines        : the loads' load trace lines.
+    uiids / addrs / pcs : the loads' uiids, addresses and PCs.
+    found        : which loads' instructions are in the block.
+    load_insts   : the instruction of each found load.
+    """
+    def __init__(self, insts, start, lines, uiids, addrs, pcs):
+        self.insts = insts
+        self.start = start
+        self.lines = lines
+        self.uiids = uiids
+        self.addrs = addrs
+        self.pcs = pcs
+
+        idx = uiids - 1 - start
+        self.found = (idx >= 0) & (idx < len(insts))
+        self.load_insts = insts[idx[self.found]]
+
+
+class LoadStream(object):
+    """Read the load trace in chunks, handing out loads up to a given uiid."""
+    def __init__(self, lf, chunk_size=100000):
+        self.chunk_size = chunk_size
+        self.chunks = get_load_arrays(lf, chunk_size, with_lines=True) if lf is not None else iter(())
+        self.lines = []
+        self.uiids = np.empty(0, dtype=np.int64)
+        self.addrs = np.empty(0, dtype=np.uint64)
+        self.pcs = np.empty(0, dtype=np.uint64)
+        self.done = lf is None
+
+    def _read_chunk(self):
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.done = True
+            return
+        lines, uiids, addrs, pcs = chunk
+        self.lines += lines
+        self.uiids = np.concatenate((self.uiids, uiids))
+        self.addrs = np.concatenate((self.addrs, addrs))
+        self.pcs = np.concatenate((self.pcs, pcs))
+
+    def take(self, max_uiid=None, max_loads=None):
+        """Take the next loads, up to (but not including) the first with uiid > max_uiid,
+        and at most max_loads of them (or if neither is given, all the remaining loads)."""
+        while not self.done and (max_loads is None or len(self.uiids) < max_loads) and \
+                (max_uiid is None or len(self.uiids) == 0 or self.uiids[-1] <= max_uiid):
+            self._read_chunk()
+        past = self.uiids > max_uiid if max_uiid is not None else np.zeros(len(self.uiids), dtype=bool)
+        n = int(np.argmax(past)) if past.any() else len(self.uiids)
+        if max_loads is not None:
+            n = min(n, max_loads)
+        taken = self.lines[:n], self.uiids[:n], self.addrs[:n], self.pcs[:n]
+        self.lines, self.uiids, self.addrs, self.pcs = self.lines[n:], self.uiids[n:], self.addrs[n:], self.pcs[n:]
+        return taken
+
+
+class Stage(object):
+    """A consumer of the decoded ChampSim trace.
+
+    Subclasses set name (also the name of their output file), and
+    override process (called on every PipelineChunk) and finish,
+    which do nothing by default.
+    """
+    name = None
+    needs_loads = False
+
+    def __init__(self, output_dir, ext='txt'):
+        self.output_path = os.path.join(output_dir, f'{self.name}.{ext}')
+
+    def process(self, chunk):
+        pass
+
+    def finish(self):
+        pass
+
+
+class VerifyStage(Stage):
+    """Verify that the loads match their ChampSim instructions (see utils.trace_verify).
+
+    Unlike trace/match_traces.py, loads that go back before the current
+    block can not seek back to their instruction, so count as missing.
+    Like it, verification stops at the first load past the end of the ChampSim trace.
+    """
+    name = 'verify'
+    needs_loads = True
+
+    def __init__(self, output_dir, max_reported=10):
+        super().__init__(output_dir)
+        self.verifier = TraceVerifier(max_reported=max_reported)
+        self.out_of_insts = False
+
+    def process(self, chunk):
+        if self.out_of_insts:
+            return
+        past = chunk.uiids > chunk.start + len(chunk.insts)
+        if not past.any():
+            self.verifier.check(chunk.uiids, chunk.addrs, chunk.pcs, chunk.load_insts, chunk.found)
+            return
+        stop = int(np.argmax(past))
+        found = chunk.found[:stop]
+        self.verifier.check(chunk.uiids[:stop], chunk.addrs[:stop], chunk.pcs[:stop],
+                            chunk.load_insts[:int(found.sum())], found)
+        self.out_of_insts = True
+
+    def finish(self):
+        v = self.verifier
+        with open(self.output_path, 'w') as f:
+            if self.out_of_insts:
+                print('ChampSim trace out of instructions. Stopped.', file=f)
+            print(f'Checked {v.num_checked} loads.', file=f)
+            for kind, description in MISMATCH_KINDS.items():
+                print(f'{kind}: {v.counts[kind]} ({description}). First uiids: {v.examples[kind]}', file=f)
+
+
+class LoadBranchStage(Stage):
+    """Write the load-branch trace, with each load's n_branches prior branches
+    (same format as trace/loadbranch_trace.py)."""
+    name = 'loadbranch'
+    needs_loads = True
+
+    def __init__(self, output_dir, n_branches, block_size, ext='txt'):
+        super().__init__(output_dir, ext=ext)
+        self.n_branches = n_branches
+        self.branches = BranchHistory(block_size + n_branches)
+        self.f = BlockWriter(self.output_path)
+
+    def process(self, chunk):
+        is_branch = np.flatnonzero(chunk.insts['is_branch'])
+        self.branches.extend(is_branch + chunk.start, chunk.insts['pc'][is_branch], chunk.insts['branch_taken'][is_branch].astype(bool))
+
+        # Only loads within the ChampSim trace are written
+        keep = chunk.uiids <= chunk.start + len(chunk.insts)
+        uiids = chunk.uiids[keep]
+        lines = chunk.lines if keep.all() else [l for l, k in zip(chunk.lines, keep) if k]
+        branch_pcs, branch_taken = self.branches.get_prior_batch(uiids, self.n_branches)
+        self.f.write(format_loadbranch_rows(lines, branch_pcs, branch_taken))
+
+    def finish(self):
+        self.f.close()
+
+
+class PCStatsStage(Stage):
+    """Count, for each PC, its instructions, branches, taken branches, loads and stores."""
+    name = 'pc_stats'
+    COLUMNS = ['instructions', 'branches', 'taken', 'loads', 'stores']
+
+    def __init__(self, output_dir):
+        super().__init__(output_dir, ext='csv')
+        self.pcs = np.empty(0, dtype=np.uint64)
+        self.counts = np.empty((0, len(self.COLUMNS)), dtype=np.int64)
+
+    def process(self, chunk):
+        insts = chunk.insts
+        pcs, inverse = np.unique(insts['pc'], return_inverse=True)
+        columns = [
+            np.ones(len(insts)),
+            insts['is_branch'],
+            insts['branch_taken'],
+            (insts['src_mem'] != 0).any(axis=1),
+            (insts['dest_mem'] != 0).any(axis=1),
+        ]
+        counts = np.stack([np.bincount(inverse, weights=c, minlength=len(pcs)) for c in columns], axis=1).astype(np.int64)
+
+        all_pcs = np.union1d(self.pcs, pcs)
+        all_counts = np.zeros((len(all_pcs), len(self.COLUMNS)), dtype=np.int64)
+        all_counts[np.searchsorted(all_pcs, self.pcs)] += self.counts
+        all_counts[np.searchsorted(all_pcs, pcs)] += counts
+        self.pcs, self.counts = all_pcs, all_counts
+
+    def finish(self):
+        with open(self.output_path, 'w') as f:
+            print(','.join(['pc'] + self.COLUMNS), file=f)
+            for pc, counts in zip(self.pcs.tolist(), self.counts.tolist()):
+                print(','.join([hex(pc)] + [str(c) for c in counts]), file=f)
+
+
+class InstMixStage(Stage):
+    """Count the instruction mix of the trace."""
+    name = 'inst_mix'
+
+    def __init__(self, output_dir):
+        super().__init__(output_dir)
+        self.counts = {k: 0 for k in ['instructions', 'branches', 'taken', 'loads', 'multi_loads', 'stores']}
+
+    def process(self, chunk):
+        insts = chunk.insts
+        n_src_mem = (insts['src_mem'] != 0).sum(axis=1)
+        self.counts['instructions'] += len(insts)
+        self.counts['branches'] += int(insts['is_branch'].sum())
+        self.counts['taken'] += int(insts['branch_taken'].sum())
+        self.counts['loads'] += int((n_src_mem > 0).sum())
+        self.counts['multi_loads'] += int((n_src_mem > 1).sum())
+        self.counts['stores'] += int((insts['dest_mem'] != 0).any(axis=1).sum())
+
+    def finish(self):
+        with open(self.output_path, 'w') as f:
+            for k, v in self.counts.items():
+                pct = v / self.counts['instructions'] * 100 if self.counts['instructions'] else 0
+                print(f'{k}: {v} ({pct:.2f}%)', file=f)
+
+
+def run_pipeline(cf, lf, stages, block_size=1 << 20):
+    """Decode the ChampSim trace once, passing every block (and the loads
+    of the load trace lf that fall in it, if given) to each stage.
+
+    Returns the time spent decoding / in each stage, in seconds.
+    """
+    timings = {'decode': 0.}
+    timings.update({stage.name: 0. for stage in stages})
+    loads = LoadStream(lf)
+    blocks = get_instruction_blocks(cf, block_size)
+    num_insts = 0
+
+    while True:
+        start = time.time()
+        block = next(blocks, None)
+        if block is None:
+            # Loads past the end of the ChampSim trace. No stage uses them, so only
+            # (up to) a chunk of them is read, for stages to see where the trace ends.
+            chunk = PipelineChunk(np.empty(0, dtype=INST_DTYPE), num_insts, *loads.take(max_loads=loads.chunk_size))
+        else:
+            chunk = PipelineChunk(block, num_insts, *loads.take(num_insts + len(block)))
+            num_insts += len(block)
+        timings['decode'] += time.time() - start
+
+        for stage in stages:
+            start = time.time()
+            stage.process(chunk)
+            timings[stage.name] += time.time() - start
+        if block is None:
+            break
+
+    for stage in stages:
+        start = time.time()
+        stage.finish()
+        timings[stage.name] += time.time() - start
+    return timings
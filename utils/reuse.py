@@ -0,0 +1,208 @@
+"""Reuse distances and footprints of load traces.
+
+The reuse (stack) distance of a load is the # of distinct cache lines (or pages)
+accessed since the last access to its own, or infinite for the first access (a cold
+load). Distances are computed for a whole interned load trace (see utils.intern) at
+once, in O(n log^2 n) vectorized operations, and summarized as log2 histograms
+(overall, per PC and per window of loads) next to the # of unique lines / pages.
+
+The summary of a load trace is cached alongside it (<load_trace>.reuse.npz), so
+notebooks can reuse it without recomputing the distances.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from utils.intern import previous_occurrence, load_interned_trace
+
+GRANULARITIES = ['line', 'page']
+NUM_DISTANCE_BINS = 41 # Bin 0 is distance 0, bin k is [2 ** (k - 1), 2 ** k)
+COLD_BIN = NUM_DISTANCE_BINS # The last bin of each histogram counts cold loads
+HIST_SIZE = NUM_DISTANCE_BINS + 1
+
+
+def count_smaller_before(values):
+    """For each position i, count the positions j < i with values[j] < values[i].
+
+    Like inserting the values into a Fenwick tree one at a time and querying the
+    prefix count before each insert, but vectorized: each pair j < i is counted at
+    the highest bit where j and i differ, where j is in the left and i in the right
+    half of a block of positions, with one sort and search per bit.
+    """
+    n = len(values)
+    counts = np.zeros(n, dtype=np.int64)
+    if n == 0:
+        return counts
+    v = values.astype(np.int64)
+    v -= v.min()
+    span = int(v.max()) + 1
+    idx = np.arange(n, dtype=np.int64)
+    k = 0
+    while (1 << k) < n:
+        block = idx >> (k + 1)
+        right = ((idx >> k) & 1).astype(bool)
+        left_keys = np.sort(block[~right] * span + v[~right])
+        # Every block before a right half has a full left half, of 2 ** k keys
+        counts[right] += np.searchsorted(left_keys, block[right] * span + v[right]) - (block[right] << k)
+        k += 1
+    return counts
+
+
+def get_reuse_distances(ids):
+    """Get the reuse distance of each access to ids (e.g. interned cache lines),
+    or -1 for the first access to each.
+
+    The distinct ids accessed between an access i and the previous access p to
+    the same id are those first accessed after p, i.e. the j in (p, i) whose own
+    previous access is before p. Since every j <= p has its previous access
+    before p, that is the # of j < i with prev[j] < p, minus the p + 1 of them up to p.
+    """
+    prev = previous_occurrence(ids)
+    counts = count_smaller_before(prev)
+    return np.where(prev >= 0, counts - prev - 1, -1)
+
+
+def get_distance_bins(distances):
+    """Get the log2 histogram bin of each reuse distance (COLD_BIN for -1)."""
+    # frexp gives the bit length of positive integers (exactly, below 2 ** 53), and 0 for 0
+    bins = np.frexp(np.maximum(distances, 0).astype(np.float64))[1].astype(np.int64)
+    bins = np.minimum(bins, NUM_DISTANCE_BINS - 1)
+    bins[distances < 0] = COLD_BIN
+    return bins
+
+
+def get_bin_edges():
+    """Get the (min, max) reuse distance of each finite histogram bin."""
+    mins = np.array([0] + [1 << (k - 1) for k in range(1, NUM_DISTANCE_BINS)], dtype=np.int64)
+    maxs = np.array([0] + [(1 << k) - 1 for k in range(1, NUM_DISTANCE_BINS)], dtype=np.int64)
+    return mins, maxs
+
+
+def _count_unique(groups, ids, num_groups):
+    # Count the distinct ids in each group
+    span = int(ids.max()) + 1 if len(ids) else 1
+    pairs = np.unique(groups.astype(np.int64) * span + ids)
+    return np.bincount(pairs // span, minlength=num_groups).astype(np.int64)
+
+
+def _histograms(groups, bins, num_groups):
+    return np.bincount(groups.astype(np.int64) * HIST_SIZE + bins,
+                       minlength=num_groups * HIST_SIZE).reshape(num_groups, HIST_SIZE).astype(np.int64)
+
+
+class ReuseStats(object):
+    """Reuse distance histograms (of length HIST_SIZE, see get_distance_bins) and
+    footprints of a load trace, for each granularity (line / page) g.
+
+    {g}_hist                  : histogram of every load.
+    num_{g}s                  : # of unique lines / pages.
+    pcs / pc_loads            : each PC, and its # of loads.
+    pc_{g}_hist / pc_{g}s     : histogram and # of unique lines / pages of each PC's loads.
+    window                    : # of loads per window.
+    window_loads              : # of loads of each window (the last may be partial).
+    window_{g}_hist / window_{g}s : histogram and # of unique lines / pages of each window.
+    """
+    FIELDS = ['window', 'num_loads', 'pcs', 'pc_loads', 'window_loads'] + [
+        f.format(g) for g in GRANULARITIES
+        for f in ['{}_hist', 'num_{}s', 'pc_{}_hist', 'pc_{}s', 'window_{}_hist', 'window_{}s']
+    ]
+
+    @classmethod
+    def from_trace(cls, trace, window=1000000):
+        """Compute the reuse stats of an interned load trace, with windows of window loads."""
+        stats = cls()
+        n = len(trace)
+        windows = np.arange(n, dtype=np.int64) // window
+        num_windows = int(windows[-1]) + 1 if n else 0
+        num_pcs = len(trace.pcs)
+
+        stats.window = np.int64(window)
+        stats.num_loads = np.int64(n)
+        stats.pcs = trace.pcs
+        stats.pc_loads = np.bincount(trace.pc_ids, minlength=num_pcs).astype(np.int64)
+        stats.window_loads = np.bincount(windows, minlength=num_windows).astype(np.int64)
+        for g, ids, uniques in (('line', trace.line_ids, trace.lines), ('page', trace.page_ids, trace.pages)):
+            bins = get_distance_bins(get_reuse_distances(ids))
+            setattr(stats, f'{g}_hist', np.bincount(bins, minlength=HIST_SIZE).astype(np.int64))
+            setattr(stats, f'num_{g}s', np.int64(len(uniques)))
+            setattr(stats, f'pc_{g}_hist', _histograms(trace.pc_ids, bins, num_pcs))
+            setattr(stats, f'pc_{g}s', _count_unique(trace.pc_ids, ids, num_pcs))
+            setattr(stats, f'window_{g}_hist', _histograms(windows, bins, num_windows))
+            setattr(stats, f'window_{g}s', _count_unique(windows, ids, num_windows))
+        return stats
+
+    def save(self, path, source_stat=None):
+        """Save the stats (and, optionally, the stat of the
+        trace they were computed from, to check they are still up-to-date)."""
+        source = [source_stat.st_size, source_stat.st_mtime_ns] if source_stat else [-1, -1]
+        with open(path, 'wb') as f:
+            np.savez(f, source=np.array(source, dtype=np.int64),
+                     **{k: getattr(self, k) for k in self.FIELDS})
+
+    @classmethod
+    def load(cls, path):
+        stats = cls()
+        with np.load(path) as data:
+            for k in cls.FIELDS:
+                setattr(stats, k, data[k])
+        return stats
+
+    def get_histogram_table(self, granularity='line', pc=None):
+        """Get a reuse distance histogram (of every load, or of one PC's loads) as a
+        table of each bin's min / max distance (inf for cold loads), loads and fraction."""
+        if pc is None:
+            hist = getattr(self, f'{granularity}_hist')
+        else:
+            hist = getattr(self, f'pc_{granularity}_hist')[np.searchsorted(self.pcs, pc)]
+        mins, maxs = get_bin_edges()
+        total = hist.sum()
+        return pd.DataFrame({
+            'min_distance': np.append(mins, np.inf),
+            'max_distance': np.append(maxs, np.inf),
+            'loads': hist,
+            'fraction': hist / total if total else np.zeros(HIST_SIZE),
+        })
+
+    def get_pc_table(self):
+        """Get a table of each PC's loads, footprint (unique lines / pages) and
+        cold lines / pages, from most to fewest loads."""
+        df = pd.DataFrame({'pc': self.pcs, 'loads': self.pc_loads})
+        for g in GRANULARITIES:
+            df[f'{g}s'] = getattr(self, f'pc_{g}s')
+            df[f'cold_{g}s'] = getattr(self, f'pc_{g}_hist')[:, COLD_BIN]
+        return df.sort_values('loads', ascending=False, kind='stable').reset_index(drop=True)
+
+    def get_window_table(self):
+        """Get a table of each window's loads, footprint and cold lines / pages."""
+        df = pd.DataFrame({
+            'start': np.arange(len(self.window_loads), dtype=np.int64) * int(self.window),
+            'loads': self.window_loads,
+        })
+        for g in GRANULARITIES:
+            df[f'{g}s'] = getattr(self, f'window_{g}s')
+            df[f'cold_{g}s'] = getattr(self, f'window_{g}_hist')[:, COLD_BIN]
+        return df
+
+
+def get_cache_path(load_trace):
+    return load_trace + '.reuse.npz'
+
+
+def load_reuse_stats(load_trace, window=1000000, refresh=False, cache_trace=False):
+    """Load the reuse stats of a load trace, computing (and saving) them alongside
+    it if they are missing, out-of-date with the trace or the window, or refresh is set.
+
+    cache_trace : reuse (and save) the interned load trace (see utils.intern.load_interned_trace).
+    """
+    stat = os.stat(load_trace)
+    cache_path = get_cache_path(load_trace)
+    if not refresh and os.path.exists(cache_path):
+        with np.load(cache_path) as data:
+            up_to_date = (data['source'].tolist() == [stat.st_size, stat.st_mtime_ns]
+                          and int(data['window']) == window)
+        if up_to_date:
+            return ReuseStats.load(cache_path)
+
+    stats = ReuseStats.from_trace(load_interned_trace(load_trace, cache=cache_trace), window=window)
+    stats.save(cache_path, stat)
+    return stats
@@ -0,0 +1,110 @@
+"""Sample intervals of a load trace, to quickly estimate correlation histograms.
+
+Each sampled interval (of loads, or a SimPoint slice of instructions) is
+processed by its own trackers, after a warm-up prefix that only fills their history. Since the histograms of different
+intervals are not additive (a trigger may recur across intervals), they are
+estimated as fractions of the triggers (or of the loads, if weighted) with
+each # of unique correlated addresses, averaged over the intervals.
+"""
+
+import math
+import numpy as np
+from utils.load_trace import get_sampled_instructions
+
+
+def random_offsets(num_samples, seed=0):
+    """Pick num_samples intervals uniformly at random, by the fraction of the
+    load trace file (by byte offset) they start at, so the loads do not need to
+    be counted first. Intervals may overlap. Returns sorted (fraction, weight) pairs."""
+    rng = np.random.default_rng(seed)
+    return [(float(u), 1 / num_samples) for u in np.sort(rng.random(num_samples))]
+
+
+def simpoint_intervals(simpoints_path, weights_path):
+    """Read the slices picked by SimPoint, from its .simpoints
+    (lines of "<slice> <cluster>") and .weights (lines of "<weight> <cluster>") files.
+    Returns sorted (slice index, weight) pairs."""
+    with open(simpoints_path) as f:
+        intervals = {int(cluster): int(interval) for interval, cluster in (l.split() for l in f if l.strip())}
+    with open(weights_path) as f:
+        weights = {int(cluster): float(weight) for weight, cluster in (l.split() for l in f if l.strip())}
+    return sorted((intervals[c], weights[c]) for c in intervals)
+
+
+def get_offset_windows(intervals, interval_len):
+    """Get the (start fraction, # of loads) of each interval picked by random_offsets."""
+    return [(fraction, interval_len) for fraction, _ in intervals]
+
+
+def get_slice_windows(intervals, slice_len):
+    """Get the (start, end) uiids of each SimPoint slice, of slice_len instructions
+    (the slice_len SimPoint was run with). Slice i is instructions
+    [i * slice_len, (i + 1) * slice_len), and uiids start at 1."""
+    return [(interval * slice_len + 1, (interval + 1) * slice_len + 1) for interval, _ in intervals]
+
+
+def gather_sampled_correlation_data(f, windows, make_trackers, add_inst, warm_up_inst, get_results,
+                                    warmup=0, by_uiid=False, get_fraction=None):
+    """Gather correlation data over each sampled window of the load trace,
+    with fresh trackers for each window (from make_trackers), warmed up
+    with the warmup loads before it (see utils.load_trace.get_sampled_instructions).
+
+    add_inst / warm_up_inst are called with the window's trackers and each
+    load (to count / only warm up with). Returns the results of each window
+    (from get_results), or None for windows the trace ends before the end of.
+    """
+    results = [None] * len(windows)
+    live = {}
+    for w, inst, warming in get_sampled_instructions(f, windows, warmup=warmup, by_uiid=by_uiid,
+                                                        get_fraction=get_fraction):
+        if w not in live:
+            live[w] = make_trackers()
+        if inst is None:
+            results[w] = get_results(live.pop(w))
+        elif warming:
+            warm_up_inst(live[w], inst)
+        else:
+            add_inst(live[w], inst)
+    return results
+
+
+def _fractions(freq):
+    total = sum(freq.values())
+    return {n: c / total for n, c in freq.items()} if total > 0 else {}
+
+
+def estimate_freqs(interval_freqs, weights, z=1.96):
+    """Estimate the frequency histograms of a trace, from the histograms
+    of its sampled intervals (each the output of compute_freqs).
+
+    Returns, for each trigger and # of unique correlated addresses, the
+    estimated fraction, and the half-width of its confidence interval
+    (at z standard errors; nan if there are too few intervals).
+    """
+    assert len(interval_freqs) > 0, 'No intervals were sampled'
+    weights = np.array(weights, dtype=np.float64)
+    weights /= weights.sum()
+    k = len(weights)
+
+    estimates = {}
+    for trigger in interval_freqs[0]:
+        fractions = [_fractions(freqs[trigger]) for freqs in interval_freqs]
+        estimates[trigger] = {}
+        for n in sorted(set().union(*fractions)):
+            x = np.array([f.get(n, 0.) for f in fractions])
+            mean = float(np.dot(weights, x))
+            if k > 1:
+                var = k / (k - 1) * float(np.dot(weights ** 2, (x - mean) ** 2))
+                half_width = z * math.sqrt(var)
+            else:
+                half_width = float('nan')
+            estimates[trigger][n] = (mean, half_width)
+    return estimates
+
+
+def format_estimates(estimates):
+    """Format estimates as percentages, e.g. '53.20% +- 0.84%'."""
+    return {
+        trigger: {n: f'{mean * 100:.2f}% +- {half_width * 100:.2f}%' for n, (mean, half_width) in est.items()}
+        for trigger, est in estimates.items()
+    }
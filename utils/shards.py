@@ -0,0 +1,189 @@
+"""Training-ready export of a load trace, as fixed-size, memory-mapped shards.
+
+Voyager models take each load's PC, page and offset (the cache line split at
+offset_bits), and learn to predict the next load's page and offset. The exporter
+decodes the load trace once (see utils.intern) and writes, for several offset bit
+widths at once, raw column files that a training input pipeline only has to mmap:
+
+    <path>/manifest.json                      written last, with the layout below
+    <path>/pcs.bin                            PC of each PC id (uint64)
+    <path>/shard-00000/{inst_ids,pc_ids}.bin  shared by every offset bit width
+    <path>/offset_bits-6/pages.bin            page of each page id (uint64)
+    <path>/offset_bits-6/shard-00000/{page_ids,offsets,next_page_ids,next_offsets}.bin
+
+Row i of a shard is a load, labeled with the page id and offset of the load after it
+(so the last load of the trace is left out). Every shard has shard_size rows, but
+the last. Ids are dense (0 to the vocabulary size - 1), and offsets are < 2 ** offset_bits.
+"""
+
+import os
+import json
+import numpy as np
+from utils.intern import intern, load_interned_trace
+from utils.logging import Instrumentation
+
+MANIFEST_VERSION = 1
+SHARED_COLUMNS = {'inst_ids': np.int64, 'pc_ids': np.int32}
+VARIANT_COLUMNS = {'page_ids': np.int32, 'offsets': np.int32, 'next_page_ids': np.int32, 'next_offsets': np.int32}
+
+
+def _source(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def get_shard_name(k):
+    return f'shard-{k:05d}'
+
+
+def get_variant_name(offset_bits):
+    return f'offset_bits-{offset_bits}'
+
+
+def split_lines(lines, offset_bits):
+    """Split cache lines into (pages, offsets) at offset_bits."""
+    return lines >> np.uint64(offset_bits), (lines & np.uint64((1 << offset_bits) - 1)).astype(np.int32)
+
+
+def _write_shards(path, columns, shard_size):
+    # Write each column's rows to raw column files, shard_size rows per shard
+    n = len(next(iter(columns.values())))
+    for k, start in enumerate(range(0, n, shard_size)):
+        shard_path = os.path.join(path, get_shard_name(k))
+        os.makedirs(shard_path, exist_ok=True)
+        for name, col in columns.items():
+            col[start:start + shard_size].tofile(os.path.join(shard_path, f'{name}.bin'))
+
+
+def export_load_trace(load_trace, path, offset_bits=(6,), shard_size=1 << 20, cache=False, instr=None):
+    """Export a load trace to sharded, memory-mapped columns at path (see the module
+    docstring), for each of the offset bit widths, from one decode of the trace.
+
+    cache : reuse (and save) the interned load trace (see utils.intern.load_interned_trace).
+    """
+    instr = instr or Instrumentation()
+    source = _source(load_trace)
+    with instr.stage('parse'):
+        trace = load_interned_trace(load_trace, cache=cache)
+    instr.count('parse', len(trace))
+    lines = trace.lines[trace.line_ids]
+    n = max(len(trace) - 1, 0)
+
+    os.makedirs(path, exist_ok=True)
+    # Remove an older manifest first, so an interrupted export is not mistaken for a complete one
+    manifest_path = os.path.join(path, 'manifest.json')
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    with instr.stage('write'):
+        trace.pcs.astype(np.uint64).tofile(os.path.join(path, 'pcs.bin'))
+        _write_shards(path, {
+            'inst_ids': trace.inst_ids[:n].astype(np.int64),
+            'pc_ids': trace.pc_ids[:n].astype(np.int32),
+        }, shard_size)
+
+    variants = {}
+    for bits in offset_bits:
+        variant_path = os.path.join(path, get_variant_name(bits))
+        os.makedirs(variant_path, exist_ok=True)
+        with instr.stage('split'):
+            pages, offsets = split_lines(lines, bits)
+            page_ids, page_vocab = intern(pages)
+        with instr.stage('write'):
+            page_vocab.astype(np.uint64).tofile(os.path.join(variant_path, 'pages.bin'))
+            _write_shards(variant_path, {
+                'page_ids': page_ids[:n],
+                'offsets': offsets[:n],
+                'next_page_ids': page_ids[1:n + 1],
+                'next_offsets': offsets[1:n + 1],
+            }, shard_size)
+        instr.count('split', len(lines))
+        instr.count('write', n)
+        variants[str(bits)] = {'path': get_variant_name(bits), 'num_pages': len(page_vocab)}
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'load_trace': os.path.abspath(load_trace),
+        'source': source,
+        'num_rows': n,
+        'shard_size': shard_size,
+        'shard_rows': [min(shard_size, n - start) for start in range(0, n, shard_size)],
+        'num_pcs': len(trace.pcs),
+        'shared_columns': {k: np.dtype(v).str for k, v in SHARED_COLUMNS.items()},
+        'variant_columns': {k: np.dtype(v).str for k, v in VARIANT_COLUMNS.items()},
+        'offset_bits': variants,
+    }
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def _memmap(path, dtype, rows):
+    # np.memmap cannot map empty files
+    return np.memmap(path, dtype=dtype, mode='r', shape=(rows,)) if rows > 0 else np.empty(0, dtype=dtype)
+
+
+class ShardedDataset(object):
+    """The shards of an exported load trace, for one offset bit width, as
+    memory-mapped columns (read lazily, by the OS).
+
+    pcs / pages : PC / page of each PC id / page id.
+    shards      : columns (inst_ids, pc_ids, page_ids, offsets, next_page_ids,
+                  next_offsets) of each shard.
+    """
+    def __init__(self, path, offset_bits=6):
+        self.path = path
+        self.offset_bits = offset_bits
+        with open(os.path.join(path, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        assert self.manifest['version'] == MANIFEST_VERSION, f'Unsupported manifest version {self.manifest["version"]}'
+        variants = self.manifest['offset_bits']
+        assert str(offset_bits) in variants, f'{offset_bits} offset bits not exported, only {sorted(map(int, variants))}'
+        variant_path = os.path.join(path, variants[str(offset_bits)]['path'])
+
+        self.pcs = _memmap(os.path.join(path, 'pcs.bin'), np.uint64, self.manifest['num_pcs'])
+        self.pages = _memmap(os.path.join(variant_path, 'pages.bin'), np.uint64, variants[str(offset_bits)]['num_pages'])
+        self.shards = []
+        for k, rows in enumerate(self.manifest['shard_rows']):
+            shard = {}
+            for base, columns in ((path, 'shared_columns'), (variant_path, 'variant_columns')):
+                for name, dtype in self.manifest[columns].items():
+                    shard[name] = _memmap(os.path.join(base, get_shard_name(k), f'{name}.bin'), np.dtype(dtype), rows)
+            self.shards.append(shard)
+        self.starts = np.cumsum([0] + self.manifest['shard_rows'])
+
+    def __len__(self):
+        return self.manifest['num_rows']
+
+    @property
+    def num_pcs(self):
+        return len(self.pcs)
+
+    @property
+    def num_pages(self):
+        return len(self.pages)
+
+    def get_batch(self, start, end):
+        """Get the columns of rows [start, end), which may span shards."""
+        end = min(end, len(self))
+        first = np.searchsorted(self.starts, start, side='right') - 1
+        parts = []
+        k = first
+        while k < len(self.shards) and self.starts[k] < end:
+            lo, hi = max(start, self.starts[k]) - self.starts[k], min(end, self.starts[k + 1]) - self.starts[k]
+            parts.append({name: col[lo:hi] for name, col in self.shards[k].items()})
+            k += 1
+        if len(parts) == 1:
+            return parts[0]
+        columns = {**self.manifest['shared_columns'], **self.manifest['variant_columns']}
+        return {name: np.concatenate([p[name] for p in parts]) if parts else np.empty(0, dtype=np.dtype(dtype))
+                for name, dtype in columns.items()}
+
+
+def load_exported_trace(path, offset_bits=6, load_trace=None):
+    """Load an exported load trace, for one offset bit width. If load_trace is given,
+    check that the export is still up-to-date with it."""
+    dataset = ShardedDataset(path, offset_bits)
+    if load_trace is not None:
+        assert dataset.manifest['source'] == _source(load_trace), f'{path} is out-of-date with {load_trace}'
+    return dataset
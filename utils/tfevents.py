@@ -0,0 +1,216 @@
+"""Read the scalars of TensorBoard event files (e.g. the Voyager training runs in
+data/voyager) into a tidy table, without TensorFlow.
+
+Event files are TFRecord files of Event protos, which are decoded directly.
+Only the fields needed for scalars (wall time, step and each summary value's tag
+and tensor shape) are read: non-scalar summaries (e.g. the embedding histograms,
+most of each file) are skipped without decoding them.
+
+Runs are laid out as <root>/<sweep>/tensorboard/<trace>/<run>/<split>/events.out.tfevents.*,
+where run may span several directories (e.g. train/default) and split is train or
+validation. The table is cached in <root>/.tfevents.npz, and only event files whose
+size or mtime changed since are read again.
+"""
+
+import os
+import glob
+import struct
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+CACHE_NAME = '.tfevents.npz'
+CACHE_VERSION = 1
+EPOCH_TAGS = ['epoch_loss', 'epoch_acc', 'epoch_page_acc', 'epoch_offset_acc', 'epoch_lr']
+KEY_COLUMNS = ['sweep', 'trace', 'run', 'split']
+# TensorProto dtypes of numeric scalars, and how they are packed
+_DTYPES = {1: '<f', 2: '<d', 3: '<i', 9: '<q'} # DT_FLOAT, DT_DOUBLE, DT_INT32, DT_INT64
+
+# In-process cache of each loaded root, with the stat of its event files when loaded
+_loaded = {}
+
+
+def _read_varint(buf, i):
+    result, shift = 0, 0
+    while True:
+        b = buf[i]
+        i += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, i
+        shift += 7
+
+
+def _iter_fields(buf, start, end):
+    """Iterate over the (field #, wire type, value) of a proto message in buf[start:end].
+    Length-delimited values are (start, end) spans, so they are not copied or decoded."""
+    i = start
+    while i < end:
+        key, i = _read_varint(buf, i)
+        wire_type = key & 7
+        if wire_type == 0:
+            value, i = _read_varint(buf, i)
+        elif wire_type == 1:
+            value, i = buf[i:i + 8], i + 8
+        elif wire_type == 2:
+            length, i = _read_varint(buf, i)
+            value, i = (i, i + length), i + length
+        elif wire_type == 5:
+            value, i = buf[i:i + 4], i + 4
+        else:
+            raise ValueError(f'Unsupported wire type {wire_type}')
+        yield key >> 3, wire_type, value
+
+
+def _decode_scalar_tensor(buf, start, end):
+    """Decode a TensorProto holding a numeric scalar, or None if it is not one."""
+    dtype, content, value = None, None, None
+    for field, wire_type, v in _iter_fields(buf, start, end):
+        if field == 1:
+            dtype = v
+        elif field == 2 and v[1] > v[0]:
+            return None # Has dimensions
+        elif field == 4:
+            content = buf[v[0]:v[1]]
+        elif field in (5, 6) and value is None: # float_val / double_val
+            fmt = '<f' if field == 5 else '<d'
+            value = struct.unpack_from(fmt, buf, v[0])[0] if wire_type == 2 else struct.unpack(fmt, v)[0]
+        elif field in (7, 10) and value is None: # int_val / int64_val
+            value = _read_varint(buf, v[0])[0] if wire_type == 2 else v
+    if dtype not in _DTYPES:
+        return None
+    if content is not None:
+        return struct.unpack(_DTYPES[dtype], content)[0] if len(content) == struct.calcsize(_DTYPES[dtype]) else None
+    return value
+
+
+def read_records(buf):
+    """Iterate over the (start, end) of each record of a TFRecord file's contents
+    (without checking the CRCs). Stops at a truncated record, e.g. of a run still training."""
+    i = 0
+    while i + 12 <= len(buf):
+        length, = struct.unpack_from('<Q', buf, i)
+        start, end = i + 12, i + 12 + length
+        if end + 4 > len(buf):
+            return
+        yield start, end
+        i = end + 4
+
+
+def read_scalars(path):
+    """Read every scalar summary of an event file, as (step, wall_time, tag, value) tuples."""
+    with open(path, 'rb') as f:
+        buf = f.read()
+
+    scalars = []
+    for start, end in read_records(buf):
+        step, wall_time, summary = 0, 0., None
+        for field, _, v in _iter_fields(buf, start, end):
+            if field == 1:
+                wall_time = struct.unpack('<d', v)[0]
+            elif field == 2:
+                step = v
+            elif field == 5:
+                summary = v
+        if summary is None:
+            continue
+
+        for field, _, (v_start, v_end) in _iter_fields(buf, *summary):
+            if field != 1:
+                continue
+            tag, value, tensor = None, None, None
+            for f, _, v in _iter_fields(buf, v_start, v_end):
+                if f == 1:
+                    tag = v
+                elif f == 2: # simple_value
+                    value = struct.unpack('<f', v)[0]
+                elif f == 8:
+                    tensor = v
+            if value is None and tensor is not None:
+                value = _decode_scalar_tensor(buf, *tensor)
+            if tag is not None and value is not None:
+                scalars.append((step, wall_time, buf[tag[0]:tag[1]].decode('utf-8'), float(value)))
+    return scalars
+
+
+def _read_scalars(path):
+    return path, read_scalars(path)
+
+
+def get_run_key(root, path):
+    """Get the (sweep, trace, run, split) of an event file under root."""
+    parts = os.path.relpath(path, root).split(os.sep)
+    return parts[0], parts[2], '/'.join(parts[3:-2]), parts[-2]
+
+
+def _load_cache(path):
+    with np.load(path) as data:
+        if 'version' not in data.files or int(data['version']) != CACHE_VERSION:
+            return None
+        return {k: data[k] for k in data.files if k != 'version'}
+
+
+def load_scalars(root='data/voyager', tags=None, processes=None, cache=True):
+    """Load the scalars of every event file under root into a tidy table, keyed by
+    sweep, trace, run, split, step and tag (with each value's wall time).
+
+    tags : only keep these tags (e.g. EPOCH_TAGS), or every scalar if None.
+
+    Event files are read in a pool of processes. If cache is set, the scalars are
+    saved in root, and only new / changed event files are read again.
+    """
+    paths = sorted(glob.glob(os.path.join(root, '*', 'tensorboard', '**', 'events.out.tfevents.*'), recursive=True))
+    names = [os.path.relpath(p, root) for p in paths]
+    stats = [os.stat(p) for p in paths]
+    signature = tuple((n, s.st_size, s.st_mtime_ns) for n, s in zip(names, stats))
+    key = os.path.abspath(root)
+    if key in _loaded and _loaded[key][0] == signature:
+        data = _loaded[key][1]
+    else:
+        cache_path = os.path.join(root, CACHE_NAME)
+        old = _load_cache(cache_path) if cache and os.path.exists(cache_path) else None
+        scalars = {}
+        if old is not None:
+            old_files = {n: i for i, n in enumerate(old['file_names'].tolist())}
+            for n, s in zip(names, stats):
+                i = old_files.get(n)
+                if i is not None and old['file_sizes'][i] == s.st_size and old['file_mtimes'][i] == s.st_mtime_ns:
+                    rows = old['file_index'] == i
+                    scalars[n] = list(zip(old['step'][rows].tolist(), old['wall_time'][rows].tolist(),
+                                          old['tag'][rows].tolist(), old['value'][rows].tolist()))
+
+        todo = [p for p, n in zip(paths, names) if n not in scalars]
+        if todo:
+            with multiprocessing.Pool(min(processes or os.cpu_count(), len(todo))) as pool:
+                for path, rows in pool.imap_unordered(_read_scalars, todo, chunksize=4):
+                    scalars[os.path.relpath(path, root)] = rows
+
+        lengths = [len(scalars[n]) for n in names]
+        rows = [row for n in names for row in scalars[n]]
+        data = {
+            'file_names': np.array(names, dtype=str),
+            'file_sizes': np.array([s.st_size for s in stats], dtype=np.int64),
+            'file_mtimes': np.array([s.st_mtime_ns for s in stats], dtype=np.int64),
+            'file_index': np.repeat(np.arange(len(names), dtype=np.int32), lengths),
+            'step': np.array([r[0] for r in rows], dtype=np.int64),
+            'wall_time': np.array([r[1] for r in rows], dtype=np.float64),
+            'tag': np.array([r[2] for r in rows], dtype=str),
+            'value': np.array([r[3] for r in rows], dtype=np.float64),
+        }
+        if cache and (todo or old is None or len(old['file_names']) != len(names)):
+            with open(cache_path, 'wb') as f:
+                np.savez(f, version=CACHE_VERSION, **data)
+        _loaded[key] = (signature, data)
+
+    keys = [get_run_key(root, os.path.join(root, n)) for n in data['file_names'].tolist()]
+    df = pd.DataFrame({
+        **{c: np.array([k[j] for k in keys], dtype=object)[data['file_index']] for j, c in enumerate(KEY_COLUMNS)},
+        'step': data['step'],
+        'tag': data['tag'],
+        'value': data['value'],
+        'wall_time': data['wall_time'],
+        'file': data['file_names'][data['file_index']],
+    })
+    if tags is not None:
+        df = df[df.tag.isin(tags)].reset_index(drop=True)
+    return df
@@ -0,0 +1,215 @@
+"""Verify that the loads of a load trace match their instructions in a ChampSim trace,
+joining chunks of loads against blocks of decoded ChampSim instructions at once.
+
+Instead of asserting on the first bad load, mismatches are counted, and the
+first few offending uiids of each kind are reported. As before, verification
+stops at the first load past the end of the ChampSim trace (e.g. of a load
+trace from a longer run), without counting it as a mismatch.
+"""
+
+import itertools
+import numpy as np
+from utils.champsim_trace import get_instruction_blocks, INST_DTYPE, INST_SIZE
+from utils.count_table import mix64
+from utils.logging import Instrumentation
+
+MISMATCH_KINDS = {
+    'missing': 'not in the ChampSim trace',
+    'src_mem': 'instruction has 0 / 2+ load addresses',
+    'pc': 'PCs do not match',
+    'mapping': 'mapping between addresses is not one-to-one',
+}
+
+
+def get_load_arrays(lf, chunk_size=100000, with_lines=False):
+    """Yield the load trace in chunks of (up to) chunk_size lines,
+    as (uiids, addrs, pcs) arrays (or if with_lines, (valid lines, uiids, addrs, pcs))."""
+    while True:
+        lines = list(itertools.islice(lf, chunk_size))
+        if not lines:
+            break
+        # For handling some invalid lines in the ML-DPC load traces
+        lines = [l for l in lines if not (l.startswith('***') or l.startswith('Read'))]
+        split = [l.split(', ', 4) for l in lines]
+        arrays = (
+            np.array([int(s[0]) for s in split], dtype=np.int64),
+            np.array([int(s[2], 16) for s in split], dtype=np.uint64),
+            np.array([int(s[3], 16) for s in split], dtype=np.uint64)
+        )
+        yield (lines,) + arrays if with_lines else arrays
+
+
+class AddressMapping(object):
+    """Check that each load trace address always maps to the same ChampSim address,
+    in bounded memory.
+
+    The last mapping of each address is kept in a direct-mapped table of 2^bits
+    entries. So, a mismatch may be missed if another address evicted the mapping
+    in between (but is never reported falsely).
+    """
+    def __init__(self, bits=20):
+        self.mask = np.uint64((1 << bits) - 1)
+        self.keys = np.zeros(1 << bits, dtype=np.uint64)
+        self.values = np.zeros(1 << bits, dtype=np.uint64)
+        self.valid = np.zeros(1 << bits, dtype=bool)
+
+    def check(self, addrs, cs_addrs):
+        """Check (and record) the mappings addrs[i] -> cs_addrs[i], in order.
+        Returns which mappings disagree with the previous one for the same address."""
+        # Compare each mapping with the previous one of the same address in this batch...
+        order = np.argsort(addrs, kind='stable')
+        same = addrs[order[1:]] == addrs[order[:-1]]
+        mismatch = np.zeros(len(addrs), dtype=bool)
+        mismatch[order[1:][same]] = cs_addrs[order[1:][same]] != cs_addrs[order[:-1][same]]
+
+        # ...or, for the first one, with the table
+        first = order[np.concatenate(([True], ~same))] if len(addrs) else order
+        slots = (mix64(addrs[first]) & self.mask).astype(np.int64)
+        known = self.valid[slots] & (self.keys[slots] == addrs[first])
+        mismatch[first[known]] = self.values[slots[known]] != cs_addrs[first[known]]
+
+        # Record the last mapping of each address
+        last = order[np.concatenate((~same, [True]))] if len(addrs) else order
+        slots = (mix64(addrs[last]) & self.mask).astype(np.int64)
+        self.keys[slots] = addrs[last]
+        self.values[slots] = cs_addrs[last]
+        self.valid[slots] = True
+        return mismatch
+
+
+class TraceVerifier(object):
+    """Count (and keep the first max_reported uiids of) each kind of mismatch."""
+    def __init__(self, max_reported=10, mapping_bits=20):
+        self.max_reported = max_reported
+        self.mapping = AddressMapping(mapping_bits)
+        self.num_checked = 0
+        self.counts = {kind: 0 for kind in MISMATCH_KINDS}
+        self.examples = {kind: [] for kind in MISMATCH_KINDS}
+
+    def _report(self, kind, uiids):
+        self.counts[kind] += len(uiids)
+        room = self.max_reported - len(self.examples[kind])
+        self.examples[kind].extend(uiids[:room].tolist())
+
+    def check(self, uiids, addrs, pcs, insts, found):
+        """Check loads against their ChampSim instructions.
+
+        insts holds the instruction of each found load (i.e. where found is set).
+        """
+        self.num_checked += len(uiids)
+        self._report('missing', uiids[~found])
+        uiids, addrs, pcs = uiids[found], addrs[found], pcs[found]
+
+        n_src_mem = (insts['src_mem'] != 0).sum(axis=1)
+        self._report('src_mem', uiids[n_src_mem != 1])
+        self._report('pc', uiids[insts['pc'] != pcs])
+
+        # Map to the (first) load address of each instruction
+        cs_addrs = insts['src_mem'][np.arange(len(insts)), np.argmax(insts['src_mem'] != 0, axis=1)]
+        self._report('mapping', uiids[self.mapping.check(addrs, cs_addrs)])
+
+    def ok(self):
+        return not any(self.counts.values())
+
+    def print_report(self):
+        print(f'Checked {self.num_checked} loads.')
+        for kind, description in MISMATCH_KINDS.items():
+            if self.counts[kind]:
+                print(f'{self.counts[kind]} loads: {description}. First uiids: {self.examples[kind]}')
+        if self.ok():
+            print('Everything checks out.')
+
+
+def _read_instruction(cf, index):
+    """Read the instruction at index of the ChampSim trace (or None, if past its end)."""
+    cf.seek(index * INST_SIZE)
+    bytearr = cf.read(INST_SIZE)
+    if len(bytearr) < INST_SIZE:
+        return None
+    return np.frombuffer(bytearr, dtype=INST_DTYPE)[0]
+
+
+def verify_traces(cf, lf, verifier, block_size=1 << 20, instr=None):
+    """Verify every load of the load trace, decoding the whole ChampSim trace in order.
+    The decode / parse / verify stages are timed with instr, if given.
+
+    Returns 'out_of_insts' if verification stopped at a load past the end
+    of the ChampSim trace, or None if every load was verified.
+    """
+    instr = instr or Instrumentation()
+    blocks = instr.timed('decode', get_instruction_blocks(cf, block_size), count=len)
+    block, block_start, num_insts = np.empty(0, dtype=INST_DTYPE), 0, 0
+    out_of_insts = False
+    for uiids, addrs, pcs in instr.timed('parse', get_load_arrays(lf), count=lambda a: len(a[0])):
+        insts = np.zeros(len(uiids), dtype=INST_DTYPE)
+        found = np.zeros(len(uiids), dtype=bool)
+
+        def gather(block, block_start):
+            idx = uiids - 1 - block_start
+            in_block = (idx >= 0) & (idx < len(block))
+            insts[in_block] = block[idx[in_block]]
+            found[in_block] = True
+
+        # Decode the ChampSim trace up to the last load of the chunk
+        gather(block, block_start)
+        while len(uiids) and num_insts < uiids.max():
+            block = next(blocks, None)
+            if block is None:
+                block = np.empty(0, dtype=INST_DTYPE)
+                out_of_insts = True
+                break
+            block_start, num_insts = num_insts, num_insts + len(block)
+            gather(block, block_start)
+
+        # Loads that go back before the current block (rare) need to seek
+        behind = np.flatnonzero(~found & (uiids <= block_start) & (uiids > 0))
+        if len(behind):
+            pos = cf.tell()
+            for i in behind.tolist():
+                inst = _read_instruction(cf, int(uiids[i]) - 1)
+                if inst is not None:
+                    insts[i], found[i] = inst, True
+            cf.seek(pos)
+
+        # Stop at the first load past the end of the ChampSim trace
+        past = uiids > num_insts if out_of_insts else np.zeros(len(uiids), dtype=bool)
+        if past.any():
+            stop = int(np.argmax(past))
+            uiids, addrs, pcs, insts, found = uiids[:stop], addrs[:stop], pcs[:stop], insts[:stop], found[:stop]
+
+        with instr.stage('verify'):
+            verifier.check(uiids, addrs, pcs, insts[found], found)
+        if past.any():
+            return 'out_of_insts'
+
+
+def verify_traces_sampled(cf, lf, verifier, sample_rate, seed=0):
+    """Verify a random sample (of about sample_rate) of the loads in the load trace,
+    seeking to each sampled load's instruction in the ChampSim trace.
+
+    Seeking is cheap for uncompressed ChampSim traces. For compressed
+    ones, it still skips decoding all the instructions in between.
+
+    Returns 'out_of_insts' if verification stopped at a sampled load past
+    the end of the ChampSim trace, or None if every sampled load was verified.
+    """
+    rng = np.random.default_rng(seed)
+    for uiids, addrs, pcs in get_load_arrays(lf):
+        sampled = rng.random(len(uiids)) < sample_rate
+        uiids, addrs, pcs = uiids[sampled], addrs[sampled], pcs[sampled]
+
+        insts = np.zeros(len(uiids), dtype=INST_DTYPE)
+        found = np.zeros(len(uiids), dtype=bool)
+        stop = None
+        for i, uiid in enumerate(uiids.tolist()):
+            inst = _read_instruction(cf, uiid - 1)
+            if inst is None and uiid > 0: # Past the end of the ChampSim trace
+                stop = i
+                break
+            if inst is not None:
+                insts[i], found[i] = inst, True
+        if stop is not None:
+            uiids, addrs, pcs, insts, found = uiids[:stop], addrs[:stop], pcs[:stop], insts[:stop], found[:stop]
+        verifier.check(uiids, addrs, pcs, insts[found], found)
+        if stop is not None:
+            return 'out_of_insts'